@@ -0,0 +1,224 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Check keyeval against reference samples, without Houdini
+
+Every channel in the reference file holds its keys and the value of the
+channel at a run of frames. The keys are read into a KeyCurve, evaluated
+with keyeval.evaluate and the largest difference per channel is reported.
+
+    python bench/check_evaluator.py
+    python bench/check_evaluator.py --reference captured.json
+
+Reference files are written by verify_evaluator.py --capture in hython,
+sampled with parm.evalAtFrame, and files from anywhere else are refused:
+
+    hython bench/verify_evaluator.py --capture bench/evaluator_reference.json
+
+--analytic checks against the straightforward definitions below instead
+(dense bezier sampling, polynomials solved per segment). Those are written
+from the same reading of the segment functions as keyeval, so they only
+catch slips in keyeval's array code, not a wrong reading of Houdini.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'keytar', 'scripts', 'python'))
+
+import numpy as np
+
+import keycurve
+import keyeval
+
+REFERENCE = os.path.join(HERE, 'evaluator_reference.json')
+
+EXPRESSIONS = ('constant()', 'linear()', 'qlinear()', 'cubic()', 'bezier()', 'spline()',
+               'ease()', 'easein()', 'easeout()', 'easeinp(3)', 'easeoutp(0.5)')
+
+KEY_FIELDS = ('frame', 'value', 'in_value', 'slope', 'in_slope', 'accel', 'in_accel')
+
+
+def reference_keys(expression, keys=8, seed=0):
+    """
+    Random values, slopes and accels, all using one segment function
+
+    Some accels are longer than the segments they start, to cover the
+    handle clamping.
+
+    @return: List of dicts with KEY_FIELDS and expression
+    """
+    rng = random.Random(seed)
+    result = []
+    frame = 1.0
+    for _ in range(keys):
+        key = {'frame': frame, 'value': rng.uniform(-10, 10),
+               'slope': rng.uniform(-20, 20), 'accel': rng.uniform(0.05, 1.5)}
+        if rng.random() < 0.3:
+            key['in_value'] = rng.uniform(-10, 10)
+            key['in_slope'] = rng.uniform(-20, 20)
+            key['in_accel'] = rng.uniform(0.05, 1.5)
+        else:
+            key['in_value'] = key['value']
+            key['in_slope'] = key['slope']
+            key['in_accel'] = key['accel']
+        key['expression'] = expression
+        result.append(key)
+        frame += rng.randint(2, 30)
+    return result
+
+
+def sample_frames(keys, samples=2):
+    """
+    Frames to sample, from a little before the first key to a little after the last
+    """
+    return np.arange(keys[0]['frame'] - 2, keys[-1]['frame'] + 2, 1.0 / samples)
+
+
+def to_curve(keys):
+    """
+    KeyCurve from reference keys
+    """
+    columns = dict((field, [key[field] for key in keys]) for field in KEY_FIELDS)
+    return keycurve.KeyCurve(expression=[key['expression'] for key in keys], **columns)
+
+
+def _analytic(keys, frame, fps):
+    """
+    Value at one frame, straight from the definitions of the segment functions
+    """
+    if frame <= keys[0]['frame']:
+        return keys[0]['value']
+    if frame >= keys[-1]['frame']:
+        return keys[-1]['value']
+
+    i = max(n for n, key in enumerate(keys) if key['frame'] <= frame)
+    k0, k1 = keys[i], keys[i + 1]
+    t0, t1 = k0['frame'], k1['frame']
+    v0, v1 = k0['value'], k1['in_value']
+    u = (frame - t0) / (t1 - t0)
+    name, argument = keyeval.parse_expression(k0['expression'])
+
+    if name == 'constant':
+        return v0
+    if name in ('linear', 'qlinear'):
+        return v0 + (v1 - v0) * u
+    if name == 'ease':
+        return v0 + (v1 - v0) * (3 * u ** 2 - 2 * u ** 3)
+    if name == 'easein':
+        return v0 + (v1 - v0) * u ** 2
+    if name == 'easeout':
+        return v0 + (v1 - v0) * (2 * u - u ** 2)
+    if name == 'easeinp':
+        return v0 + (v1 - v0) * u ** (2.0 if argument is None else argument)
+    if name == 'easeoutp':
+        return v0 + (v1 - v0) * (1 - (1 - u) ** (2.0 if argument is None else argument))
+
+    # slopes are per second
+    length = (t1 - t0) / fps
+    seconds = u * length
+    if name in ('cubic', 'spline'):
+        if name == 'cubic':
+            m0, m1 = k0['slope'], k1['in_slope']
+        else:
+            h = keys[max(i - 1, 0)]
+            k = keys[min(i + 2, len(keys) - 1)]
+            m0 = (k1['value'] - h['value']) / (k1['frame'] - h['frame']) * fps
+            m1 = (k['value'] - k0['value']) / (k['frame'] - k0['frame']) * fps
+        # a + b t + c t^2 + d t^3 through both ends with both slopes
+        matrix = [[1, 0, 0, 0],
+                  [1, length, length ** 2, length ** 3],
+                  [0, 1, 0, 0],
+                  [0, 1, 2 * length, 3 * length ** 2]]
+        a, b, c, d = np.linalg.solve(matrix, [v0, v1, m0, m1])
+        return a + b * seconds + c * seconds ** 2 + d * seconds ** 3
+    if name == 'bezier':
+        # control points in seconds, handles cut at the segment ends
+        h0 = min(max(k0['accel'], 0.0), length)
+        h1 = min(max(k1['in_accel'], 0.0), length)
+        xs = np.array([0.0, h0, length - h1, length])
+        ys = np.array([v0, v0 + k0['slope'] * h0, v1 - k1['in_slope'] * h1, v1])
+        s = np.linspace(0.0, 1.0, 200001)
+        basis = np.array([(1 - s) ** 3, 3 * (1 - s) ** 2 * s, 3 * (1 - s) * s ** 2, s ** 3])
+        return float(np.interp(seconds, xs.dot(basis), ys.dot(basis)))
+    raise ValueError("no definition for %r" % k0['expression'])
+
+
+def analytic(fps=24.0):
+    """
+    Channels like verify_evaluator.py captures, sampled with the definitions in _analytic
+    """
+    channels = []
+    for seed, expression in enumerate(EXPRESSIONS):
+        keys = reference_keys(expression, seed=seed)
+        frames = sample_frames(keys)
+        channels.append({
+            'label': expression,
+            'keys': keys,
+            'frames': frames.tolist(),
+            'values': [_analytic(keys, f, fps) for f in frames],
+        })
+    return {'source': 'analytic definitions, check_evaluator.py --analytic',
+            'fps': fps, 'channels': channels}
+
+
+def check(channel, fps):
+    """
+    Largest difference between keyeval and a reference channel
+
+    @return: (max error, samples compared)
+    """
+    curve = to_curve(channel['keys']).sorted()
+    frames = np.array(channel['frames'], dtype=np.float64)
+    theirs = np.array(channel['values'], dtype=np.float64)
+    ours = keyeval.evaluate(curve, frames, fps)
+    if len(ours) != len(theirs) or np.isnan(ours).any():
+        return float('inf'), len(frames)
+    return float(np.abs(ours - theirs).max()), len(frames)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reference', default=REFERENCE,
+                        help='reference file to check against (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=1e-6,
+                        help='largest difference that counts as a match (default: %(default)s)')
+    parser.add_argument('--analytic', action='store_true',
+                        help='check against the analytic definitions instead, not a Houdini reference')
+    args = parser.parse_args(argv)
+
+    if args.analytic:
+        reference = analytic()
+    elif not os.path.exists(args.reference):
+        print('no reference at %s, capture one in hython with\n'
+              '    hython bench/verify_evaluator.py --capture %s' % (args.reference, args.reference))
+        return 2
+    else:
+        with open(args.reference) as f:
+            reference = json.load(f)
+        if not reference.get('source', '').startswith('Houdini'):
+            print('%s was not captured from Houdini (%s), recapture it with verify_evaluator.py --capture'
+                  % (args.reference, reference.get('source', 'unknown')))
+            return 2
+    print('reference:', reference['source'])
+
+    failed = 0
+    for channel in reference['channels']:
+        error, count = check(channel, reference['fps'])
+        ok = error <= args.tolerance
+        failed += not ok
+        print('%-40s %6d samples  max error %.3g  %s' % (channel['label'], count, error,
+                                                         'ok' if ok else 'MISMATCH'))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,423 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Check transformkeys against the per key implementation it replaced
+
+legacy_transform below is transformKeyframes as it was before the KeyCurve
+rewrite, working key by key through hou calls (only its debug prints are
+left out). Every case is run through both on the same fake scene and the
+keys left behind are compared - every autopivot and a manual pivot, with
+and without snapframe and ripple, scales, translates and both flips.
+
+    python bench/check_transform.py
+    python bench/check_transform.py --speed 1000000 --output transform_speed.json
+
+With --speed, both are also timed transforming that many selected keys
+(1000 channels of equal length), along with the hou calls and channel edits
+each makes and the time the array maths takes on its own. The speedup is
+reported, and written out as json with --output.
+
+The rewrite set out to fix a few things the per key code got wrong, and
+the check works around those rather than reporting them:
+
+ - translate Y was applied twice, so legacy_transform is given half of it
+ - flat selections (every value the same) divided by zero. No case has one
+ - rippled keys moving onto each other overwrote one another, one key at a
+   time. The scenes have one key on either side of the selection, far enough
+   out that rippling them can't land on anything
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'fakehou'))
+sys.path.insert(0, os.path.join(HERE, '..', 'keytar', 'scripts', 'python'))
+
+import hou
+import scenes
+
+import keycurve_hou
+import keytransform
+import transformkeys
+from channelscope import scope_resolver
+
+# hou.Keyframe getters compared between the two
+KEY_GETTERS = ('frame', 'value', 'inValue', 'slope', 'inSlope', 'accel', 'inAccel',
+               'isSlopeAuto', 'isInSlopeAuto', 'expression')
+
+# (label, scalex, scaley, translatex, translatey) of each case, the flips as TransformKeysUi.flip makes them
+TRANSFORMS = (
+    ('scale', 2.0, 1.5, 0.0, 0.0),
+    ('shrink', 0.5, 0.25, 0.0, 0.0),
+    ('translate', 1.0, 1.0, 5.0, 0.75),
+    ('scale and translate', 1.5, 0.5, -3.0, -2.0),
+    ('flip vertical', 1.0, -1.0, 0.0, 0.0),
+    ('flip horizontal', -1.0, 1.0, 0.0, 0.0),
+)
+
+# keys per channel in the check scenes. odd, so selecting every other key
+# selects the last one too
+KEYS = 25
+
+# frames between the selection and the keys either side of it
+OUTER = 1000
+
+# hou.Parm methods that edit a channel's keys
+CHANNEL_EDITS = ('setKeyframe', 'setKeyframes', 'deleteKeyframeAtFrame', 'deleteAllKeyframes')
+
+# manual pivot, used when autopivot isn't one of keytransform.AUTOPIVOTS
+MANUAL_PIVOT = (7.0, 0.25)
+
+
+def legacy_transform(keyframes, scalex=1.0, scaley=1.0,
+                     translatex=0.0, translatey=0.0,
+                     pivotx=None, pivoty=None,
+                     autopivot='mm',
+                     ripple=True,
+                     snapframe=True
+                     ):
+    xmin = 99999999999999
+    xmax = -99999999999999
+
+    ymin = 99999999999999
+    ymax = -99999999999999
+
+    for parm in keyframes.keys():
+        for key in keyframes[parm]:
+            xmin = min(xmin, key.frame())
+            xmax = max(xmax, key.frame())
+
+            ymin = min(ymin, key.value())
+            ymax = max(ymax, key.value())
+
+    pivotx_mid = (xmax - xmin) / 2 + xmin
+    pivoty_mid = (ymax - ymin) / 2 + ymin
+
+    if autopivot == 'tl':
+        # top left
+        pivotx = xmin
+        pivoty = ymax
+
+    elif autopivot == 'tm':
+        # top middle
+        pivotx = pivotx_mid
+        pivoty = ymax
+
+    elif autopivot == 'tr':
+        # top right
+        pivotx = xmax
+        pivoty = ymax
+
+    elif autopivot == 'ml':
+        # middle left
+        pivotx = xmin
+        pivoty = pivoty_mid
+
+    elif autopivot == 'mm':
+        # middle middle
+        pivotx = pivotx_mid
+        pivoty = pivoty_mid
+
+    elif autopivot == 'mr':
+        # middle right
+        pivotx = xmax
+        pivoty = pivoty_mid
+
+    elif autopivot == 'bl':
+        # bottom left
+        pivotx = xmin
+        pivoty = ymin
+
+    elif autopivot == 'bm':
+        # bottom middle
+        pivotx = pivotx_mid
+        pivoty = ymin
+
+    elif autopivot == 'br':
+        # bottom right
+        pivotx = xmax
+        pivoty = ymin
+    else:
+        pivotx = pivotx or 0
+        pivoty = pivoty or 0
+
+    if xmin == xmax:
+        raise RuntimeError("gotta select a bigger time range")
+
+    xmin_pvt = xmin - pivotx
+    xmax_pvt = xmax - pivotx
+
+    xmin_scaled = xmin_pvt * scalex + translatex
+    xmax_scaled = xmax_pvt * scalex + translatex
+    xmin_diff = xmin_scaled - xmin_pvt
+    xmax_diff = xmax_scaled - xmax_pvt
+
+    ymin_pvt = ymin - pivoty
+    ymax_pvt = ymax - pivoty
+
+    ymin_scaled = ymin_pvt * scaley + translatey
+    ymax_scaled = ymax_pvt * scaley + translatey
+
+    for parm in keyframes.keys():
+        if ripple:
+            # you dont want to ripple if you're scaling negative. bad times
+            if scalex > 0:
+
+                before = parm.keyframesBefore(xmin - 1)
+                for key in before:
+                    parm.deleteKeyframeAtFrame(key.frame())
+
+                    newframe = key.frame() + xmin_diff
+                    if snapframe:
+                        newframe = round(newframe)
+
+                    key.setFrame(newframe)
+                    parm.setKeyframe(key)
+
+                after = parm.keyframesAfter(xmax + 1)
+
+                for key in after:
+                    parm.deleteKeyframeAtFrame(key.frame())
+
+                    newframe = key.frame() + xmax_diff
+                    if snapframe:
+                        newframe = round(newframe)
+
+                    key.setFrame(newframe)
+                    parm.setKeyframe(key)
+
+        for key in keyframes[parm]:
+            # first run - delete the target keys from the parm
+            parm.deleteKeyframeAtFrame(key.frame())
+
+        for key in keyframes[parm]:
+            # second run - apply the key at a modified time
+            xvalue = key.frame()
+
+            xvalue_pvt = xvalue - pivotx
+            yvalue_pvt = key.value() - pivoty
+
+            # https://stackoverflow.com/a/929107
+            # NewValue = (((OldValue - OldMin) * (NewMax - NewMin)) / (OldMax - OldMin)) + NewMin
+            new_xvalue = ((xvalue_pvt - xmin_pvt) * (xmax_scaled - xmin_scaled)) / (xmax_pvt - xmin_pvt) + xmin_scaled
+            new_xvalue += pivotx
+
+            new_yvalue = ((yvalue_pvt - ymin_pvt) * (ymax_scaled - ymin_scaled)) / (ymax_pvt - ymin_pvt) + ymin_scaled
+            new_yvalue += pivoty
+            key.setValue(new_yvalue + translatey)
+
+            if snapframe:
+                new_xvalue = round(new_xvalue)
+            key.setFrame(new_xvalue)
+
+            if key.isSlopeAuto() is False:
+                key.setAccel(key.accel() * scalex)
+                # key.setInAccel(key.inAccel() * scalex)
+
+                key.setSlope(key.slope() * scaley)
+
+            else:
+                # re-auto the keys
+                key.setSlope(0)
+                key.setSlopeAuto(True)
+                key.setInSlopeAuto(True)
+            parm.setKeyframe(key)
+
+
+def scene(channels, keys, every=2):
+    """
+    Fresh scene with keys selected on every channel
+
+    Every channel has a run of keys on consecutive frames, with every n-th
+    one selected starting with the first, and one more key OUTER frames
+    either side of the run to ripple.
+
+    @param every: Select every n-th key of the run
+    @return: Dict of hou.Parm to its selected hou.Keyframes, as transformKeyframes takes them
+    """
+    hou.hipFile.clear()
+    parms = scenes.animated_nodes(channels, keys, manual=0.5)
+    selection = {}
+    for parm in parms:
+        selection[parm] = parm.keyframes()[::every]
+        keys = parm.keyframes()
+        first, last = keys[0], keys[-1]
+        first.setFrame(first.frame() - OUTER)
+        last.setFrame(last.frame() + OUTER)
+        parm.setKeyframes([first, last])
+    hou.setSelectedKeyframes(selection)
+    return scope_resolver.selected_keyframes()
+
+
+def scene_keys():
+    """
+    Every key left in the scene, by parm path
+    """
+    result = {}
+    for node in hou.node('/').allSubChildren():
+        for parm in node.parms():
+            keys = parm.keyframes()
+            if keys:
+                result[parm.path()] = [tuple(getattr(key, getter)() for getter in KEY_GETTERS) for key in keys]
+    return result
+
+
+def _close(a, b):
+    if isinstance(a, float) and isinstance(b, float):
+        return abs(a - b) <= 1e-9 * max(1.0, abs(a), abs(b))
+    return a == b
+
+
+def differences(theirs, ours):
+    """
+    Getters that differ between two scene_keys results
+
+    @return: Dict of getter name to the number of keys it differs on. Channels
+             with a different number of keys count under 'keys'
+    """
+    result = {}
+    for path in sorted(set(theirs) | set(ours)):
+        a, b = theirs.get(path, []), ours.get(path, [])
+        if len(a) != len(b):
+            result['keys'] = result.get('keys', 0) + 1
+            continue
+        for key_a, key_b in zip(a, b):
+            for getter, x, y in zip(KEY_GETTERS, key_a, key_b):
+                if not _close(x, y):
+                    result[getter] = result.get(getter, 0) + 1
+    return result
+
+
+def cases():
+    """
+    (label, keyword arguments) of every case to check
+    """
+    for autopivot in keytransform.AUTOPIVOTS + ('manual',):
+        for label, scalex, scaley, translatex, translatey in TRANSFORMS:
+            for snapframe in (True, False):
+                for ripple in (True, False):
+                    kwargs = dict(scalex=scalex, scaley=scaley, translatex=translatex, translatey=translatey,
+                                  autopivot=autopivot, ripple=ripple, snapframe=snapframe)
+                    if autopivot == 'manual':
+                        kwargs['pivotx'], kwargs['pivoty'] = MANUAL_PIVOT
+                    yield ('%-6s %-20s snap %-5s ripple %-5s' % (autopivot, label, snapframe, ripple)), kwargs
+
+
+def run(func, keyframes, kwargs):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = timeit.default_timer()
+        func(keyframes, **kwargs)
+        return timeit.default_timer() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def check(channels=12, keys=KEYS):
+    """
+    Run every case through both implementations
+
+    @return: Number of cases that differ
+    """
+    failed = 0
+    for label, kwargs in cases():
+        # the per key code applied translate Y twice
+        legacy_kwargs = dict(kwargs, translatey=kwargs['translatey'] / 2.0)
+        run(legacy_transform, scene(channels, keys), legacy_kwargs)
+        theirs = scene_keys()
+        run(transformkeys.transformKeyframes, scene(channels, keys), kwargs)
+        ours = scene_keys()
+
+        diff = differences(theirs, ours)
+        failed += bool(diff)
+        print('%s  %s' % (label, ', '.join('%s on %d keys' % item for item in sorted(diff.items())) or 'same'))
+    return failed
+
+
+def engine_seconds(keyframes, kwargs):
+    """
+    Time just the array maths of transformKeyframes, on curves read beforehand
+
+    @param keyframes: Dict of hou.Parm to its selected hou.Keyframes
+    @param kwargs: The transform, as given to transformKeyframes
+    """
+    curves = [keycurve_hou.read_parm(parm) for parm in keyframes]
+    selections = [curve.find([key.frame() for key in keyframes[parm]]) for parm, curve in zip(keyframes, curves)]
+
+    start = timeit.default_timer()
+    batch = keytransform.CurveBatch(curves, selections)
+    bounds = batch.bounds()
+    pivot = keytransform.resolve_pivot(bounds, kwargs['autopivot'], kwargs.get('pivotx'), kwargs.get('pivoty'))
+    keytransform.transform_batch(batch, bounds, pivot, scalex=kwargs['scalex'], scaley=kwargs['scaley'],
+                                 translatex=kwargs.get('translatex', 0.0), translatey=kwargs.get('translatey', 0.0),
+                                 ripple=kwargs['ripple'], snapframe=kwargs['snapframe'])
+    return timeit.default_timer() - start
+
+
+def speed(keys, channels=1000):
+    """
+    Time both implementations on one selection of keys
+
+    Besides the time taken, the hou calls each makes are counted, and how
+    many of them edit a channel - in Houdini every one of those is recorded
+    for undo and dirties the channel. The fake hou makes every call cost the
+    same, so the array maths is also timed on its own.
+
+    @return: Dict of the timings, call counts and speedups
+    """
+    per_channel = max(keys // channels, 2)
+    kwargs = dict(scalex=1.5, scaley=0.5, autopivot='mm', ripple=True, snapframe=True)
+    result = {'channels': channels, 'keys_per_channel': per_channel}
+
+    for prefix, func in (('legacy_', legacy_transform), ('', transformkeys.transformKeyframes)):
+        keyframes = scene(channels, per_channel, every=1)
+        result['keys_selected'] = sum(len(selected) for selected in keyframes.values())
+        hou.calls.clear()
+        result[prefix + 'seconds'] = run(func, keyframes, kwargs)
+        result[prefix + 'hou_calls'] = sum(hou.calls.values())
+        result[prefix + 'channel_edits'] = sum(hou.calls['Parm.' + name] for name in CHANNEL_EDITS)
+    result['speedup'] = result['legacy_seconds'] / result['seconds']
+
+    keyframes = scene(channels, per_channel, every=1)
+    result['engine_seconds'] = engine_seconds(keyframes, kwargs)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--speed', type=int, metavar='KEYS',
+                        help='also time both on this many keys, eg. 1000000')
+    parser.add_argument('--output', help='write the timings to this json file')
+    args = parser.parse_args(argv)
+
+    failed = check()
+
+    if args.speed:
+        result = speed(args.speed)
+        print('%d keys (%d selected):' % (result['channels'] * result['keys_per_channel'], result['keys_selected']))
+        print('  per key  %.3fs, %d hou calls, %d channel edits' % (
+            result['legacy_seconds'], result['legacy_hou_calls'], result['legacy_channel_edits']))
+        print('  batched  %.3fs, %d hou calls, %d channel edits, %.3fs of it array maths' % (
+            result['seconds'], result['hou_calls'], result['channel_edits'], result['engine_seconds']))
+        print('  %.1fx faster' % result['speedup'])
+        if args.output:
+            result.update(python=platform.python_version(), platform=platform.platform())
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+
+    print('%d cases differ' % failed)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
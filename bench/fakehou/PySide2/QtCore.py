@@ -0,0 +1,54 @@
+"""
+Inert QtCore stand in, see the package docstring
+"""
+
+
+class Qt(object):
+    Tool = 0
+    Horizontal = 1
+    Vertical = 2
+    Checked = 2
+    Unchecked = 0
+
+
+class Signal(object):
+    def __init__(self, *args):
+        self._slots = []
+
+    def connect(self, slot):
+        self._slots.append(slot)
+
+    def emit(self, *args):
+        for slot in self._slots:
+            slot(*args)
+
+
+class QObject(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class QTimer(QObject):
+    def __init__(self, *args, **kwargs):
+        super(QTimer, self).__init__()
+        self.timeout = Signal()
+        self._active = False
+
+    def setSingleShot(self, on):
+        pass
+
+    def setInterval(self, msec):
+        pass
+
+    def start(self, *args):
+        self._active = True
+
+    def stop(self):
+        self._active = False
+
+    def isActive(self):
+        return self._active
+
+    @staticmethod
+    def singleShot(msec, slot):
+        slot()
@@ -0,0 +1,3 @@
+"""
+Inert QtGui stand in, see the package docstring
+"""
@@ -0,0 +1,40 @@
+"""
+Inert QtWidgets stand in, see the package docstring
+"""
+
+
+class _Widget(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        # signals and every other method are no-ops
+        return _Inert()
+
+
+class _Inert(object):
+    def __call__(self, *args, **kwargs):
+        return _Inert()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Inert()
+
+
+QWidget = QDialog = QLineEdit = QLabel = QPushButton = QCheckBox = _Widget
+QComboBox = QSpinBox = QDoubleSpinBox = QSlider = QRadioButton = QGroupBox = _Widget
+QHBoxLayout = QVBoxLayout = QGridLayout = QSpacerItem = _Widget
+
+
+class QSizePolicy(object):
+    Minimum = 0
+    Expanding = 1
+
+
+class QMessageBox(object):
+    @staticmethod
+    def warning(*args):
+        pass
@@ -0,0 +1,6 @@
+"""
+Just enough of PySide2 for the keytar modules to import outside of Houdini
+
+Widgets accept anything and do nothing, the benchmarks drive the tools
+through their functions rather than through the UI.
+"""
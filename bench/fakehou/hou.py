@@ -0,0 +1,1116 @@
+# -*- coding: UTF-8 -*-
+
+"""
+A small, in-process stand in for Houdini's hou module
+
+Only covers what the keytar tools use - parms and keyframes, object nodes and
+their transforms, matrices and vectors, the chkey / chscope hscript commands,
+undo groups and the playbar. It is meant for timing and regression checks
+outside of a Houdini session, not as a faithful simulation:
+
+ - channels evaluate linearly between keys whatever their segment function
+ - object transforms are built from the t, r and s parms only
+ - every hou call is counted in hou.calls, so tools can be compared by the
+   number of round trips they make
+
+Call hipFile.clear() to start a new scene.
+
+"""
+
+import bisect
+import collections
+import math
+import shlex
+
+import numpy as np
+
+calls = collections.Counter()
+
+_state = {
+    'frame': 1.0,
+    'fps': 24.0,
+    'playbar_range': (1.0, 240.0),
+    'playbar_selection': None,
+    'scope': [],
+    'selected_nodes': [],
+    'selected_keyframes': {},
+    'undo_groups': [],
+    'undo_disabled': 0,
+    # 'undo' or 'redo' while one is being performed
+    'undoing': None,
+    'cooks': 0,
+    # progress fraction at which InterruptableOperation acts as if cancelled
+    'interrupt_at': None,
+}
+
+
+def _counted(cls):
+    """
+    Class decorator counting calls to every public method in hou.calls
+    """
+    for name, attr in list(vars(cls).items()):
+        if name.startswith('_') or not callable(attr):
+            continue
+        setattr(cls, name, _counter('%s.%s' % (cls.__name__, name), attr))
+    return cls
+
+
+def _counter(name, func):
+    def wrapper(*args, **kwargs):
+        calls[name] += 1
+        return func(*args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def _count(name):
+    calls[name] += 1
+
+
+class OperationFailed(Exception):
+    pass
+
+
+class OperationInterrupted(Exception):
+    pass
+
+
+class ObjectWasDeleted(Exception):
+    pass
+
+
+class exprLanguage(object):
+    Hscript = 'hscript'
+    Python = 'python'
+
+
+class paneTabType(object):
+    ChannelEditor = 'ChannelEditor'
+    SceneViewer = 'SceneViewer'
+
+
+class nodeEventType(object):
+    ParmTupleChanged = 'ParmTupleChanged'
+    BeingDeleted = 'BeingDeleted'
+    NameChanged = 'NameChanged'
+    ChildCreated = 'ChildCreated'
+
+
+class nodeTypeFilter(object):
+    ObjCamera = 'ObjCamera'
+
+
+# TIME
+
+def frame():
+    _count('frame')
+    return _state['frame']
+
+
+def setFrame(value):
+    _count('setFrame')
+    # every frame change cooks the scene in houdini
+    _state['cooks'] += 1
+    _state['frame'] = float(value)
+
+
+def time():
+    _count('time')
+    return frameToTime(_state['frame'])
+
+
+def fps():
+    return _state['fps']
+
+
+def frameToTime(value):
+    return (value - 1.0) / _state['fps']
+
+
+def timeToFrame(value):
+    return value * _state['fps'] + 1.0
+
+
+class playbar(object):
+    @staticmethod
+    def selectionRange():
+        _count('playbar.selectionRange')
+        return _state['playbar_selection']
+
+    @staticmethod
+    def setSelectionRange(value):
+        _state['playbar_selection'] = tuple(value) if value else None
+
+    @staticmethod
+    def frameRange():
+        _count('playbar.frameRange')
+        return _state['playbar_range']
+
+    @staticmethod
+    def setFrameRange(start, end):
+        _state['playbar_range'] = (float(start), float(end))
+
+
+# UNDO
+
+class _UndoGroup(object):
+    def __init__(self, label):
+        self.label = label
+
+    def __enter__(self):
+        _state['undo_groups'].append(self.label)
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class _UndoDisabler(object):
+    def __enter__(self):
+        _state['undo_disabled'] += 1
+        return self
+
+    def __exit__(self, *args):
+        _state['undo_disabled'] -= 1
+        return False
+
+
+class undos(object):
+    @staticmethod
+    def group(label):
+        _count('undos.group')
+        return _UndoGroup(label)
+
+    @staticmethod
+    def disabler():
+        _count('undos.disabler')
+        return _UndoDisabler()
+
+    @staticmethod
+    def areEnabled():
+        return not _state['undo_disabled']
+
+    @staticmethod
+    def performingUndo():
+        return _state['undoing'] == 'undo'
+
+    @staticmethod
+    def performingRedo():
+        return _state['undoing'] == 'redo'
+
+
+class InterruptableOperation(object):
+    def __init__(self, operation_name, long_operation_name=None, open_interrupt_dialog=False):
+        _count('InterruptableOperation')
+        self.operation_name = operation_name
+        self.long_operation_name = long_operation_name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def _progress(self, fraction):
+        _count('InterruptableOperation.updateProgress')
+        if _state['interrupt_at'] is not None and fraction >= _state['interrupt_at']:
+            raise OperationInterrupted('cancelled')
+
+    def updateProgress(self, percentage=-1.0):
+        self._progress(percentage)
+
+    def updateLongProgress(self, percentage=-1.0, long_op_status=None):
+        self._progress(percentage)
+
+
+# MATHS
+
+@_counted
+class Vector3(object):
+    def __init__(self, *args):
+        if len(args) == 1:
+            args = args[0]
+        if len(args) == 0:
+            args = (0.0, 0.0, 0.0)
+        self._v = [float(x) for x in args]
+        if len(self._v) != 3:
+            raise ValueError("Vector3 needs 3 components")
+
+    def __getitem__(self, index):
+        return self._v[index]
+
+    def __setitem__(self, index, value):
+        self._v[index] = float(value)
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        return iter(self._v)
+
+    def __repr__(self):
+        return '<hou.Vector3 [%g, %g, %g]>' % tuple(self._v)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __add__(self, other):
+        return Vector3([a + b for a, b in zip(self, other)])
+
+    def __sub__(self, other):
+        return Vector3([a - b for a, b in zip(self, other)])
+
+    def __mul__(self, other):
+        _count('Vector3.__mul__')
+        if isinstance(other, Matrix4):
+            x, y, z = self._v
+            row = np.dot([x, y, z, 1.0], other._m)
+            if row[3] != 0 and row[3] != 1:
+                row = row / row[3]
+            return Vector3(row[:3])
+        return Vector3([a * other for a in self._v])
+
+    def x(self):
+        return self._v[0]
+
+    def y(self):
+        return self._v[1]
+
+    def z(self):
+        return self._v[2]
+
+    def length(self):
+        return math.sqrt(sum(a * a for a in self._v))
+
+
+@_counted
+class Matrix4(object):
+    def __init__(self, values=1.0):
+        if isinstance(values, (int, float)):
+            self._m = np.identity(4) * float(values)
+        else:
+            self._m = np.array(values, dtype=np.float64).reshape(4, 4)
+
+    def __mul__(self, other):
+        _count('Matrix4.__mul__')
+        return Matrix4(np.dot(self._m, other._m))
+
+    def __repr__(self):
+        return '<hou.Matrix4 %s>' % (self.asTupleOfTuples(),)
+
+    def at(self, row, col):
+        return float(self._m[row, col])
+
+    def setAt(self, row, col, value):
+        self._m[row, col] = value
+
+    def inverted(self):
+        return Matrix4(np.linalg.inv(self._m))
+
+    def transposed(self):
+        return Matrix4(self._m.T)
+
+    def asTuple(self):
+        return tuple(float(x) for x in self._m.reshape(-1))
+
+    def asTupleOfTuples(self):
+        return tuple(tuple(float(x) for x in row) for row in self._m)
+
+    def setToIdentity(self):
+        self._m = np.identity(4)
+
+    def setToPerspective(self, zoom, image_aspect=1, pixel_aspect=1,
+                         clip_near=0, clip_far=1,
+                         window_xmin=0, window_xmax=1,
+                         window_ymin=0, window_ymax=1):
+        # row vector projection, w comes out as -z so points on the z = -1
+        # plane keep w = 1
+        near = max(clip_near, 1e-6)
+        far = clip_far
+        m = np.zeros((4, 4))
+        m[0, 0] = 2.0 * zoom / (window_xmax - window_xmin)
+        m[1, 1] = 2.0 * zoom * image_aspect / pixel_aspect / (window_ymax - window_ymin)
+        m[2, 2] = (far + near) / (near - far)
+        m[2, 3] = -1.0
+        m[3, 2] = 2.0 * far * near / (near - far)
+        self._m = m
+
+    def extractTranslates(self):
+        return Vector3(self._m[3, :3])
+
+
+class hmath(object):
+    @staticmethod
+    def identityTransform():
+        return Matrix4()
+
+    @staticmethod
+    def buildScale(x, y=None, z=None):
+        _count('hmath.buildScale')
+        if y is None:
+            x, y, z = x
+        return Matrix4(np.diag([x, y, z, 1.0]))
+
+    @staticmethod
+    def buildTranslate(x, y=None, z=None):
+        _count('hmath.buildTranslate')
+        if y is None:
+            x, y, z = x
+        m = np.identity(4)
+        m[3, :3] = (x, y, z)
+        return Matrix4(m)
+
+    @staticmethod
+    def buildRotate(x, y=None, z=None):
+        _count('hmath.buildRotate')
+        if y is None:
+            x, y, z = x
+        rx, ry, rz = [math.radians(a) for a in (x, y, z)]
+        mx = np.array([[1, 0, 0, 0], [0, math.cos(rx), math.sin(rx), 0],
+                       [0, -math.sin(rx), math.cos(rx), 0], [0, 0, 0, 1]])
+        my = np.array([[math.cos(ry), 0, -math.sin(ry), 0], [0, 1, 0, 0],
+                       [math.sin(ry), 0, math.cos(ry), 0], [0, 0, 0, 1]])
+        mz = np.array([[math.cos(rz), math.sin(rz), 0, 0], [-math.sin(rz), math.cos(rz), 0, 0],
+                       [0, 0, 1, 0], [0, 0, 0, 1]])
+        return Matrix4(np.dot(np.dot(mx, my), mz))
+
+
+# KEYFRAMES
+
+@_counted
+class Keyframe(object):
+    # slots keep the scenes of the biggest benchmark sizes in memory
+    __slots__ = ('_frame', '_value', '_in_value', '_slope', '_in_slope', '_accel', '_in_accel',
+                 '_slope_auto', '_in_slope_auto', '_expression', '_language')
+
+    def __init__(self, value=None, time=None):
+        self._frame = timeToFrame(time) if time is not None else 0.0
+        self._value = float(value) if value is not None else 0.0
+        self._in_value = None
+        self._slope = 0.0
+        self._in_slope = None
+        self._accel = 1.0 / 3.0
+        self._in_accel = None
+        self._slope_auto = False
+        self._in_slope_auto = False
+        self._expression = 'bezier()'
+        self._language = exprLanguage.Hscript
+
+    def __repr__(self):
+        return '<hou.Keyframe frame %g value %g>' % (self._frame, self._value)
+
+    def _copy(self):
+        key = Keyframe.__new__(Keyframe)
+        key._frame = self._frame
+        key._value = self._value
+        key._in_value = self._in_value
+        key._slope = self._slope
+        key._in_slope = self._in_slope
+        key._accel = self._accel
+        key._in_accel = self._in_accel
+        key._slope_auto = self._slope_auto
+        key._in_slope_auto = self._in_slope_auto
+        key._expression = self._expression
+        key._language = self._language
+        return key
+
+    def frame(self):
+        return self._frame
+
+    def setFrame(self, value):
+        self._frame = float(value)
+
+    def time(self):
+        return frameToTime(self._frame)
+
+    def setTime(self, value):
+        self._frame = timeToFrame(value)
+
+    def value(self):
+        return self._value
+
+    def setValue(self, value):
+        self._value = float(value)
+
+    def inValue(self):
+        return self._value if self._in_value is None else self._in_value
+
+    def setInValue(self, value):
+        self._in_value = float(value)
+
+    def isValueTied(self):
+        return self._in_value is None
+
+    def slope(self):
+        return self._slope
+
+    def setSlope(self, value):
+        self._slope = float(value)
+        self._slope_auto = False
+
+    def inSlope(self):
+        return self._slope if self._in_slope is None else self._in_slope
+
+    def setInSlope(self, value):
+        self._in_slope = float(value)
+        self._in_slope_auto = False
+
+    def isSlopeTied(self):
+        return self._in_slope is None
+
+    def isSlopeAuto(self):
+        return self._slope_auto
+
+    def setSlopeAuto(self, on):
+        self._slope_auto = bool(on)
+
+    def isInSlopeAuto(self):
+        return self._in_slope_auto
+
+    def setInSlopeAuto(self, on):
+        self._in_slope_auto = bool(on)
+
+    def accel(self):
+        return self._accel
+
+    def setAccel(self, value):
+        self._accel = float(value)
+
+    def inAccel(self):
+        return self._accel if self._in_accel is None else self._in_accel
+
+    def setInAccel(self, value):
+        self._in_accel = float(value)
+
+    def isAccelTied(self):
+        return self._in_accel is None
+
+    def expression(self):
+        return self._expression
+
+    def expressionLanguage(self):
+        return self._language
+
+    def setExpression(self, expression, language=None):
+        self._expression = expression
+        if language is not None:
+            self._language = language
+
+
+class _ParmTemplate(object):
+    def __init__(self, defaults):
+        self._defaults = tuple(defaults)
+
+    def defaultValue(self):
+        return self._defaults
+
+
+@_counted
+class Parm(object):
+    def __init__(self, node, name, value=0.0, tuple_=None, index=0, default=0.0):
+        self._node = node
+        self._name = name
+        self._value = float(value)
+        self._keys = []
+        # frame of each key in _keys, kept alongside so lookups don't rebuild it
+        self._key_frames = []
+        self._tuple = tuple_
+        self._index = index
+        self._default = float(default)
+        self._selected = True
+
+    def __repr__(self):
+        return '<hou.Parm %s in %s>' % (self._name, self._node.path())
+
+    def name(self):
+        return self._name
+
+    def path(self):
+        return '%s/%s' % (self._node.path(), self._name)
+
+    def node(self):
+        return self._node
+
+    def tuple(self):
+        return self._tuple
+
+    def componentIndex(self):
+        return self._index
+
+    def parmTemplate(self):
+        defaults = [p._default for p in self._tuple] if self._tuple else [self._default]
+        return _ParmTemplate(defaults)
+
+    def isSelected(self):
+        return self._selected
+
+    def setSelected(self, on):
+        self._selected = bool(on)
+
+    def isTimeDependent(self):
+        return bool(self._keys)
+
+    # keyframes are stored sorted by frame, and handed out as copies just like
+    # houdini does
+
+    def _find(self, value):
+        index = bisect.bisect_left(self._key_frames, value)
+        if index < len(self._keys) and self._keys[index]._frame == value:
+            return index
+        return None
+
+    def keyframes(self):
+        return tuple(key._copy() for key in self._keys)
+
+    def keyframesBefore(self, value):
+        end = bisect.bisect_right(self._key_frames, value)
+        return tuple(key._copy() for key in self._keys[:end])
+
+    def keyframesAfter(self, value):
+        start = bisect.bisect_left(self._key_frames, value)
+        return tuple(key._copy() for key in self._keys[start:])
+
+    def keyframesInRange(self, start, end):
+        frames = self._key_frames
+        return tuple(key._copy() for key in
+                     self._keys[bisect.bisect_left(frames, start):bisect.bisect_right(frames, end)])
+
+    def _insert(self, key):
+        key = key._copy()
+        frames = self._key_frames
+        index = bisect.bisect_left(frames, key._frame)
+        if index < len(frames) and frames[index] == key._frame:
+            self._keys[index] = key
+        else:
+            self._keys.insert(index, key)
+            frames.insert(index, key._frame)
+
+    def _merge(self, keys):
+        # many keys at once, merged with one sort rather than one insert each.
+        # later keys win on the same frame, like inserting them in order
+        merged = dict(zip(self._key_frames, self._keys))
+        for key in keys:
+            merged[key._frame] = key._copy()
+        self._key_frames = sorted(merged)
+        self._keys = [merged[frame_] for frame_ in self._key_frames]
+
+    def _changed(self):
+        self._node._event(nodeEventType.ParmTupleChanged, parm_tuple=self._tuple)
+
+    def setKeyframe(self, key):
+        self._insert(key)
+        self._changed()
+
+    def setKeyframes(self, keys):
+        keys = list(keys)
+        if len(keys) > 16 and len(keys) * 8 > len(self._keys):
+            self._merge(keys)
+        else:
+            for key in keys:
+                self._insert(key)
+        self._changed()
+
+    def deleteKeyframeAtFrame(self, value):
+        index = self._find(value)
+        if index is not None:
+            current = self._evaluate(_state['frame'])
+            del self._keys[index]
+            del self._key_frames[index]
+            if not self._keys:
+                self._value = current
+            self._changed()
+
+    def deleteAllKeyframes(self):
+        if self._keys:
+            self._value = self._evaluate(_state['frame'])
+        self._keys = []
+        self._key_frames = []
+        self._changed()
+
+    def _evaluate(self, value):
+        keys = self._keys
+        if not keys:
+            return self._value
+        if value <= keys[0]._frame:
+            return keys[0]._value
+        if value >= keys[-1]._frame:
+            return keys[-1]._value
+
+        index = bisect.bisect_right(self._key_frames, value)
+        prev, next_ = keys[index - 1], keys[index]
+        blend = (value - prev._frame) / (next_._frame - prev._frame)
+        return prev._value * (1 - blend) + next_._value * blend
+
+    def eval(self):
+        return self._evaluate(_state['frame'])
+
+    def evalAtFrame(self, value):
+        return self._evaluate(value)
+
+    def evalAtTime(self, value):
+        return self._evaluate(timeToFrame(value))
+
+    def set(self, value):
+        if self._keys:
+            # animated parms take the value as a key at the current frame
+            index = self._find(_state['frame'])
+            if index is not None:
+                self._keys[index]._value = float(value)
+            else:
+                key = Keyframe(value)
+                key._frame = _state['frame']
+                self._insert(key)
+        else:
+            self._value = float(value)
+        self._changed()
+
+
+@_counted
+class ParmTuple(object):
+    def __init__(self, node, name, parms):
+        self._node = node
+        self._name = name
+        self._parms = parms
+
+    def __repr__(self):
+        return '<hou.ParmTuple %s in %s>' % (self._name, self._node.path())
+
+    def __iter__(self):
+        return iter(self._parms)
+
+    def __len__(self):
+        return len(self._parms)
+
+    def __getitem__(self, index):
+        return self._parms[index]
+
+    def name(self):
+        return self._name
+
+    def node(self):
+        return self._node
+
+    def eval(self):
+        return tuple(parm.eval() for parm in self._parms)
+
+    def evalAtFrame(self, value):
+        return tuple(parm.evalAtFrame(value) for parm in self._parms)
+
+    def set(self, values):
+        for parm, value in zip(self._parms, values):
+            parm.set(value)
+
+
+# NODES
+
+_nodes = collections.OrderedDict()
+
+
+class _NodeType(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+# parm tuples each node type gets, with their defaults
+_NODE_PARMS = {
+    'geo': [('t', (0, 0, 0)), ('r', (0, 0, 0)), ('s', (1, 1, 1))],
+    'null': [('t', (0, 0, 0)), ('r', (0, 0, 0)), ('s', (1, 1, 1))],
+    'cam': [('t', (0, 0, 0)), ('r', (0, 0, 0)), ('s', (1, 1, 1)),
+            ('focal', (50,)), ('aperture', (41.4214,)),
+            ('resx', (1920,)), ('resy', (1080,)), ('aspect', (1,)),
+            ('near', (0.001,)), ('far', (10000,))],
+    'add': [('pt0', (0, 0, 0))],
+}
+
+
+@_counted
+class Node(object):
+    def __init__(self, parent, name, type_name):
+        self._parent = parent
+        self._name = name
+        self._type = _NodeType(type_name)
+        self._children = collections.OrderedDict()
+        self._tuples = collections.OrderedDict()
+        self._parms = collections.OrderedDict()
+        self._callbacks = []
+
+        for tuple_name, defaults in _NODE_PARMS.get(type_name, []):
+            self.addParmTuple(tuple_name, defaults)
+
+    def __repr__(self):
+        return '<hou.%s %s>' % (type(self).__name__, self.path())
+
+    def addParmTuple(self, name, defaults):
+        """
+        Fake only - add a float parm tuple. Tuples of three get x, y, z parm names
+        """
+        parms = []
+        parm_tuple = ParmTuple(self, name, parms)
+        if len(defaults) == 1:
+            names = [name]
+        elif len(defaults) == 3:
+            names = [name + axis for axis in 'xyz']
+        else:
+            names = ['%s%d' % (name, i + 1) for i in range(len(defaults))]
+
+        for index, (parm_name, default) in enumerate(zip(names, defaults)):
+            parm = Parm(self, parm_name, default, parm_tuple, index, default)
+            parms.append(parm)
+            self._parms[parm_name] = parm
+        self._tuples[name] = parm_tuple
+        return parm_tuple
+
+    def addEventCallback(self, event_types, callback):
+        self._callbacks.append((tuple(event_types), callback))
+
+    def removeEventCallback(self, event_types, callback):
+        entry = (tuple(event_types), callback)
+        if entry not in self._callbacks:
+            raise OperationFailed("callback not registered")
+        self._callbacks.remove(entry)
+
+    def eventCallbacks(self):
+        return tuple(self._callbacks)
+
+    def _event(self, event_type, **kwargs):
+        for event_types, callback in list(self._callbacks):
+            if event_type in event_types:
+                callback(event_type=event_type, node=self, **kwargs)
+
+    def name(self):
+        return self._name
+
+    def path(self):
+        if self._parent is None:
+            return '/'
+        parent = self._parent.path().rstrip('/')
+        return '%s/%s' % (parent, self._name)
+
+    def type(self):
+        return self._type
+
+    def parent(self):
+        return self._parent
+
+    def children(self):
+        return tuple(self._children.values())
+
+    def allSubChildren(self):
+        result = []
+        for child in self._children.values():
+            result.append(child)
+            result.extend(child.allSubChildren())
+        return tuple(result)
+
+    def recursiveGlob(self, pattern, filter=None):
+        nodes = self.allSubChildren()
+        if filter == nodeTypeFilter.ObjCamera:
+            nodes = [n for n in nodes if n._type._name == 'cam']
+        return tuple(nodes)
+
+    def isLockedHDA(self):
+        return False
+
+    def createNode(self, type_name, name=None):
+        name = name or '%s%d' % (type_name, len(self._children) + 1)
+        cls = ObjNode if self.path() == '/obj' else SopNode if isinstance(self, ObjNode) else Node
+        node = cls(self, name, type_name)
+        self._children[name] = node
+        _nodes[node.path()] = node
+        self._event(nodeEventType.ChildCreated, child_node=node)
+        return node
+
+    def node(self, path):
+        return _find_node(path if path.startswith('/') else '%s/%s' % (self.path().rstrip('/'), path))
+
+    def parm(self, name):
+        return self._parms.get(name)
+
+    def parms(self):
+        return tuple(self._parms.values())
+
+    def parmTuple(self, name):
+        return self._tuples.get(name)
+
+    def isSelected(self):
+        return self in _state['selected_nodes']
+
+    def setSelected(self, on, clear_all_selected=False):
+        if clear_all_selected:
+            del _state['selected_nodes'][:]
+        if on and self not in _state['selected_nodes']:
+            _state['selected_nodes'].append(self)
+        elif not on and self in _state['selected_nodes']:
+            _state['selected_nodes'].remove(self)
+
+    def worldTransform(self):
+        return self.worldTransformAtTime(time())
+
+    def worldTransformAtTime(self, value):
+        if self._parent is None:
+            return Matrix4()
+        return self._parent.worldTransformAtTime(value)
+
+
+@_counted
+class ObjNode(Node):
+    def localTransformAtTime(self, value):
+        frame_ = timeToFrame(value)
+        t = self._tuples['t'].evalAtFrame(frame_)
+        r = self._tuples['r'].evalAtFrame(frame_)
+        s = self._tuples['s'].evalAtFrame(frame_)
+        return hmath.buildScale(s) * hmath.buildRotate(r) * hmath.buildTranslate(t)
+
+    def worldTransformAtTime(self, value):
+        return self.localTransformAtTime(value) * self._parent.worldTransformAtTime(value)
+
+    def localTransform(self):
+        return self.localTransformAtTime(time())
+
+
+class attribType(object):
+    Point = 'Point'
+
+
+class attribData(object):
+    Int = 'Int'
+    Float = 'Float'
+    String = 'String'
+
+
+class Attrib(object):
+    def __init__(self, name, size):
+        self._name = name
+        self._size = size
+
+    def name(self):
+        return self._name
+
+    def dataType(self):
+        return attribData.Float
+
+    def size(self):
+        return self._size
+
+
+@_counted
+class Geometry(object):
+    """
+    Point attributes only, stored as float32 numpy arrays
+    """
+
+    def __init__(self, points=0):
+        self._attribs = collections.OrderedDict()
+        self._attribs['P'] = (Attrib('P', 3), np.zeros((points, 3), dtype=np.float32))
+
+    def createPoints(self, positions):
+        attrib, old = self._attribs['P']
+        new = np.array(positions, dtype=np.float32).reshape(-1, 3)
+        for name, (other, values) in list(self._attribs.items()):
+            if name == 'P':
+                values = np.concatenate((old, new))
+            else:
+                values = np.concatenate((values, np.zeros((len(new), other.size()), dtype=np.float32)))
+            self._attribs[name] = (other, values)
+
+    def addAttrib(self, type_, name, default_value):
+        size = len(default_value) if isinstance(default_value, (tuple, list)) else 1
+        values = np.empty((self.intrinsicValue('pointcount'), size), dtype=np.float32)
+        values[:] = default_value
+        self._attribs[name] = (Attrib(name, size), values)
+        return self._attribs[name][0]
+
+    def findPointAttrib(self, name):
+        entry = self._attribs.get(name)
+        return entry[0] if entry else None
+
+    def intrinsicValue(self, name):
+        if name == 'pointcount':
+            return len(self._attribs['P'][1])
+        raise OperationFailed("unknown intrinsic %s" % name)
+
+    def pointFloatAttribValues(self, name):
+        return tuple(float(x) for x in self._attribs[name][1].reshape(-1))
+
+    def pointFloatAttribValuesAsString(self, name):
+        return self._attribs[name][1].tobytes()
+
+    def setPointFloatAttribValues(self, name, values):
+        attrib, old = self._attribs[name]
+        self._attribs[name] = (attrib, np.array(values, dtype=np.float32).reshape(old.shape))
+
+    def setPointFloatAttribValuesFromString(self, name, values):
+        attrib, old = self._attribs[name]
+        self._attribs[name] = (attrib, np.frombuffer(values, dtype=np.float32).reshape(old.shape).copy())
+
+
+@_counted
+class SopNode(Node):
+    def geometry(self):
+        if not hasattr(self, '_geometry'):
+            self._geometry = Geometry()
+        return self._geometry
+
+
+def _find_node(path):
+    if path in ('/', ''):
+        return _root
+    return _nodes.get(path.rstrip('/'))
+
+
+def node(path):
+    _count('node')
+    return _find_node(path)
+
+
+def parm(path):
+    _count('parm')
+    node_path, _, name = path.rpartition('/')
+    found = _find_node(node_path)
+    return found.parm(name) if found else None
+
+
+def parmTuple(path):
+    _count('parmTuple')
+    node_path, _, name = path.rpartition('/')
+    found = _find_node(node_path)
+    return found.parmTuple(name) if found else None
+
+
+def selectedNodes():
+    _count('selectedNodes')
+    return tuple(_state['selected_nodes'])
+
+
+def clearAllSelected():
+    del _state['selected_nodes'][:]
+
+
+def _build_root():
+    root = Node(None, '', 'root')
+    _nodes.clear()
+    _nodes['/'] = root
+    for name in ('obj', 'out', 'ch'):
+        child = Node(root, name, name)
+        root._children[name] = child
+        _nodes[child.path()] = child
+    return root
+
+
+_root = _build_root()
+
+
+class hipFile(object):
+    @staticmethod
+    def clear(suppress_save_prompt=True):
+        global _root
+        for old in list(_nodes.values()):
+            old._event(nodeEventType.BeingDeleted)
+        _root = _build_root()
+        _state.update(frame=1.0, playbar_selection=None, scope=[], selected_nodes=[],
+                      selected_keyframes={}, undo_groups=[], undo_disabled=0, cooks=0,
+                      interrupt_at=None)
+        calls.clear()
+
+
+# HSCRIPT
+
+def setScope(parms):
+    """
+    Fake only - set the channels chscope reports
+    """
+    _state['scope'] = list(parms)
+
+
+def hscript(command):
+    _count('hscript')
+    out = []
+    err = []
+    # our commands never quote a ";", so a plain split is enough
+    for part in command.split(';'):
+        result = _hscript_command(part)
+        out.append(result[0])
+        err.append(result[1])
+    return ''.join(out), ''.join(err)
+
+
+def _hscript_command(command):
+    args = shlex.split(command)
+    if not args:
+        return '', ''
+
+    if args[0] == 'chscope':
+        return ' '.join(parm_.path() for parm_ in _state['scope']) + '\n', ''
+
+    if args[0] == 'chkey':
+        options = {}
+        targets = []
+        it = iter(args[1:])
+        for arg in it:
+            if arg.startswith('-') and len(arg) == 2:
+                options[arg[1]] = next(it)
+            else:
+                targets.append(arg)
+        frame_ = float(options.get('f', _state['frame']))
+        for target in targets:
+            found = parm(target)
+            if found is None:
+                return '', 'Unable to find channel %s\n' % target
+            index = found._find(frame_)
+            key = found._keys[index]._copy() if index is not None else Keyframe()
+            key._frame = frame_
+            if 'v' in options:
+                key._value = float(options['v'])
+            found._insert(key)
+            found._changed()
+        return '', ''
+
+    return '', 'Unknown command: %s\n' % args[0]
+
+
+# UI
+
+class _Graph(object):
+    def selectedKeyframes(self):
+        _count('graph.selectedKeyframes')
+        return dict((p, tuple(k._copy() for k in keys))
+                    for p, keys in _state['selected_keyframes'].items())
+
+
+class _ChannelEditor(object):
+    def type(self):
+        return paneTabType.ChannelEditor
+
+    def graph(self):
+        return _Graph()
+
+
+def setSelectedKeyframes(keyframes):
+    """
+    Fake only - set the keys the animation editor has selected, as a dict of parm: keyframes
+    """
+    _state['selected_keyframes'] = dict(keyframes)
+
+
+class ui(object):
+    @staticmethod
+    def mainQtWindow():
+        return None
+
+    @staticmethod
+    def currentPaneTabs():
+        _count('ui.currentPaneTabs')
+        return (_ChannelEditor(),)
+
+
+class qt(object):
+    class mimeType(object):
+        nodePath = 'application/sidefx-houdini-node.path'
+        parmPath = 'application/sidefx-houdini-parm.path'
@@ -0,0 +1,413 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Benchmark the keytar tools against the fake hou module
+
+Times transformkeys, tweenmachine, remove_flat_keys and cam_space_transform
+on synthetic scenes of growing size and writes the results as json. Pass an
+earlier result file with --baseline to flag regressions - runs that got
+slower than --threshold allows, or that made a different number of hou
+calls, hscript calls or undo groups, or left different keys behind (by a
+checksum of every key in the scene).
+
+    python bench/run_benchmarks.py --sizes 10,1000 --output bench.json
+    python bench/run_benchmarks.py --baseline bench.json
+
+Each size is run twice - as that many channels with a few keys each, and as
+a few channels with that many keys each.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'fakehou'))
+sys.path.insert(0, os.path.join(HERE, '..', 'keytar', 'scripts', 'python'))
+
+import hou
+import scenes
+
+import cam_space_transform
+import keycurve_hou
+import keyeval
+import keysnapshot
+import keytrace
+import remove_flat_keys
+import transformkeys
+import tweenmachine
+
+# keys per channel for the "channels" shape, and channels for the "keys" shape
+FEW = 10
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+def _dialog(cls, **attrs):
+    """
+    Tool dialog that skips building its widgets, so its methods can run without Qt
+    """
+    dialog = cls.__new__(cls)
+    dialog.__dict__.update(attrs)
+    return dialog
+
+
+class _Spin(object):
+    def __init__(self, value):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+
+@benchmark
+def transform_keys(channels, keys):
+    parms = scenes.animated_nodes(channels, keys)
+    selected = scenes.select_keys(parms, inner=True)
+
+    def run():
+        transformkeys.transformKeyframes(hou.ui.currentPaneTabs()[0].graph().selectedKeyframes(),
+                                         scalex=1.5, scaley=0.5, translatex=2)
+
+    return run, selected
+
+
+@benchmark
+def flip_keys(channels, keys):
+    parms = scenes.animated_nodes(channels, keys)
+    selected = scenes.select_keys(parms)
+    ui = _dialog(transformkeys.TransformKeysUi, align_checks=[])
+
+    def run():
+        ui.flip(vertical=True)
+
+    return run, selected
+
+
+@benchmark
+def snapshot_toggle(channels, keys):
+    # A/B the result of a transform, then revert it
+    parms = scenes.animated_nodes(channels, keys)
+    selected = scenes.select_keys(parms)
+    keysnapshot.snapshots.clear()
+    transformkeys.transformKeyframes(hou.ui.currentPaneTabs()[0].graph().selectedKeyframes(),
+                                     scalex=1.5, scaley=0.5, translatex=2)
+
+    def run():
+        keysnapshot.snapshots.toggle()
+        keysnapshot.snapshots.toggle()
+        keysnapshot.snapshots.revert()
+
+    return run, selected
+
+
+def _tween(channels, keys, mode):
+    parms = scenes.animated_nodes(channels, keys)
+    selected = scenes.select_keys(parms, every=2)
+    ui = _dialog(tweenmachine.TweenMachineUi, mode=mode)
+
+    def run():
+        ui.blend(0.25)
+
+    return run, selected
+
+
+@benchmark
+def flip_scoped(channels, keys):
+    # nothing selected, repeated flips of every scoped channel
+    parms = scenes.animated_nodes(channels, keys)
+    scenes.scope(parms)
+    ui = _dialog(transformkeys.TransformKeysUi, align_checks=[])
+
+    def run():
+        for _ in range(5):
+            ui.flip(vertical=True)
+
+    return run, channels * keys * 5
+
+
+@benchmark
+def tween(channels, keys):
+    return _tween(channels, keys, 'linear')
+
+
+@benchmark
+def tween_curve(channels, keys):
+    return _tween(channels, keys, 'curve')
+
+
+@benchmark
+def tween_drag(channels, keys):
+    # a slider drag delivering 30 throttled updates, then the release
+    parms = scenes.animated_nodes(channels, keys)
+    selected = scenes.select_keys(parms, every=2)
+    ui = _dialog(tweenmachine.TweenMachineUi)
+
+    def run():
+        ui.drag_start()
+        for step in range(30):
+            ui.drag_pending = step / 30.0
+            ui.drag_apply()
+        ui.drag_finish(0.75)
+
+    return run, selected
+
+
+@benchmark
+def remove_flat(channels, keys):
+    parms = scenes.animated_nodes(channels, keys)
+    nodes = sorted(set(parm.node() for parm in parms), key=lambda n: n.path())
+
+    def run():
+        for node in nodes:
+            remove_flat_keys.remove_static(node)
+
+    return run, channels * keys
+
+
+@benchmark
+def remove_flat_scene(channels, keys):
+    scenes.animated_nodes(channels, keys)
+
+    def run():
+        remove_flat_keys.remove_static_scene()
+
+    return run, channels * keys
+
+
+@benchmark
+def flat_watcher(channels, keys):
+    # a few edited channels, however big the scene is
+    parms = scenes.animated_nodes(channels, keys)
+    watcher = remove_flat_keys.FlatKeyWatcher()
+    watcher.watch(remove_flat_keys.scene_nodes())
+    edited = parms[::max(1, len(parms) // FEW)][:FEW]
+
+    def run():
+        for parm in edited:
+            parm.setKeyframe(parm.keyframes()[-1])
+        watcher.flush()
+        watcher.stop()
+
+    return run, sum(len(parm.keyframes()) for parm in edited)
+
+
+@benchmark
+def flat_report(channels, keys):
+    scenes.animated_nodes(channels, keys)
+
+    def run():
+        remove_flat_keys.analyse_flat(remove_flat_keys.animated_keys(remove_flat_keys.scene_nodes()))
+
+    return run, channels * keys
+
+
+@benchmark
+def reduce_keys(channels, keys):
+    parms = scenes.animated_nodes(channels, keys)
+
+    def run():
+        remove_flat_keys.reduce_keys(parms, 0.1)
+
+    return run, channels * keys
+
+
+@benchmark
+def evaluate(channels, keys):
+    # every frame of every channel, from one snapshot read per channel
+    parms = scenes.animated_nodes(channels, keys)
+    frames = [float(f) for f in range(1, keys + 1)]
+
+    def run():
+        for parm in parms:
+            keyeval.evaluate(keycurve_hou.read_parm(parm), frames)
+
+    return run, channels * keys
+
+
+def _camera_nudge(channels, keys, scrub):
+    # nudging works on whole translate tuples
+    parms = scenes.animated_nodes(max(1, channels // 3) * 3, keys)
+    cam = scenes.camera()
+    nodes = sorted(set(parm.node() for parm in parms), key=lambda n: n.path())
+    for node in nodes:
+        node.setSelected(True)
+
+    ui = _dialog(cam_space_transform.CameraSpaceNudgeUi,
+                 camera=cam.path(), parm='t', time_range='all', scrub=scrub, nudge_amount=_Spin(0.1))
+
+    def run():
+        ui.move(z=1)
+
+    return run, len(nodes) * 3 * keys
+
+
+@benchmark
+def camera_nudge(channels, keys):
+    return _camera_nudge(channels, keys, scrub=False)
+
+
+@benchmark
+def camera_nudge_scrub(channels, keys):
+    return _camera_nudge(channels, keys, scrub=True)
+
+
+@benchmark
+def geometry_nudge(channels, keys):
+    # one point per key, nudging is per point rather than per channel
+    count = channels * keys
+    cam = scenes.camera()
+    sop = scenes.points(count)
+    xform = sop.parent().worldTransform()
+
+    def run():
+        cam_space_transform.cam_space_nudge_geometry(sop.geometry(), cam, z=-0.1,
+                                                     xform=xform, weight_attrib='nudge')
+
+    return run, count
+
+
+# hou.Keyframe getters that go into the checksum
+KEY_GETTERS = ('frame', 'value', 'inValue', 'slope', 'inSlope', 'accel', 'inAccel',
+               'isSlopeAuto', 'isInSlopeAuto', 'expression')
+
+# results that have to match the baseline exactly
+EXACT = ('hou_calls', 'hscript_calls', 'undo_groups', 'checksum')
+
+
+def keys_checksum():
+    """
+    Checksum of every key in the scene, to tell whether a change to a tool changed its results
+    """
+    digest = hashlib.md5()
+    for node in sorted(hou.node('/').allSubChildren(), key=lambda n: n.path()):
+        for parm in node.parms():
+            keys = parm.keyframes()
+            if not keys:
+                continue
+            digest.update(parm.path().encode('utf-8'))
+            for key in keys:
+                digest.update(repr(tuple(getattr(key, getter)() for getter in KEY_GETTERS)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def run_benchmark(func, channels, keys):
+    hou.hipFile.clear()
+    run, count = func(channels, keys)
+    hou.calls.clear()
+    hou._state['cooks'] = 0
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = timeit.default_timer()
+        run()
+        seconds = timeit.default_timer() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    result = {
+        'tool': func.__name__,
+        'channels': channels,
+        'keys': keys,
+        'keys_touched': count,
+        'seconds': seconds,
+        'hou_calls': sum(hou.calls.values()),
+        'hscript_calls': hou.calls['hscript'],
+        'undo_groups': hou.calls['undos.group'],
+        'cooks': hou._state['cooks'],
+    }
+    result['checksum'] = keys_checksum()
+    return result
+
+
+def compare(results, baseline, threshold):
+    """
+    Regressions against a baseline run
+
+    Times may grow up to threshold, the EXACT results have to match. Results
+    missing from an older baseline aren't compared.
+
+    @return: List of (result, description of what changed)
+    """
+    old = dict(((r['tool'], r['channels'], r['keys']), r) for r in baseline['results'])
+    regressions = []
+    for result in results:
+        previous = old.get((result['tool'], result['channels'], result['keys']))
+        if not previous:
+            continue
+        if result['seconds'] > previous['seconds'] * threshold:
+            regressions.append((result, '%.4fs -> %.4fs' % (previous['seconds'], result['seconds'])))
+        for name in EXACT:
+            if name in previous and result[name] != previous[name]:
+                regressions.append((result, '%s %s -> %s' % (name, previous[name], result[name])))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10,1000,100000',
+                        help='comma separated channel / key counts (default: %(default)s)')
+    parser.add_argument('--tools', default='',
+                        help='comma separated benchmarks to run (default: all)')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--baseline', help='json file from an earlier run to compare against')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='trace every operation with keytrace, appending to this file')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown against the baseline that counts as a regression (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        keytrace.enable(args.trace)
+
+    sizes = [int(x) for x in args.sizes.split(',') if x]
+    tools = [x for x in args.tools.split(',') if x]
+    benchmarks = [b for b in BENCHMARKS if not tools or b.__name__ in tools]
+
+    results = []
+    for func in benchmarks:
+        for size in sizes:
+            shapes = [(size, FEW)] if size == FEW else [(size, FEW), (FEW, size)]
+            for channels, keys in shapes:
+                result = run_benchmark(func, channels, keys)
+                results.append(result)
+                print('%-18s %7d channels x %7d keys  %9.4fs  %8d hou calls  %6d hscript  %3d undo  %6d cooks' % (
+                    result['tool'], channels, keys, result['seconds'],
+                    result['hou_calls'], result['hscript_calls'], result['undo_groups'], result['cooks']))
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for result, change in regressions:
+            print('REGRESSION %s %d x %d: %s' % (result['tool'], result['channels'], result['keys'], change))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
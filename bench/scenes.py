@@ -0,0 +1,137 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Synthetic scenes for the keytar benchmarks
+
+Builds animated object nodes and cameras in the fake hou module.
+
+"""
+
+import random
+
+import hou
+
+# transform parms that get animated, in order
+ANIMATED_PARMS = ('tx', 'ty', 'tz', 'rx', 'ry', 'rz', 'sx', 'sy', 'sz')
+
+
+def animate(parm, keys, start=1, step=1, flat=0.25, rng=None, manual=0.0):
+    """
+    Key a parm with a random walk
+
+    @param parm: hou.Parm to key
+    @param keys: Number of keys
+    @param start: First key frame
+    @param step: Frames between keys
+    @param flat: Chance of a key repeating the previous value, so there is
+                 something for remove_flat_keys to find
+    @param rng: random.Random to use
+    @param manual: Chance of a key getting set slopes and accels rather than
+                   auto slopes. Half of those have untied in values, slopes
+                   and accels
+    """
+    rng = rng or random.Random(0)
+    value = rng.uniform(-1, 1)
+    frames = []
+    for i in range(keys):
+        if rng.random() > flat:
+            value += rng.uniform(-1, 1)
+        key = hou.Keyframe(value)
+        key.setFrame(start + i * step)
+        if manual and rng.random() < manual:
+            key.setSlope(rng.uniform(-5, 5))
+            key.setAccel(rng.uniform(0.1, 1.0))
+            if rng.random() < 0.5:
+                key.setInValue(value + rng.uniform(-0.5, 0.5))
+                key.setInSlope(rng.uniform(-5, 5))
+                key.setInAccel(rng.uniform(0.1, 1.0))
+        else:
+            key.setSlopeAuto(True)
+            key.setInSlopeAuto(True)
+        frames.append(key)
+    parm.setKeyframes(frames)
+
+
+def animated_nodes(channels, keys, seed=0, manual=0.0):
+    """
+    Object nodes with a number of animated channels between them
+
+    Channels are spread over as few geo nodes as possible, filling the
+    translate, rotate and scale parms of each one in turn.
+
+    @param channels: Total number of animated parms
+    @param keys: Keys per parm
+    @param seed: Random seed
+    @param manual: Chance of a key having set slopes, see animate
+    @return: List of the animated hou.Parms
+    """
+    rng = random.Random(seed)
+    obj = hou.node('/obj')
+    parms = []
+    while len(parms) < channels:
+        node = obj.createNode('geo')
+        for name in ANIMATED_PARMS[:channels - len(parms)]:
+            parm = node.parm(name)
+            animate(parm, keys, rng=rng, manual=manual)
+            parms.append(parm)
+    return parms
+
+
+def camera(name='cam1', distance=10.0):
+    """
+    Static camera looking down -z at the origin
+    """
+    cam = hou.node('/obj').createNode('cam', name)
+    cam.parm('tz').set(distance)
+    return cam
+
+
+def select_keys(parms, every=1, inner=False):
+    """
+    Select keys in the fake animation editor
+
+    @param parms: Parms to select keys on
+    @param every: Select every n-th key
+    @param inner: Leave the first and last quarter of each channel unselected,
+                  so there are keys to ripple
+    @return: Number of selected keys
+    """
+    selection = {}
+    count = 0
+    for parm in parms:
+        keys = parm.keyframes()
+        if inner:
+            keys = keys[len(keys) // 4:len(keys) - len(keys) // 4]
+        keys = keys[::every]
+        if keys:
+            selection[parm] = keys
+            count += len(keys)
+    hou.setSelectedKeyframes(selection)
+    return count
+
+
+def scope(parms):
+    """
+    Scope parms and show them in the graph, with no keys selected
+    """
+    for parm in parms:
+        parm.setSelected(True)
+    hou.setScope(parms)
+    hou.setSelectedKeyframes({})
+
+
+def points(count, seed=0):
+    """
+    SOP under a geo object, holding a cloud of points in front of cam1
+
+    @param count: Number of points
+    @return: The SOP node. Its geometry has a random "nudge" weight attribute
+    """
+    rng = random.Random(seed)
+    geo = hou.node('/obj').createNode('geo')
+    sop = geo.createNode('python')
+    geometry = sop.geometry()
+    geometry.createPoints([(rng.uniform(-5, 5), rng.uniform(-5, 5), rng.uniform(-5, 5)) for _ in range(count)])
+    geometry.addAttrib(hou.attribType.Point, 'nudge', 1.0)
+    geometry.setPointFloatAttribValues('nudge', [rng.random() for _ in range(count)])
+    return sop
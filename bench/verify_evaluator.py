@@ -0,0 +1,152 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Check keyeval against Houdini's own channel evaluation
+
+Must run in hython, the fake hou module can't evaluate segment functions.
+Keys a null with every supported segment function, samples each channel
+with parm.evalAtFrame and with keyeval.evaluate, and reports the largest
+difference per function.
+
+    hython bench/verify_evaluator.py
+    hython bench/verify_evaluator.py --hip shot.hip
+
+With --hip, every animated parm in the file is checked as well. With
+--capture, the reference channels and Houdini's samples of them are written
+out for check_evaluator.py, which checks keyeval without Houdini:
+
+    hython bench/verify_evaluator.py --capture bench/evaluator_reference.json
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'keytar', 'scripts', 'python'))
+
+import hou
+import numpy as np
+
+import check_evaluator
+import keycurve_hou
+import keyeval
+
+
+def reference_channel(node, expression, seed=0):
+    """
+    Spare parm keyed like check_evaluator.reference_keys
+
+    @return: (parm, keys)
+    """
+    keys = check_evaluator.reference_keys(expression, seed=seed)
+    name = 'verify_%s' % expression.split('(')[0]
+    group = node.parmTemplateGroup()
+    group.append(hou.FloatParmTemplate(name, name, 1))
+    node.setParmTemplateGroup(group)
+    parm = node.parm(name)
+
+    for values in keys:
+        key = hou.Keyframe(values['value'])
+        key.setFrame(values['frame'])
+        key.setSlope(values['slope'])
+        key.setAccel(values['accel'])
+        if (values['in_value'], values['in_slope'], values['in_accel']) != \
+                (values['value'], values['slope'], values['accel']):
+            key.setInValue(values['in_value'])
+            key.setInSlope(values['in_slope'])
+            key.setInAccel(values['in_accel'])
+        key.setExpression(expression, hou.exprLanguage.Hscript)
+        parm.setKeyframe(key)
+    return parm, keys
+
+
+def capture(path, channels):
+    """
+    Write reference channels and Houdini's samples of them for check_evaluator
+
+    @param channels: List of (label, parm, keys)
+    """
+    result = []
+    for label, parm, keys in channels:
+        frames = check_evaluator.sample_frames(keys)
+        result.append({
+            'label': label,
+            'keys': keys,
+            'frames': frames.tolist(),
+            'values': [parm.evalAtFrame(f) for f in frames],
+        })
+    reference = {'source': 'Houdini %s, verify_evaluator.py --capture' % hou.applicationVersionString(),
+                 'fps': hou.fps(), 'channels': result}
+    with open(path, 'w') as f:
+        json.dump(reference, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def compare(parm, samples=4):
+    """
+    Largest difference between keyeval and Houdini on a parm
+
+    @param samples: Samples per frame
+    @return: (max error, samples compared), or None if nothing could be evaluated
+    """
+    curve = keycurve_hou.read_parm(parm).sorted()
+    if len(curve) < 2:
+        return None
+
+    frames = np.arange(curve.frame[0] - 2, curve.frame[-1] + 2, 1.0 / samples)
+    ours = keyeval.evaluate(curve, frames, hou.fps())
+    usable = ~np.isnan(ours)
+    if not usable.any():
+        return None
+
+    theirs = np.array([parm.evalAtFrame(f) for f in frames[usable]])
+    return float(np.abs(ours[usable] - theirs).max()), int(usable.sum())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hip', help='also check every animated parm in this file')
+    parser.add_argument('--tolerance', type=float, default=1e-4,
+                        help='largest difference that counts as a match (default: %(default)s)')
+    parser.add_argument('--capture', metavar='FILE',
+                        help='write the reference channels and their samples to FILE for check_evaluator.py')
+    args = parser.parse_args(argv)
+
+    if args.hip:
+        hou.hipFile.load(args.hip, suppress_save_prompt=True, ignore_load_warnings=True)
+        parms = [p for n in hou.node('/').allSubChildren() for p in n.parms() if p.keyframes()]
+    else:
+        hou.hipFile.clear(suppress_save_prompt=True)
+        parms = []
+
+    null = hou.node('/obj').createNode('null', 'verify_evaluator')
+    references = [(e,) + reference_channel(null, e, seed=i)
+                  for i, e in enumerate(check_evaluator.EXPRESSIONS)]
+    if args.capture:
+        capture(args.capture, references)
+        print('wrote', args.capture)
+
+    checks = [(label, parm) for label, parm, _ in references]
+    checks += [(p.path(), p) for p in parms]
+
+    failed = 0
+    for label, parm in checks:
+        result = compare(parm)
+        if result is None:
+            print('%-40s skipped' % label)
+            continue
+        error, count = result
+        ok = error <= args.tolerance
+        failed += not ok
+        print('%-40s %6d samples  max error %.3g  %s' % (label, count, error, 'ok' if ok else 'MISMATCH'))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
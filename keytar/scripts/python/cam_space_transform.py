@@ -2,12 +2,185 @@
 nudge objects in camera depth
 """
 
+import collections
+import contextlib
+
 import hou
+import numpy as np
 from PySide2 import QtWidgets, QtCore
 from functools import partial
 
+import camspace
+import keyedit
+import keytrace
+from keysnapshot import snapshots
+
+
+class CameraState(object):
+    """
+    Everything a camera space nudge needs from a camera at one frame
+    
+    @ivar view_matrix: Perspective projection of the camera
+    @ivar view_inverse: Inverse of view_matrix
+    @ivar xform: Camera world transform
+    @ivar xform_inverse: Inverse of xform
+    @ivar arrays: The four matrices above as a 4 x 4 x 4 numpy array, in the same order
+    """
+    
+    __slots__ = ('view_matrix', 'view_inverse', 'xform', 'xform_inverse', 'arrays')
+    
+    
+    def __init__(self, cam, frame):
+        time = hou.frameToTime(frame)
+        
+        focal = cam.parm("focal").evalAtFrame(frame)
+        aperture = cam.parm("aperture").evalAtFrame(frame)
+        zoom = focal / aperture
+        xres = float(cam.parm("resx").evalAtFrame(frame))
+        yres = float(cam.parm("resy").evalAtFrame(frame))
+        pix_aspect = cam.parm("aspect").evalAtFrame(frame)
+        
+        aspect = xres / yres
+        near_clip = cam.parm("near").evalAtFrame(frame)
+        far_clip = cam.parm("far").evalAtFrame(frame)
+        
+        # camera view matrix
+        self.view_matrix = hou.Matrix4()
+        # we are ignoring the camera window, using the full aperture
+        # camera window can vary with 2d pan/zoom, etc
+        self.view_matrix.setToPerspective(zoom, aspect, pix_aspect, near_clip, far_clip, 0, 1, 0, 1)
+        self.view_inverse = self.view_matrix.inverted()
+        
+        # camera transform matrix
+        self.xform = cam.worldTransformAtTime(time)
+        self.xform_inverse = self.xform.inverted()
+        
+        self.arrays = np.array([matrix.asTuple() for matrix in
+                                (self.view_matrix, self.view_inverse, self.xform, self.xform_inverse)]).reshape(4, 4, 4)
+
+
+class CameraCache(object):
+    """
+    CameraStates keyed by camera and frame
+    
+    A camera's states are thrown away whenever a parm changes on the camera or
+    on any of the nodes it is parented under. Cameras can also be moved by
+    things that fire no events on them (constraints, look at, expressions
+    reading other nodes), so states are only kept inside an operation()
+    block and thrown away at the end of it, along with the event callbacks.
+    Outside of one every get() evaluates the camera afresh. At most
+    MAX_STATES are kept, the oldest go first.
+    """
+    
+    MAX_STATES = 4096
+    
+    EVENTS = (hou.nodeEventType.ParmTupleChanged,
+              hou.nodeEventType.BeingDeleted,
+              hou.nodeEventType.NameChanged)
+    
+    
+    def __init__(self):
+        self._states = collections.OrderedDict()
+        # camera path: (callback, nodes it is registered on)
+        self._watched = {}
+        self._operations = 0
+    
+    
+    @contextlib.contextmanager
+    def operation(self):
+        """
+        Keep camera states for the length of the block
+        """
+        self._operations += 1
+        try:
+            yield self
+        finally:
+            self._operations -= 1
+            if not self._operations:
+                self.clear()
+                self._unwatch_all()
+    
+    
+    def get(self, cam, frame=None):
+        """
+        CameraState for a camera at a frame
+        
+        @param cam: Camera object node
+        @param frame: Frame to evaluate at. Defaults to the current frame
+        """
+        if frame is None:
+            frame = hou.frame()
+        if not self._operations:
+            return CameraState(cam, frame)
+        
+        key = (cam.path(), frame)
+        state = self._states.get(key)
+        if state is None:
+            self._watch(cam)
+            state = self._states[key] = CameraState(cam, frame)
+            while len(self._states) > self.MAX_STATES:
+                self._states.popitem(last=False)
+        return state
+    
+    
+    def invalidate(self, cam):
+        """
+        Forget every state of a camera
+        
+        @param cam: Camera path or object
+        """
+        path = cam if isinstance(cam, basestring) else cam.path()
+        for key in [k for k in self._states if k[0] == path]:
+            del self._states[key]
+    
+    
+    def clear(self):
+        self._states.clear()
+    
+    
+    def _watch(self, cam):
+        path = cam.path()
+        if path in self._watched:
+            return
+        
+        nodes = []
+        node = cam
+        while isinstance(node, hou.ObjNode):
+            nodes.append(node)
+            node = node.parent()
+        
+        callback = partial(self._node_changed, path)
+        for node in nodes:
+            node.addEventCallback(self.EVENTS, callback)
+        self._watched[path] = (callback, nodes)
+    
+    
+    def _node_changed(self, path, event_type, **kwargs):
+        self.invalidate(path)
+        if event_type != hou.nodeEventType.ParmTupleChanged:
+            # part of the camera's hierarchy is going away or changing path,
+            # stop following it. It gets picked up again on the next get()
+            self._unwatch(path)
+    
+    
+    def _unwatch(self, path):
+        callback, nodes = self._watched.pop(path, (None, []))
+        for node in nodes:
+            try:
+                node.removeEventCallback(self.EVENTS, callback)
+            except (hou.OperationFailed, hou.ObjectWasDeleted):
+                pass
+    
+    
+    def _unwatch_all(self):
+        for path in list(self._watched):
+            self._unwatch(path)
+
+
+camera_cache = CameraCache()
+
 
-def cam_space_nudge(pos, cam, x=0, y=0, z=0):
+def cam_space_nudge(pos, cam, x=0, y=0, z=0, frame=None):
     """
     Transforms a position vector in camera view space
     
@@ -16,6 +189,7 @@ def cam_space_nudge(pos, cam, x=0, y=0, z=0):
     @param x: Amount in camera x to move
     @param y: Amount in camera y to move
     @param z: Amount in camera z to move
+    @param frame: Frame to take the camera from. Defaults to the current frame
     @return: Mofified positon vector
     """
     
@@ -31,28 +205,10 @@ def cam_space_nudge(pos, cam, x=0, y=0, z=0):
     
     assert isinstance(cam, hou.ObjNode)
     
-    focal = cam.parm("focal").eval()
-    aperture = cam.parm("aperture").eval()
-    zoom = focal / aperture
-    xres = float(cam.parm("resx").eval())
-    yres = float(cam.parm("resy").eval())
-    pix_aspect = cam.parm("aspect").eval()
-    
-    aspect = xres / yres
-    near_clip = cam.parm("near").eval()
-    far_clip = cam.parm("far").eval()
-    
-    # camera view matrix
-    view_matrix = hou.Matrix4()
-    # we are ignoring the camera window, using the full aperture
-    # camera window can vary with 2d pan/zoom, etc
-    view_matrix.setToPerspective(zoom, aspect, pix_aspect, near_clip, far_clip, 0, 1, 0, 1)
-    
-    # camera transform matrix
-    cam_xform = cam.worldTransform()
+    state = camera_cache.get(cam, frame)
     
     # position in the camera transform space
-    pos_in_cam = pos * cam_xform.inverted()
+    pos_in_cam = pos * state.xform_inverse
     # print 'pos in cam xform space:', pos_in_cam
     
     # this is the depth in cam xform space
@@ -60,7 +216,7 @@ def cam_space_nudge(pos, cam, x=0, y=0, z=0):
     # normalize the depth before converting into matrix space
     squish = hou.hmath.buildScale(1 / depth, 1 / depth, 1 / depth)
     
-    ndc_pos = pos_in_cam * squish * view_matrix
+    ndc_pos = pos_in_cam * squish * state.view_matrix
     # print 'NDC cam_pos:', ndc_pos
     
     # adjust the depth here
@@ -71,11 +227,129 @@ def cam_space_nudge(pos, cam, x=0, y=0, z=0):
     
     # scale the depth back out to the proper
     stretch = hou.hmath.buildScale(depth, depth, depth)
-    new_pos = ndc_pos * view_matrix.inverted() * stretch * cam_xform
+    new_pos = ndc_pos * state.view_inverse * stretch * state.xform
     # print 'new world pos', new_pos
     return new_pos
 
 
+def cam_space_nudge_frames(positions, cam, frames, x=0, y=0, z=0, parent=None):
+    """
+    Transforms many position vectors in camera view space, in one go
+    
+    @param positions: N x 3 array (or sequence of Vector3) of positions
+    @param cam: Camera path or object
+    @param frames: Frame of each position, to take the camera from
+    @param x: Amount in camera x to move. A number, or one per position
+    @param y: Amount in camera y to move. A number, or one per position
+    @param z: Amount in camera z to move. A number, or one per position
+    @param parent: Optional object node the positions are local to. They are
+                   taken to world space, nudged and brought back
+    @return: N x 3 array of modified positions
+    """
+    if isinstance(cam, basestring):
+        cam = hou.node(cam)
+    
+    assert isinstance(cam, hou.ObjNode)
+    
+    if not len(frames):
+        return np.zeros((0, 3))
+    
+    # one lookup per distinct frame, then spread out to the positions
+    unique_frames, inverse = np.unique(np.asarray(frames, dtype=np.float64), return_inverse=True)
+    cam_arrays = np.array([camera_cache.get(cam, float(frame)).arrays for frame in unique_frames])[inverse]
+    
+    parent_xforms = None
+    if parent is not None:
+        parent_xforms = np.array([parent.worldTransformAtTime(hou.frameToTime(float(frame))).asTuple()
+                                  for frame in unique_frames]).reshape(-1, 4, 4)[inverse]
+    
+    return camspace.cam_space_nudge(positions,
+                                    cam_arrays[:, 2], cam_arrays[:, 0], x=x, y=y, z=z,
+                                    xform_inverses=cam_arrays[:, 3], view_inverses=cam_arrays[:, 1],
+                                    parent_xforms=parent_xforms)
+
+
+def cam_space_nudge_geometry(geo, cam, x=0, y=0, z=0, xform=None, weight_attrib=None, frame=None):
+    """
+    Transforms every point of a geometry in camera view space
+    
+    Positions are read and written as flat float buffers, and nudged in one
+    vectorized pass. The geometry has to be writable - eg. hou.pwd().geometry()
+    in a Python SOP.
+    
+    @param geo: hou.Geometry to modify
+    @param cam: Camera path or object
+    @param x: Amount in camera x to move
+    @param y: Amount in camera y to move
+    @param z: Amount in camera z to move
+    @param xform: World transform of the geometry, eg. its object's worldTransform().
+                  Defaults to the geometry already being in world space
+    @param weight_attrib: Optional float point attribute to multiply the nudge by
+    @param frame: Frame to take the camera from. Defaults to the current frame
+    @return: Number of points moved
+    """
+    if isinstance(cam, basestring):
+        cam = hou.node(cam)
+    
+    assert isinstance(cam, hou.ObjNode)
+    
+    positions = np.frombuffer(geo.pointFloatAttribValuesAsString("P"), dtype=np.float32).reshape(-1, 3)
+    if not len(positions):
+        return 0
+    
+    if weight_attrib:
+        attrib = geo.findPointAttrib(weight_attrib)
+        if attrib is None or attrib.dataType() != hou.attribData.Float or attrib.size() != 1:
+            raise RuntimeError("%s is not a float point attribute" % weight_attrib)
+        weights = np.frombuffer(geo.pointFloatAttribValuesAsString(weight_attrib), dtype=np.float32)
+        x = weights * x
+        y = weights * y
+        z = weights * z
+    
+    parent_xforms = None
+    if xform is not None:
+        parent_xforms = np.array(xform.asTuple()).reshape(4, 4)
+    
+    state = camera_cache.get(cam, frame)
+    new_positions = camspace.cam_space_nudge(positions, state.arrays[2], state.arrays[0], x=x, y=y, z=z,
+                                             xform_inverses=state.arrays[3], view_inverses=state.arrays[1],
+                                             parent_xforms=parent_xforms)
+    
+    geo.setPointFloatAttribValuesFromString("P", new_positions.astype(np.float32).tobytes())
+    return len(new_positions)
+
+
+def key_parm_tuple(parm_tuple, frames, values):
+    """
+    Key a parm tuple at a set of frames, without changing the current frame
+    
+    Animated parms get a key at every frame - existing keys keep their slopes
+    and just take the new value. Parms without animation are set to the last
+    value, same as setting them frame by frame would.
+    
+    @param parm_tuple: hou.ParmTuple to key
+    @param frames: Frames to key at
+    @param values: One value tuple per frame
+    """
+    for index, parm in enumerate(parm_tuple):
+        existing = dict((key.frame(), key) for key in parm.keyframes())
+        if not existing:
+            if values:
+                keyedit.set_value(parm, values[-1][index])
+            continue
+        
+        keys = []
+        for frame, value in zip(frames, values):
+            key = existing.get(frame)
+            if key is None:
+                key = hou.Keyframe()
+                key.setFrame(frame)
+            key.setValue(value[index])
+            keys.append(key)
+        keyedit.set_keyframes(parm, keys)
+        keytrace.add_keys(len(keys))
+
+
 """
 cam = hou.node("/obj/cam1")
 
@@ -103,6 +377,26 @@ print 'world_pos', world_pos
 new_pos = cam_space_nudge(world_pos, cam, x=0, z=-0.1)
 local_pos = new_pos * par_xform.inverted()
 target.parmTuple("pt0").set(local_pos)
+
+
+# or the same for every key of the parm tuple at once, doing the parent
+# space round trip along the way
+
+frames = sorted(set(key.frame() for parm in target.parmTuple("pt0") for key in parm.keyframes()))
+positions = [target.parmTuple("pt0").evalAtFrame(frame) for frame in frames]
+new_positions = cam_space_nudge_frames(positions, cam, frames, z=-0.1, parent=target.parent())
+key_parm_tuple(target.parmTuple("pt0"), frames, new_positions.tolist())
+
+
+# whole geometry, in a Python SOP. Weighted by a "nudge" point attribute
+# and taking the object transform into account
+
+import cam_space_transform
+node = hou.pwd()
+geo = node.geometry()
+cam_space_transform.cam_space_nudge_geometry(geo, "/obj/cam1", z=-0.1,
+                                             xform=node.creator().worldTransform(),
+                                             weight_attrib="nudge")
 """
 
 
@@ -179,6 +473,7 @@ class CameraSpaceNudgeUi(QtWidgets.QDialog):
         
         self.parm = 't'
         self.time_range = 'all'
+        self.scrub = False
         
         self.draw_ui()
         
@@ -213,6 +508,10 @@ class CameraSpaceNudgeUi(QtWidgets.QDialog):
         self.time_range = self.time_range_combo.currentData()
     
     
+    def scrub_changed(self):
+        self.scrub = self.scrub_chk.checkState() == QtCore.Qt.Checked
+    
+    
     def draw_ui(self):
         
         main_lay = QtWidgets.QHBoxLayout()
@@ -263,6 +562,12 @@ class CameraSpaceNudgeUi(QtWidgets.QDialog):
         self.time_range_combo.currentIndexChanged.connect(self.time_range_changed)
         time_lay.addWidget(self.time_range_combo)
         
+        self.scrub_chk = QtWidgets.QCheckBox("Scrub timeline")
+        self.scrub_chk.setToolTip("Change to every key's frame before nudging it.\n"
+                                  "Only needed for setups that don't evaluate correctly at other frames")
+        self.scrub_chk.stateChanged.connect(self.scrub_changed)
+        xform_lay.addWidget(self.scrub_chk)
+        
         # PIVOT OPTIONS
         groupBox = QtWidgets.QGroupBox("Nudge")
         xform_lay.addWidget(groupBox)
@@ -316,6 +621,22 @@ class CameraSpaceNudgeUi(QtWidgets.QDialog):
         down_btn.clicked.connect(partial(self.move, y=1))
     
     
+    def get_keytimes(self, parm_tuple, current_frame, sel_range=None):
+        """
+        Frames to nudge a parm tuple at, for the current time range setting
+        """
+        if self.time_range == 'cur':
+            return [current_frame]
+        
+        keytimes = set()
+        for parm in parm_tuple:
+            keytimes.update(x.frame() for x in parm.keyframes())
+        
+        if self.time_range == 'sel':
+            keytimes = [x for x in keytimes if x >= sel_range[0] and x <= sel_range[1]]
+        return sorted(keytimes)
+    
+    
     def move(self, x=0, y=0, z=0):
         camera = hou.node(self.camera)
         if not camera:
@@ -328,34 +649,80 @@ class CameraSpaceNudgeUi(QtWidgets.QDialog):
         y_offset = y * amount
         z_offset = z * amount
         
+        sel_range = None
+        if self.time_range == 'sel':
+            sel_range = hou.playbar.selectionRange()
+            if not sel_range:
+                QtWidgets.QMessageBox.warning(self, 'Problems!',
+                                              'Select a range on the timeline')
+                return
+        
+        # camera states are only cached for the length of one nudge
+        with keytrace.operation('Camera Nudge Keys'), camera_cache.operation():
+            self.nudge_keys(camera, x_offset, y_offset, z_offset, sel_range)
+    
+    
+    def nudge_keys(self, camera, x_offset, y_offset, z_offset, sel_range=None):
+        """
+        Nudge the selected nodes at every frame of the time range
+        """
         current_frame = hou.frame()
-        with hou.undos.group('Camera Nudge Keys'):
+        
+        with keytrace.phase('gather'):
+            # gather every node's frames first, so each frame only gets visited
+            # once however many nodes share it
+            jobs = []
             for node in hou.selectedNodes():
-                keytimes = []
                 parmTuple = node.parmTuple(self.parm)
                 if parmTuple:
-                    if self.time_range == 'cur':
-                        keytimes = [current_frame]
-                    else:
-                        for parm in parmTuple:
-                            print parm
-                            parm_keys = parm.keyframes()
-                            keytimes.extend([x.frame() for x in parm_keys])
-                        
-                        keytimes = sorted(list(set(keytimes)))
-                        if self.time_range == 'sel':
-                            sel_range = hou.playbar.selectionRange()
-                            if not sel_range:
-                                QtWidgets.QMessageBox.warning(self, 'Problems!',
-                                                              'Select a range on the timeline')
-                                return
-                            
-                            keytimes = [x for x in keytimes if x >= sel_range[0] and x <= sel_range[1]]
-                    
+                    keytimes = self.get_keytimes(parmTuple, current_frame, sel_range)
+                    if keytimes:
+                        jobs.append((parmTuple, keytimes))
+            
+            if not jobs:
+                return
+        
+        # every parm of every job gets keyed
+        parms = [parm for parmTuple, keytimes in jobs for parm in parmTuple]
+        
+        if self.scrub:
+            snapshots.capture('Camera Nudge Keys', parms)
+            # setting parms frame by frame relies on the frame being current,
+            # so these can't be buffered
+            with keytrace.phase('commit'), hou.undos.group('Camera Nudge Keys'):
+                frames = {}
+                for parmTuple, keytimes in jobs:
                     for keytime in keytimes:
-                        hou.setFrame(keytime)
+                        frames.setdefault(keytime, []).append(parmTuple)
+                
+                for keytime in sorted(frames):
+                    hou.setFrame(keytime)
+                    for parmTuple in frames[keytime]:
                         pos = hou.Vector3(parmTuple.eval())
                         new_pos = cam_space_nudge(pos, camera, x=x_offset, y=y_offset, z=z_offset)
                         parmTuple.set(new_pos)
+                    keytrace.add_keys(sum(len(parmTuple) for parmTuple in frames[keytime]))
+                
+                hou.setFrame(current_frame)
+            return
         
-        hou.setFrame(current_frame)
+        with keytrace.phase('gather'):
+            # read every position before writing any keys, so new keys can't
+            # change the interpolation at the frames still to come
+            positions = []
+            frames = []
+            for parmTuple, keytimes in jobs:
+                positions.extend(parmTuple.evalAtFrame(keytime) for keytime in keytimes)
+                frames.extend(keytimes)
+        
+        with keytrace.phase('compute'):
+            new_positions = cam_space_nudge_frames(positions, camera, frames,
+                                                   x=x_offset, y=y_offset, z=z_offset).tolist()
+        
+        snapshots.capture('Camera Nudge Keys', parms)
+        with keyedit.transaction('Camera Nudge Keys'), keytrace.phase('commit'):
+            start = 0
+            for parmTuple, keytimes in jobs:
+                end = start + len(keytimes)
+                key_parm_tuple(parmTuple, keytimes, new_positions[start:end])
+                start = end
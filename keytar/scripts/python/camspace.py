@@ -0,0 +1,99 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Vectorized camera space nudging
+
+Same maths as cam_space_transform.cam_space_nudge, but for whole arrays of
+positions at once, each with its own camera matrices. Matrices are 4x4 numpy
+arrays in Houdini's row vector convention (position * matrix).
+
+Host independent - see cam_space_transform for pulling the matrices out of
+a Houdini camera.
+
+"""
+
+import numpy as np
+
+
+def transform_points(points, matrices):
+    """
+    Multiply row vector points by 4x4 matrices
+
+    Points are treated as having w = 1, and are divided by the resulting w
+    unless it comes out as 0.
+
+    @param points: N x 3 array
+    @param matrices: One 4 x 4 matrix for every point, or a single one for all of them
+    @return: N x 3 array
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    matrices = np.asarray(matrices, dtype=np.float64)
+
+    homogeneous = np.concatenate((points, np.ones((len(points), 1))), axis=1)
+    if matrices.ndim == 2:
+        result = homogeneous.dot(matrices)
+    else:
+        result = np.einsum('ni,nij->nj', homogeneous, matrices)
+
+    w = result[:, 3:]
+    return result[:, :3] / np.where(w == 0, 1.0, w)
+
+
+def _inverse(matrices, inverses):
+    if inverses is not None:
+        return np.asarray(inverses, dtype=np.float64)
+    return np.linalg.inv(np.asarray(matrices, dtype=np.float64))
+
+
+def _column(amount):
+    """
+    Nudge amounts as something that broadcasts against an N x 1 column
+    """
+    amount = np.asarray(amount, dtype=np.float64)
+    return amount.reshape(-1, 1) if amount.ndim else amount
+
+
+def cam_space_nudge(positions, xforms, view_matrices, x=0, y=0, z=0,
+                    xform_inverses=None, view_inverses=None,
+                    parent_xforms=None, parent_inverses=None):
+    """
+    Transform positions in camera view space
+
+    @param positions: N x 3 array of positions
+    @param xforms: Camera world transforms, N x 4 x 4 or a single 4 x 4
+    @param view_matrices: Camera perspective matrices, N x 4 x 4 or a single 4 x 4
+    @param x: Amount in camera x to move. A number, or one per position (eg. weighted)
+    @param y: Amount in camera y to move. A number, or one per position
+    @param z: Amount in camera z to move. A number, or one per position
+    @param xform_inverses: Inverses of xforms, if they are already known
+    @param view_inverses: Inverses of view_matrices, if they are already known
+    @param parent_xforms: World transforms of the space the positions are in. When
+                          given, positions are taken to world space, nudged and
+                          brought back again. N x 4 x 4 or a single 4 x 4
+    @param parent_inverses: Inverses of parent_xforms, if they are already known
+    @return: N x 3 array of nudged positions
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+
+    if parent_xforms is not None:
+        positions = transform_points(positions, parent_xforms)
+
+    # position in the camera transform space
+    pos_in_cam = transform_points(positions, _inverse(xforms, xform_inverses))
+
+    # this is the depth in cam xform space, normalize it out before
+    # converting into matrix space
+    depth = pos_in_cam[:, 2:3] * -1
+    ndc_pos = transform_points(pos_in_cam / depth, view_matrices)
+
+    ndc_pos[:, 0:1] += _column(x)
+    ndc_pos[:, 1:2] += _column(y)
+    depth = depth + _column(z)
+
+    # scale the depth back out to the proper
+    cam_pos = transform_points(ndc_pos, _inverse(view_matrices, view_inverses)) * depth
+    new_pos = transform_points(cam_pos, xforms)
+
+    if parent_xforms is not None:
+        new_pos = transform_points(new_pos, _inverse(parent_xforms, parent_inverses))
+    return new_pos
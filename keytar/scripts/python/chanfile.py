@@ -0,0 +1,412 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Read and write Houdini channel files without Houdini
+
+Supports the text formats written by chwrite and the File CHOP, and keytar's
+own keyed format:
+
+ - .chan: one line per frame, one whitespace separated column per channel
+ - .clip: CHOP clip, a brace delimited header and one data block per track
+ - .kchan: json, every field of every key of each channel, written from
+   Houdini with keycurve_hou.export_channels
+
+.chan and .clip store samples rather than keys, so every sample reads in as
+a linear key, and curves are sampled (with keyeval) when written - .chan
+files on every frame, .clip files at the rate of the clip they were read
+from. Reading a file and writing it back unchanged gives the same samples,
+but sparse keys (eg. after reducing) are sampled back out, neither format
+can keep them. .kchan files keep the keys as they are. The binary .bclip
+format isn't supported.
+
+Files that don't parse - bad numbers, rows or tracks of the wrong length,
+missing closing braces, keys missing fields - raise ValueError rather than
+reading in part.
+
+.chan and .clip files are memory mapped and parsed in chunks of lines, so
+big files never need to be held in memory as text.
+
+Channels are passed around as Channels, OrderedDicts of channel name to
+KeyCurve.
+
+"""
+
+import collections
+import itertools
+import json
+import mmap
+import os
+
+import numpy as np
+
+import keycurve
+import keyeval
+
+# lines parsed per chunk
+CHUNK_LINES = 65536
+
+FORMATS = ('.chan', '.clip', '.kchan')
+
+# formats that hold samples rather than keys
+SAMPLED_FORMATS = ('.chan', '.clip')
+
+# version written to .kchan files
+KCHAN_VERSION = 1
+
+
+class Channels(collections.OrderedDict):
+    """
+    Channel name to KeyCurve
+
+    @ivar rate: Samples per second of the clip the channels were read from,
+                None for .chan files and channels made elsewhere
+    """
+
+    def __init__(self, items=(), rate=None):
+        super(Channels, self).__init__(items)
+        self.rate = rate
+
+
+def _lines(path):
+    """
+    Lines of a file, read through a memory map
+    """
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for line in iter(buf.readline, b''):
+                yield line
+        finally:
+            buf.close()
+
+
+def _numbers(lines, path):
+    """
+    Parse whitespace separated numbers out of some lines
+
+    @raise ValueError: If anything in them isn't a number
+    """
+    text = b' '.join(lines).decode('ascii')
+    values = np.fromstring(text, dtype=np.float64, sep=' ')
+    # fromstring stops quietly at the first thing it can't parse
+    if len(values) != len(text.split()):
+        raise ValueError("%s: '%s' is not a number" % (path, text.split()[len(values)]))
+    return values
+
+
+def _linear_curve(frames, values):
+    return keycurve.KeyCurve(frames, values, expression=np.full(len(frames), 'linear()', dtype=object))
+
+
+def is_sampled(path):
+    """
+    Whether a channel file holds samples rather than keys, so any keys
+    written to it are sampled back out
+    """
+    return os.path.splitext(path)[1].lower() in SAMPLED_FORMATS
+
+
+def _format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError("unsupported channel file %s, expected one of %s" % (path, ', '.join(FORMATS)))
+    return ext
+
+
+def iter_chan(path, chunk=CHUNK_LINES):
+    """
+    Stream the rows of a .chan file
+
+    @param chunk: Lines per chunk
+    @return: Generator of 2D arrays, each chunk of rows by channels
+    """
+    lines = (line for line in _lines(path) if line.strip())
+    columns = None
+    while True:
+        block = list(itertools.islice(lines, chunk))
+        if not block:
+            return
+        if columns is None:
+            columns = len(block[0].split())
+        values = _numbers(block, path)
+        if len(values) != len(block) * columns:
+            raise ValueError("%s: rows don't all have %d columns" % (path, columns))
+        yield values.reshape(-1, columns)
+
+
+def read_chan(path, names=None, start=1.0):
+    """
+    Read a .chan file
+
+    @param names: Channel names, one per column. Defaults to chan0, chan1...
+    @param start: Frame of the first row
+    @return: Channels
+    """
+    chunks = list(iter_chan(path))
+    data = np.concatenate(chunks) if chunks else np.zeros((0, len(names or ())))
+    if names is None:
+        names = ['chan%d' % i for i in range(data.shape[1])]
+    if len(names) != data.shape[1]:
+        raise ValueError("%s has %d channels, got %d names" % (path, data.shape[1], len(names)))
+
+    frames = start + np.arange(len(data), dtype=np.float64)
+    return Channels((name, _linear_curve(frames, data[:, i])) for i, name in enumerate(names))
+
+
+def read_clip(path, fps=24.0):
+    """
+    Read a text .clip file
+
+    Sample times are converted to frames at the given fps, with sample 0
+    (time 0) on frame 1.
+
+    @return: Channels, with the rate of the clip
+    @raise ValueError: If the clip is cut short, or its data doesn't match its
+                       tracks and tracklength
+    """
+    header = {}
+    tracks = []
+    track = None
+    data = None
+    depth = 0
+
+    for line in _lines(path):
+        line = line.strip()
+        if not line:
+            continue
+
+        if data is not None:
+            # data runs on until the track closes or the next field starts
+            if line.startswith(b'}') or b'=' in line:
+                track['data'] = _numbers(data, path)
+                data = None
+            else:
+                data.append(line)
+                continue
+
+        if line == b'{':
+            # the clip is the outer block, tracks are the blocks inside it
+            depth += 1
+            if depth == 2:
+                track = {}
+            continue
+        if line.startswith(b'}'):
+            if depth == 2:
+                tracks.append(track)
+                track = None
+            depth -= 1
+            continue
+
+        key, _, value = line.partition(b'=')
+        key = key.strip().decode('ascii')
+        value = value.strip()
+        if track is None:
+            header[key] = value.decode('ascii')
+        elif key == 'data':
+            data = [value]
+        else:
+            track[key] = value.decode('ascii')
+
+    if depth or data is not None:
+        raise ValueError("%s: clip ends before its closing brace" % path)
+    if 'tracks' in header and int(header['tracks']) != len(tracks):
+        raise ValueError("%s: header says %s tracks, found %d" % (path, header['tracks'], len(tracks)))
+
+    rate = float(header.get('rate', fps))
+    start = float(header.get('start', 0))
+    length = int(header['tracklength']) if 'tracklength' in header else None
+    channels = Channels(rate=rate)
+    for track in tracks:
+        name = track.get('name', 'chan%d' % len(channels))
+        values = track.get('data', np.zeros(0))
+        if length is None:
+            length = len(values)
+        if len(values) != length:
+            raise ValueError("%s: track %s has %d samples, expected %d" % (path, name, len(values), length))
+        frames = (start + np.arange(len(values))) / rate * fps + 1
+        channels[name] = _linear_curve(frames, values)
+    return channels
+
+
+def read_kchan(path):
+    """
+    Read a .kchan file
+
+    @return: Channels
+    @raise ValueError: If it isn't a .kchan file this module can read, or a
+                       channel's fields don't all have one entry per key
+    """
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise ValueError("%s: %s" % (path, e))
+    if not isinstance(data, dict) or data.get('format') != 'kchan':
+        raise ValueError("%s is not a .kchan file" % path)
+    if data.get('version') != KCHAN_VERSION:
+        raise ValueError("%s: unsupported .kchan version %r" % (path, data.get('version')))
+
+    channels = Channels()
+    for channel in data.get('channels', ()):
+        name = channel.get('name', 'chan%d' % len(channels))
+        keys = channel.get('keys', {})
+        missing = [field for field in keycurve.KeyCurve.FIELDS if field not in keys]
+        if missing:
+            raise ValueError("%s: channel %s has no %s" % (path, name, ', '.join(missing)))
+        size = len(keys['frame'])
+        for field in keycurve.KeyCurve.FIELDS:
+            if len(keys[field]) != size:
+                raise ValueError("%s: channel %s has %d %s, expected %d" % (
+                    path, name, len(keys[field]), field, size))
+        try:
+            channels[name] = keycurve.KeyCurve(**dict((field, keys[field]) for field in keycurve.KeyCurve.FIELDS))
+        except (TypeError, ValueError) as e:
+            raise ValueError("%s: channel %s: %s" % (path, name, e))
+    return channels
+
+
+def read(path, fps=24.0, names=None, start=1.0):
+    """
+    Read any supported channel file
+
+    @param names: Channel names for .chan files
+    @param start: First frame for .chan files
+    @return: Channels
+    """
+    ext = _format(path)
+    if ext == '.chan':
+        return read_chan(path, names, start)
+    if ext == '.kchan':
+        return read_kchan(path)
+    return read_clip(path, fps)
+
+
+def key_range(channels):
+    """
+    First and last key frame over some channels
+    """
+    curves = [curve for curve in channels.values() if len(curve)]
+    if not curves:
+        return 1.0, 1.0
+    return (float(min(curve.frame.min() for curve in curves)),
+            float(max(curve.frame.max() for curve in curves)))
+
+
+def frame_range(channels):
+    """
+    First and last key frame over some channels, rounded out to whole frames
+    """
+    first, last = key_range(channels)
+    return float(np.floor(first)), float(np.ceil(last))
+
+
+def _samples(channels, frames, fps):
+    """
+    Every channel sampled at some frames, as frames by channels
+    """
+    data = np.zeros((len(frames), len(channels)))
+    for i, curve in enumerate(channels.values()):
+        curve = curve.sorted()
+        data[:, i] = keyeval.evaluate(curve, frames, fps) if len(curve) else 0.0
+    # segments keyeval can't do hold the previous sample
+    bad = np.isnan(data)
+    if bad.any():
+        index = np.where(~bad, np.arange(len(frames))[:, None], 0)
+        np.maximum.accumulate(index, axis=0, out=index)
+        data = np.nan_to_num(data[index, np.arange(data.shape[1])])
+    return data
+
+
+def write_chan(path, channels, start=None, end=None, fps=24.0, chunk=CHUNK_LINES):
+    """
+    Write channels as a .chan file, one row per frame
+
+    @param start: First frame to write, defaults to the first key
+    @param end: Last frame to write, defaults to the last key
+    @return: Samples written
+    """
+    first, last = frame_range(channels)
+    start = first if start is None else start
+    end = last if end is None else end
+    data = _samples(channels, np.arange(start, end + 1, dtype=np.float64), fps)
+    with open(path, 'w') as f:
+        for i in range(0, len(data), chunk):
+            np.savetxt(f, data[i:i + chunk], fmt='%.9g')
+    return data.size
+
+
+def write_clip(path, channels, start=None, end=None, fps=24.0, rate=None):
+    """
+    Write channels as a text .clip file
+
+    Samples are taken on the clip's own sample times, from the last one at or
+    before start to the first one at or after end.
+
+    @param start: First frame to write, defaults to the first key
+    @param end: Last frame to write, defaults to the last key
+    @param rate: Samples per second, defaults to the rate the channels were
+                 read at, or fps
+    @return: Samples written
+    """
+    if rate is None:
+        rate = getattr(channels, 'rate', None) or fps
+    first, last = key_range(channels)
+    start = first if start is None else start
+    end = last if end is None else end
+
+    # sample numbers, with sample 0 on frame 1. the tolerance keeps samples
+    # that are only off the grid by rounding error from adding one more
+    scale = rate / float(fps)
+    first_sample = int(np.floor((start - 1) * scale + 1e-6))
+    last_sample = max(int(np.ceil((end - 1) * scale - 1e-6)), first_sample)
+    samples = np.arange(first_sample, last_sample + 1, dtype=np.float64)
+    data = _samples(channels, samples / scale + 1, fps)
+
+    with open(path, 'w') as f:
+        f.write('{\n')
+        f.write('\trate = %.9g\n' % rate)
+        f.write('\tstart = %d\n' % first_sample)
+        f.write('\ttracklength = %d\n' % len(data))
+        f.write('\ttracks = %d\n' % len(channels))
+        for i, name in enumerate(channels):
+            f.write('\t{\n')
+            f.write('\t\tname = %s\n' % name)
+            f.write('\t\tdata = ')
+            f.write(' '.join('%.9g' % v for v in data[:, i]))
+            f.write('\n\t}\n')
+        f.write('}\n')
+    return data.size
+
+
+def write_kchan(path, channels):
+    """
+    Write channels as a .kchan file, every key as it is
+
+    @return: Keys written
+    """
+    data = {'format': 'kchan', 'version': KCHAN_VERSION, 'channels': []}
+    for name, curve in channels.items():
+        keys = dict((field, getattr(curve, field).tolist()) for field in keycurve.KeyCurve.FIELDS)
+        data['channels'].append({'name': name, 'keys': keys})
+    with open(path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    return sum(len(curve) for curve in channels.values())
+
+
+def write(path, channels, start=None, end=None, fps=24.0):
+    """
+    Write any supported channel file, picked by the extension
+
+    .clip files keep the rate the channels were read at, see write_clip.
+    .kchan files keep the keys, start and end are ignored for them.
+
+    @return: Keys written, or samples for the sampled formats
+    """
+    ext = _format(path)
+    if ext == '.chan':
+        return write_chan(path, channels, start, end, fps)
+    if ext == '.kchan':
+        return write_kchan(path, channels)
+    return write_clip(path, channels, start, end, fps)
@@ -0,0 +1,137 @@
+# -*- coding: UTF-8 -*-
+"""
+Work out which channels the keytar tools should act on
+
+Every tool acts on the keys selected in the animation editor, or failing
+that on the scoped channels that are visible in the graph. Resolving the
+scope means parsing chscope and looking up and checking every parm, which
+adds up on a big rig, so the parms of the scope are cached. Whether a
+channel is highlighted in the channel list can change at any time without
+any event to hear about it, so that is checked on every call.
+
+The cache is keyed by the chscope string and a selection version. The
+version moves on whenever the node selection changes, when a node holding a
+cached parm is deleted or renamed, or when invalidate() is called.
+"""
+
+from functools import partial
+
+import hou
+
+
+class ScopeResolver(object):
+    """
+    Cached lookup of the animation editor selection and scoped channels
+
+    @ivar version: Selection version, see the module docs
+    """
+
+    EVENTS = (hou.nodeEventType.BeingDeleted,
+              hou.nodeEventType.NameChanged)
+
+
+    def __init__(self):
+        self.version = 0
+        self._key = None
+        self._parms = ()
+        # node path: callback registered on it
+        self._watched = {}
+        self._selection_callback = False
+
+
+    def channel_editor(self):
+        """
+        The animation editor pane, or None if there isn't one
+        """
+        editor = None
+        for pane in hou.ui.currentPaneTabs():
+            if pane.type() == hou.paneTabType.ChannelEditor:
+                editor = pane
+        return editor
+
+
+    def selected_keyframes(self):
+        """
+        Keys selected in the animation editor
+
+        @return: Dict of hou.Parm to tuple of hou.Keyframe. Empty if nothing is selected,
+                 None if there is no animation editor
+        """
+        editor = self.channel_editor()
+        if editor is None:
+            return None
+        return editor.graph().selectedKeyframes() or {}
+
+
+    def scoped_parms(self):
+        """
+        Scoped parms that are visible in the graph editor
+
+        @return: Tuple of hou.Parm
+        """
+        self._watch_selection()
+        scope = hou.hscript("chscope")[0]
+        key = (scope, self.version)
+        if key != self._key:
+            parms = [hou.parm(x) for x in scope.split()]
+            self._parms = tuple(parm for parm in parms if parm is not None)
+            self._key = key
+            for parm in self._parms:
+                self._watch(parm.node())
+        # only operate on channels that are visible in the graph editor
+        return tuple(parm for parm in self._parms if parm.isSelected())
+
+
+    def keyframes(self, scoped=True):
+        """
+        The keys the tools should act on
+
+        Selected keys in the animation editor if there are any, otherwise
+        every key of the scoped and visible channels.
+
+        @param scoped: Fall back to the scoped channels when there is no animation editor
+        @return: Dict of hou.Parm to sequence of hou.Keyframe
+        """
+        keyframes = self.selected_keyframes()
+        if keyframes:
+            return keyframes
+        if keyframes is None and not scoped:
+            return {}
+        return dict((parm, parm.keyframes()) for parm in self.scoped_parms())
+
+
+    def invalidate(self, *args, **kwargs):
+        """
+        Throw away the cached scope. Takes any arguments, so it can be used as a callback
+        """
+        self.version += 1
+
+
+    def _watch_selection(self):
+        # node selection drives what shows up in the channel list
+        if self._selection_callback:
+            return
+        self._selection_callback = True
+        if hasattr(hou.ui, 'addSelectionCallback'):
+            hou.ui.addSelectionCallback(self.invalidate)
+
+
+    def _watch(self, node):
+        path = node.path()
+        if path in self._watched:
+            return
+        callback = partial(self._node_changed, path)
+        node.addEventCallback(self.EVENTS, callback)
+        self._watched[path] = callback
+
+
+    def _node_changed(self, path, node, **kwargs):
+        self.invalidate()
+        callback = self._watched.pop(path, None)
+        try:
+            node.removeEventCallback(self.EVENTS, callback)
+        except (hou.OperationFailed, hou.ObjectWasDeleted):
+            pass
+
+
+scope_resolver = ScopeResolver()
@@ -0,0 +1,157 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Dry run report of the flat keys in a scene
+
+Lists what remove_flat_keys would remove without touching anything, per
+parm and per node, with the frame ranges of the flat runs and a rough
+estimate of the saving. Reports can be written out as json or csv, eg. for
+a scene health check on publish.
+
+Host independent - see remove_flat_keys.analyse_flat for filling one in
+from Houdini.
+
+"""
+
+import collections
+import csv
+import json
+import sys
+
+import numpy as np
+
+import keycurve
+
+# rough size of one key in a .hip file's channel section, in bytes
+HIP_BYTES_PER_KEY = 100
+
+CSV_COLUMNS = ('node', 'parm', 'keys', 'removable', 'ranges')
+
+
+class FlatKeyReport(object):
+    """
+    Removable flat keys, per parm
+
+    @ivar parms: List of dicts with node, parm, keys (key count), removable (key count)
+                 and ranges (list of [first frame, last frame] of each flat run with
+                 keys to remove). Only parms with something to remove are listed
+    @ivar channels: Number of channels looked at
+    @ivar keys: Number of keys looked at
+    """
+
+    def __init__(self):
+        self.parms = []
+        self.channels = 0
+        self.keys = 0
+
+
+    def __str__(self):
+        return '%d removable keys of %d, on %d of %d channels (about %d bytes)' % (
+            self.removable(), self.keys, len(self.parms), self.channels, self.saving()[1])
+
+
+    def add(self, node, parm, frames, values):
+        """
+        Analyse one channel
+
+        @param node: Path of the node the channel is on
+        @param parm: Name of the channel
+        @param frames: Key times, in order
+        @param values: Key values
+        @return: Number of removable keys
+        """
+        frames = np.asarray(frames, dtype=np.float64)
+        self.channels += 1
+        self.keys += len(frames)
+
+        starts, redundant = keycurve.flat_runs(values)
+        removable = int(redundant.sum())
+        if not removable:
+            return 0
+
+        # runs of two keys have nothing to remove, so only take the starts
+        # followed by a redundant key. the key after a run's last redundant
+        # key ends it
+        run_start = (starts[:-1] & redundant[1:]).nonzero()[0]
+        run_end = (redundant[:-1] & ~redundant[1:]).nonzero()[0] + 1
+
+        self.parms.append({
+            'node': node,
+            'parm': parm,
+            'keys': len(frames),
+            'removable': removable,
+            'ranges': [[float(frames[s]), float(frames[e])] for s, e in zip(run_start, run_end)],
+        })
+        return removable
+
+
+    def removable(self):
+        return sum(entry['removable'] for entry in self.parms)
+
+
+    def nodes(self):
+        """
+        Totals per node
+
+        @return: OrderedDict of node path to dict of parms, keys and removable counts
+        """
+        nodes = collections.OrderedDict()
+        for entry in self.parms:
+            node = nodes.setdefault(entry['node'], {'parms': 0, 'keys': 0, 'removable': 0})
+            node['parms'] += 1
+            node['keys'] += entry['keys']
+            node['removable'] += entry['removable']
+        return nodes
+
+
+    def saving(self):
+        """
+        Estimated saving from removing the keys
+
+        @return: (keys, .hip bytes)
+        """
+        removable = self.removable()
+        return removable, removable * HIP_BYTES_PER_KEY
+
+
+    def to_dict(self):
+        keys, size = self.saving()
+        return {
+            'channels': self.channels,
+            'keys': self.keys,
+            'removable': keys,
+            'hip_bytes_saved': size,
+            'nodes': self.nodes(),
+            'parms': self.parms,
+        }
+
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+    def write_csv(self, path):
+        """
+        One row per parm, with the flat runs as space separated first-last frame ranges
+        """
+        if sys.version_info[0] < 3:
+            f = open(path, 'wb')
+        else:
+            f = open(path, 'w', newline='')
+        with f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_COLUMNS)
+            for entry in self.parms:
+                ranges = ' '.join('%g-%g' % (start, end) for start, end in entry['ranges'])
+                writer.writerow((entry['node'], entry['parm'], entry['keys'], entry['removable'], ranges))
+
+
+    def write(self, path):
+        """
+        Write as csv if the path ends in .csv, json otherwise
+        """
+        if path.lower().endswith('.csv'):
+            self.write_csv(path)
+        else:
+            self.write_json(path)
@@ -0,0 +1,277 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Run keytar key operations over channel files, without Houdini
+
+Every file is read with chanfile, put through the requested operations and
+written back. Files are handled in parallel by a process pool, and each
+result is written to a temporary file and renamed over the target, keeping
+the permissions of the input, so an interrupted run never leaves half
+written files.
+
+Operations run in this order, each only when asked for:
+
+ 1. transform - scale / translate all keys about a pivot, like Transform Keys
+ 2. retime - scale and offset key times about a frame
+ 3. flat - remove the redundant keys of flat runs, like Remove Flat Keys
+ 4. reduce - remove keys the curve reproduces within a tolerance
+
+    python keybatch.py --transform 1 2 0 0 --output-dir scaled shot/*.clip
+    python keybatch.py --retime 0.5 --retime-pivot 1001 -j 8 --in-place shot/*.chan
+
+.kchan files keep keys as they are, see chanfile. .chan and .clip files
+hold samples rather than keys, so anything written to them is sampled back
+out. flat and reduce would only make those files less accurate without
+making them any smaller, so they are refused for them - export the channels
+as .kchan to remove keys.
+
+    python keybatch.py --flat --reduce 0.001 --output-dir reduced shot/*.kchan
+
+Each file's keys (samples for .chan and .clip) and bytes are reported from
+before and after.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+import chanfile
+import keycurve
+import keyreduce
+import keytransform
+
+
+def remove_flat(curve):
+    """
+    Curve without the redundant keys of its flat runs, see remove_flat_keys.remove_flat
+    """
+    starts, redundant = keycurve.flat_runs(curve.value)
+    if not starts.any():
+        return curve
+    curve = curve.copy()
+    curve.expression[starts] = 'linear()'
+    return curve.take(~redundant)
+
+
+def reduce_curves(curves, tolerance, fps):
+    """
+    Reduced copies of some curves and the largest error of any of them
+    """
+    reductions = keyreduce.reduce_curves(curves, tolerance, fps)
+    result = []
+    for curve, reduction in zip(curves, reductions):
+        curve = curve.copy()
+        curve.expression[reduction.linear] = 'linear()'
+        result.append(curve.take(reduction.keep))
+    return result, max([r.error for r in reductions] or [0.0])
+
+
+def transform_curves(curves, scalex=1.0, scaley=1.0, translatex=0.0, translatey=0.0,
+                     autopivot='mm', pivotx=None, pivoty=None, snapframe=False):
+    """
+    Transform every key of some curves together, as if they were all selected
+    """
+    batch = keytransform.CurveBatch(curves)
+    if not len(batch):
+        return curves
+    bounds = batch.bounds()
+    pivot = keytransform.resolve_pivot(bounds, autopivot, pivotx, pivoty)
+    return keytransform.transform_batch(batch, bounds, pivot, scalex, scaley, translatex, translatey,
+                                        ripple=False, snapframe=snapframe)
+
+
+def process(curves, options):
+    """
+    Apply the requested operations to some curves
+
+    @param curves: List of time sorted KeyCurves
+    @param options: Dict of the command line options
+    @return: (new curves, largest reduction error)
+    """
+    if options.get('transform'):
+        scalex, scaley, translatex, translatey = options['transform']
+        curves = transform_curves(curves, scalex, scaley, translatex, translatey,
+                                  options.get('pivot', 'mm'), snapframe=options.get('snap', False))
+    if options.get('retime'):
+        curves = transform_curves(curves, scalex=options['retime'], translatex=options.get('retime_offset', 0.0),
+                                  autopivot=None, pivotx=options.get('retime_pivot', 1.0),
+                                  snapframe=options.get('snap', False))
+    # transforms can reorder keys, eg. a negative scale
+    curves = [curve.sorted() for curve in curves]
+
+    if options.get('flat'):
+        curves = [remove_flat(curve) for curve in curves]
+
+    error = 0.0
+    if options.get('reduce') is not None:
+        curves, error = reduce_curves(curves, options['reduce'], options.get('fps', 24.0))
+    return curves, error
+
+
+def _replace(source, target):
+    # os.replace is atomic on every platform, python 2 only has rename
+    if hasattr(os, 'replace'):
+        os.replace(source, target)
+    else:
+        if os.name == 'nt' and os.path.exists(target):
+            os.remove(target)
+        os.rename(source, target)
+
+
+def write_atomic(path, channels, fps, mode_from=None):
+    """
+    Write a channel file through a temporary file in the same folder
+
+    @param mode_from: File to copy the permissions from. mkstemp makes the
+                      temporary file readable by its owner only
+    @return: Keys written, or samples for the sampled formats, see chanfile.write
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    handle, temp = tempfile.mkstemp(suffix=os.path.splitext(path)[1], prefix='.keybatch', dir=folder)
+    os.close(handle)
+    try:
+        written = chanfile.write(temp, channels, fps=fps)
+        if mode_from is not None:
+            shutil.copymode(mode_from, temp)
+        _replace(temp, path)
+    except Exception:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return written
+
+
+def process_file(task):
+    """
+    Process one file, for the pool
+
+    @param task: (input path, output path, options dict)
+    @return: Dict of the file's results. Failures are reported in an error entry
+             rather than raised, so one bad file doesn't stop the run
+    """
+    path, output, options = task
+    fps = options.get('fps', 24.0)
+    start = timeit.default_timer()
+    result = {'file': path, 'output': output}
+    try:
+        size = os.path.getsize(path)
+        channels = chanfile.read(path, fps=fps)
+        names = list(channels)
+        curves = [channels[name].sorted() for name in names]
+        new_curves, error = process(curves, options)
+
+        written = write_atomic(output, chanfile.Channels(zip(names, new_curves), rate=channels.rate), fps,
+                               mode_from=path)
+
+        result.update(channels=len(names),
+                      keys_before=sum(len(curve) for curve in curves),
+                      keys_after=written,
+                      bytes_before=size,
+                      bytes_after=os.path.getsize(output),
+                      max_error=error)
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    result['seconds'] = timeit.default_timer() - start
+    return result
+
+
+def _output_path(path, args):
+    if args.in_place:
+        return path
+    return os.path.join(args.output_dir, os.path.basename(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('files', nargs='+', help='.kchan, .chan or .clip files')
+    parser.add_argument('--flat', action='store_true', help='remove flat keys')
+    parser.add_argument('--reduce', type=float, metavar='TOLERANCE',
+                        help='remove keys the curve reproduces within this tolerance')
+    parser.add_argument('--transform', type=float, nargs=4, metavar=('SCALEX', 'SCALEY', 'TRANSLATEX', 'TRANSLATEY'),
+                        help='scale and translate every key')
+    parser.add_argument('--pivot', default='mm', choices=keytransform.AUTOPIVOTS,
+                        help='pivot for --transform (default: %(default)s)')
+    parser.add_argument('--retime', type=float, metavar='SCALE', help='scale key times')
+    parser.add_argument('--retime-offset', type=float, default=0.0, help='frames to shift keys by when retiming')
+    parser.add_argument('--retime-pivot', type=float, default=1.0,
+                        help='frame that stays put when retiming (default: %(default)s)')
+    parser.add_argument('--snap', action='store_true', help='snap transformed key times to whole frames')
+    parser.add_argument('--fps', type=float, default=24.0, help='frames per second (default: %(default)s)')
+    parser.add_argument('--output-dir', help='folder to write the results to')
+    parser.add_argument('--in-place', action='store_true', help='overwrite the input files')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='processes to use (default: %(default)s)')
+    parser.add_argument('--report', help='write the per file results to this json file')
+    args = parser.parse_args(argv)
+
+    if args.in_place == bool(args.output_dir):
+        parser.error('give one of --output-dir or --in-place')
+    if args.flat or args.reduce is not None:
+        sampled = [path for path in args.files if chanfile.is_sampled(path)]
+        if sampled:
+            parser.error('--flat and --reduce remove keys, but %s files only hold samples - the curves would be '
+                         'sampled back out, less accurately and no smaller. Export the channels as .kchan instead'
+                         % ', '.join(sorted(set(os.path.splitext(path)[1] for path in sampled))))
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    options = {
+        'flat': args.flat,
+        'reduce': args.reduce,
+        'transform': args.transform,
+        'pivot': args.pivot,
+        'retime': args.retime,
+        'retime_offset': args.retime_offset,
+        'retime_pivot': args.retime_pivot,
+        'snap': args.snap,
+        'fps': args.fps,
+    }
+    tasks = [(path, _output_path(path, args), options) for path in args.files]
+
+    start = timeit.default_timer()
+    if args.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(tasks)))
+        try:
+            results = list(pool.imap_unordered(process_file, tasks))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [process_file(task) for task in tasks]
+    seconds = timeit.default_timer() - start
+
+    results.sort(key=lambda r: r['file'])
+    failed = 0
+    for result in results:
+        if 'error' in result:
+            failed += 1
+            print('%-40s FAILED %s' % (result['file'], result['error']))
+        else:
+            print('%-40s %9d -> %9d keys  %10d -> %10d bytes  max error %-10.4g %8.3fs' % (
+                result['file'], result['keys_before'], result['keys_after'], result['bytes_before'],
+                result['bytes_after'], result['max_error'], result['seconds']))
+
+    keys_before = sum(r.get('keys_before', 0) for r in results)
+    keys_after = sum(r.get('keys_after', 0) for r in results)
+    before = sum(r.get('bytes_before', 0) for r in results)
+    after = sum(r.get('bytes_after', 0) for r in results)
+    print('%d files, %d -> %d keys, %d -> %d bytes in %.3fs (%.3fs of work), %d failed' % (
+        len(results), keys_before, keys_after, before, after, seconds, sum(r['seconds'] for r in results),
+        failed))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'seconds': seconds, 'results': results}, f, indent=2, sort_keys=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
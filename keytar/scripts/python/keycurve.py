@@ -0,0 +1,294 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Compact keyframe curves
+
+A KeyCurve holds every key of one channel as parallel numpy arrays, so the
+keytar tools can read a channel once, do their maths in memory and write the
+result back once.
+
+Nothing in here talks to Houdini - see keycurve_hou for moving curves in and
+out of parms.
+
+"""
+
+import itertools
+
+import numpy as np
+
+
+class KeyCurve(object):
+    """
+    Keys of a single channel
+
+    In values, slopes and accels default to the out ones, ie. tied keys.
+
+    @ivar frame: Key times, in frames
+    @ivar value: Key values
+    @ivar in_value: Values coming into the keys
+    @ivar slope: Out slopes
+    @ivar in_slope: In slopes
+    @ivar accel: Out accelerations
+    @ivar in_accel: In accelerations
+    @ivar slope_auto: True where the out slope is automatic
+    @ivar in_slope_auto: True where the in slope is automatic
+    @ivar expression: Segment function of the segment leaving each key, eg. "bezier()".
+                      Empty where unknown
+    @ivar keys: Host keyframe objects the arrays were read from, or None
+    @ivar version: Number identifying this state of the curve, for caching. Call touch()
+                   after changing arrays in place
+    """
+
+    FLOAT_FIELDS = ('frame', 'value', 'in_value', 'slope', 'in_slope', 'accel', 'in_accel')
+    BOOL_FIELDS = ('slope_auto', 'in_slope_auto')
+    OBJECT_FIELDS = ('expression',)
+    FIELDS = FLOAT_FIELDS + BOOL_FIELDS + OBJECT_FIELDS
+
+    __slots__ = FIELDS + ('keys', 'version')
+
+
+    def __init__(self, frame=(), value=None, slope=None, accel=None,
+                 slope_auto=None, in_slope_auto=None, keys=None,
+                 in_value=None, in_slope=None, in_accel=None, expression=None):
+        self.frame = np.array(frame, dtype=np.float64).reshape(-1)
+        size = len(self.frame)
+
+        self.value = _column(value, size, np.float64)
+        self.slope = _column(slope, size, np.float64)
+        self.accel = _column(accel, size, np.float64)
+        self.in_value = _column(in_value, size, np.float64, self.value)
+        self.in_slope = _column(in_slope, size, np.float64, self.slope)
+        self.in_accel = _column(in_accel, size, np.float64, self.accel)
+        self.slope_auto = _column(slope_auto, size, np.bool_)
+        self.in_slope_auto = _column(in_slope_auto, size, np.bool_)
+        self.expression = _column(expression, size, object, '')
+
+        if keys is not None:
+            keys = list(keys)
+            if len(keys) != size:
+                raise ValueError("expected %d keys, got %d" % (size, len(keys)))
+        self.keys = keys
+        self.touch()
+
+
+    def touch(self):
+        """
+        Mark the curve as changed
+        """
+        self.version = next(_versions)
+
+
+    def __len__(self):
+        return len(self.frame)
+
+
+    def __repr__(self):
+        if len(self):
+            return '<KeyCurve %d keys, frames %g-%g>' % (len(self), self.frame.min(), self.frame.max())
+        return '<KeyCurve empty>'
+
+
+    def nbytes(self):
+        """
+        Rough memory held by the curve's arrays, in bytes. Host keys aren't counted
+        """
+        size = sum(getattr(self, name).nbytes for name in self.FIELDS)
+        return size + sum(len(e) for e in self.expression)
+
+
+    def copy(self):
+        """
+        Copy of the curve. Arrays are copied, host keys are shared
+        """
+        keys = list(self.keys) if self.keys is not None else None
+        return KeyCurve(keys=keys, **dict((name, getattr(self, name).copy()) for name in self.FIELDS))
+
+
+    def take(self, indices):
+        """
+        New curve made of the keys at the given indices (or boolean mask)
+        """
+        indices = np.arange(len(self))[indices]
+        keys = [self.keys[i] for i in indices] if self.keys is not None else None
+        return KeyCurve(keys=keys, **dict((name, getattr(self, name)[indices]) for name in self.FIELDS))
+
+
+    def find(self, frames):
+        """
+        Indices of the keys sitting on the given frames
+
+        @param frames: Sequence of key times
+        @return: Integer array of key indices. Frames without a key are ignored
+        """
+        frames = np.asarray(frames, dtype=np.float64).reshape(-1)
+        if not len(self) or not len(frames):
+            return np.zeros(0, dtype=np.intp)
+
+        order = np.argsort(self.frame, kind='mergesort')
+        sorted_frames = self.frame[order]
+        pos = np.searchsorted(sorted_frames, frames)
+        pos = np.clip(pos, 0, len(sorted_frames) - 1)
+        hit = sorted_frames[pos] == frames
+        return np.unique(order[pos[hit]])
+
+
+    def neighbours(self, frames):
+        """
+        The keys either side of some frames, ignoring any key sitting right on them
+
+        The curve has to be sorted by time.
+
+        @param frames: Sequence of frames
+        @return: (previous key indices, next key indices, mask of frames that have both)
+        """
+        frames = np.asarray(frames, dtype=np.float64).reshape(-1)
+        previous = np.searchsorted(self.frame, frames, side='left') - 1
+        following = np.searchsorted(self.frame, frames, side='right')
+        found = (previous >= 0) & (following < len(self))
+        return previous, following, found
+
+
+    def changed(self, other):
+        """
+        Boolean mask of keys that differ from the same index in another curve
+
+        Both curves must be the same length, eg. a curve and a transformed copy
+        of it.
+        """
+        if len(self) != len(other):
+            raise ValueError("curves have different key counts")
+
+        mask = np.zeros(len(self), dtype=np.bool_)
+        for name in self.FIELDS:
+            mask |= getattr(self, name) != getattr(other, name)
+        return mask
+
+
+    def sorted(self):
+        """
+        Copy of the curve with the keys in time order
+        """
+        return self.take(np.argsort(self.frame, kind='mergesort'))
+
+
+def concatenate(curves):
+    """
+    Join several curves into one, keeping the key order
+
+    Host keys are only kept if every curve has them.
+    """
+    curves = list(curves)
+    fields = {}
+    for name in KeyCurve.FIELDS:
+        fields[name] = np.concatenate([getattr(curve, name) for curve in curves] + [np.zeros(0, dtype=field_dtype(name))])
+
+    keys = None
+    if all(curve.keys is not None for curve in curves):
+        keys = [key for curve in curves for key in curve.keys]
+    return KeyCurve(keys=keys, **fields)
+
+
+COLLISIONS = ('keep-moved', 'keep-static', 'average')
+
+
+def apply_changes(original, curve, collisions='keep-moved'):
+    """
+    The curve a channel ends up with when a modified curve is written over it
+
+    Keys that changed are merged with the ones that didn't in a single sorted
+    pass. Where keys end up on the same frame the collision policy decides
+    what is left:
+
+     - keep-moved: the changed key wins. If several changed keys land
+       together the last one wins
+     - keep-static: a key that didn't change wins over changed ones
+     - average: one key with the mean values, slopes and accels of all of them
+
+    @param original: KeyCurve as read from the channel
+    @param curve: Modified copy of the original, with the same keys
+    @param collisions: One of COLLISIONS
+    @return: (final curve sorted by time, boolean mask of changed keys,
+              index of the key each final key came from)
+    """
+    if collisions not in COLLISIONS:
+        raise ValueError("unknown collision policy %r, expected one of %s" % (collisions, ', '.join(COLLISIONS)))
+
+    changed = original.changed(curve)
+
+    # sort by frame, then priority, then original order - so the key that
+    # should survive a collision is always the last one on its frame
+    priority = changed if collisions != 'keep-static' else ~changed
+    order = np.lexsort((np.arange(len(curve)), priority, curve.frame))
+    merged = curve.take(order)
+
+    if not len(merged):
+        return merged, changed, order
+
+    starts = np.concatenate(([True], merged.frame[1:] != merged.frame[:-1])).nonzero()[0]
+    ends = np.concatenate((starts[1:], [len(merged)])) - 1
+    final = merged.take(ends)
+
+    if collisions == 'average':
+        counts = (ends - starts + 1).astype(np.float64)
+        for name in ('value', 'in_value', 'slope', 'in_slope', 'accel', 'in_accel'):
+            setattr(final, name, np.add.reduceat(getattr(merged, name), starts) / counts)
+
+    return final, changed, order[ends]
+
+
+def flat_runs(values):
+    """
+    Find runs of keys with the same value
+
+    In every run of two or more equal keys the first key starts the run and
+    the keys after it, up to but not including the last, are redundant.
+
+    @param values: Key values in time order
+    @return: (mask of run starts, mask of redundant keys)
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(-1)
+    # same as the next key, and same as the previous one
+    same_next = np.zeros(len(values), dtype=np.bool_)
+    same_next[:-1] = values[1:] == values[:-1]
+    same_prev = np.zeros(len(values), dtype=np.bool_)
+    same_prev[1:] = same_next[:-1]
+    return same_next & ~same_prev, same_next & same_prev
+
+
+_versions = itertools.count()
+
+
+def field_dtype(name):
+    """
+    numpy dtype of a KeyCurve field
+    """
+    if name in KeyCurve.BOOL_FIELDS:
+        return np.bool_
+    if name in KeyCurve.OBJECT_FIELDS:
+        return object
+    return np.float64
+
+
+def _column(data, size, dtype, default=None):
+    if data is None:
+        if default is None:
+            return np.zeros(size, dtype=dtype)
+        column = np.empty(size, dtype=dtype)
+        column[:] = default
+        return column
+
+    column = np.array(data, dtype=dtype).reshape(-1)
+    if len(column) != size:
+        raise ValueError("expected %d values, got %d" % (size, len(column)))
+    return column
+
+
+def round_frames(frames):
+    """
+    Round frames to whole numbers, halves away from zero
+
+    Matches python's builtin round() rather than numpy's round-half-even, so
+    snapped keys land where they always have.
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    return np.copysign(np.floor(np.abs(frames) + 0.5), frames)
@@ -0,0 +1,299 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Move KeyCurves in and out of Houdini parms
+
+Each key is read once when a curve is built, and changes are written back
+with as few parm calls as possible.
+
+"""
+
+import hou
+import numpy as np
+
+import chanfile
+import keycurve
+import keyedit
+import keytrace
+
+
+def read_keyframes(keys):
+    """
+    Build a KeyCurve from a sequence of hou.Keyframe
+
+    @param keys: hou.Keyframe objects, eg. from parm.keyframes()
+    @return: KeyCurve, holding on to the keys for write back
+    """
+    keys = list(keys)
+    # a pass per field is cheaper in Python than appending to ten lists per key
+    fields = {
+        'frame': [key.frame() for key in keys],
+        'value': [key.value() for key in keys],
+        'in_value': [key.inValue() for key in keys],
+        'slope': [key.slope() for key in keys],
+        'in_slope': [key.inSlope() for key in keys],
+        'accel': [key.accel() for key in keys],
+        'in_accel': [key.inAccel() for key in keys],
+        'slope_auto': [key.isSlopeAuto() for key in keys],
+        'in_slope_auto': [key.isInSlopeAuto() for key in keys],
+        'expression': [key.expression() for key in keys],
+    }
+
+    return keycurve.KeyCurve(keys=keys, **fields)
+
+
+def read_values(parm, keys=None):
+    """
+    KeyCurve of just the times and values of a parm's keys
+
+    Cheaper than read_parm when slopes don't matter, but can't be written back.
+
+    @param keys: The parm's hou.Keyframes, if already read
+    """
+    if keys is None:
+        keys = parm.keyframes()
+    return keycurve.KeyCurve([key.frame() for key in keys], [key.value() for key in keys])
+
+
+def read_parm(parm):
+    """
+    KeyCurve of every key on a parm
+    """
+    return read_keyframes(parm.keyframes())
+
+
+class WriteStats(object):
+    """
+    Tally of parm calls made while writing curves back
+
+    @ivar parms: Parms that were written to
+    @ivar keys: Keys that changed
+    @ivar calls: Parm calls actually made
+    @ivar per_key_calls: Parm calls a per key delete / set would have made
+    """
+
+    def __init__(self):
+        self.parms = 0
+        self.keys = 0
+        self.calls = 0
+        self.per_key_calls = 0
+
+
+    def __str__(self):
+        return '%d keys on %d parms, %d parm calls (%d saved)' % (
+            self.keys, self.parms, self.calls, self.saved())
+
+
+    def saved(self):
+        return self.per_key_calls - self.calls
+
+
+def _in_side_needed(new_in, new_out, old_in, old_out, keys, is_tied):
+    """
+    Mask of the keys whose in values, slopes or accels have to be set
+
+    A tied in side follows the out side, an untied one stays where it was.
+    Keys are only asked whether they're tied when it could go either way.
+
+    @param keys: hou.Keyframes, lined up with the arrays
+    @param is_tied: Name of the getter, eg. 'isValueTied'
+    """
+    moved_in = new_in != old_in
+    needed = moved_in.copy()
+    # an in side that differed from the out side was never tied
+    unsure = (old_in == old_out) & (moved_in != (new_in != new_out))
+    for i in unsure.nonzero()[0]:
+        if getattr(keys[i], is_tied)():
+            needed[i] = new_in[i] != new_out[i]
+    return needed
+
+
+def _update_key(curve, i):
+    """
+    hou.Keyframe for key i of a curve, carrying the curve's values
+    """
+    existing = curve.keys is not None
+    key = curve.keys[i] if existing else hou.Keyframe()
+    key.setFrame(float(curve.frame[i]))
+    key.setValue(float(curve.value[i]))
+    # only untie in values that differ, or that were already untied
+    if curve.in_value[i] != curve.value[i] or (existing and not key.isValueTied()):
+        key.setInValue(float(curve.in_value[i]))
+
+    if curve.slope_auto[i]:
+        key.setSlopeAuto(True)
+        key.setInSlopeAuto(bool(curve.in_slope_auto[i]))
+    else:
+        key.setAccel(float(curve.accel[i]))
+        key.setSlope(float(curve.slope[i]))
+        if curve.in_slope[i] != curve.slope[i] or (existing and not key.isSlopeTied()):
+            key.setInSlope(float(curve.in_slope[i]))
+        if curve.in_accel[i] != curve.accel[i] or (existing and not key.isAccelTied()):
+            key.setInAccel(float(curve.in_accel[i]))
+        # an untied in slope can still be auto
+        if curve.in_slope_auto[i]:
+            key.setInSlopeAuto(True)
+
+    expression = curve.expression[i]
+    if expression and expression != key.expression():
+        key.setExpression(expression, hou.exprLanguage.Hscript)
+    return key
+
+
+def _update_read_keys(curve, indices, read, sources):
+    """
+    Host keys of some keys of a curve, setting only what differs from the keys they were read from
+
+    @param indices: Keys of the curve to update
+    @param read: Curve the keys were read from
+    @param sources: Index in read of each of those keys
+    @return: List of hou.Keyframe
+    """
+    new = curve.take(indices)
+    old = read.take(sources)
+    keys = new.keys
+
+    def set_where(mask, setter, values):
+        indices = mask.nonzero()[0]
+        for i, value in zip(indices.tolist(), values[indices].tolist()):
+            getattr(keys[i], setter)(value)
+
+    set_where(new.frame != old.frame, 'setFrame', new.frame)
+    set_where(new.value != old.value, 'setValue', new.value)
+    set_where(_in_side_needed(new.in_value, new.value, old.in_value, old.value, keys, 'isValueTied'),
+              'setInValue', new.in_value)
+
+    auto = new.slope_auto
+    for i in (auto & ~old.slope_auto).nonzero()[0]:
+        keys[i].setSlopeAuto(True)
+    set_where(~auto & (new.accel != old.accel), 'setAccel', new.accel)
+    set_where(~auto & ((new.slope != old.slope) | old.slope_auto), 'setSlope', new.slope)
+    in_slopes = ~auto & _in_side_needed(new.in_slope, new.slope, old.in_slope, old.slope, keys, 'isSlopeTied')
+    set_where(in_slopes, 'setInSlope', new.in_slope)
+    set_where(~auto & _in_side_needed(new.in_accel, new.accel, old.in_accel, old.accel, keys, 'isAccelTied'),
+              'setInAccel', new.in_accel)
+    # setting the in slope turns in auto off
+    for i in (new.in_slope_auto != (old.in_slope_auto & ~in_slopes)).nonzero()[0]:
+        keys[i].setInSlopeAuto(bool(new.in_slope_auto[i]))
+
+    for i in ((new.expression != old.expression) & (new.expression != '')).nonzero()[0]:
+        keys[i].setExpression(new.expression[i], hou.exprLanguage.Hscript)
+    return keys
+
+
+def to_keyframes(curve):
+    """
+    New hou.Keyframes for every key of a curve, ignoring any keys it was read from
+    """
+    if curve.keys is not None:
+        curve = curve.copy()
+        curve.keys = None
+    return [_update_key(curve, i) for i in range(len(curve))]
+
+
+def write_curve(parm, original, curve, stats=None, collisions='keep-moved'):
+    """
+    Write the changes between two versions of a curve back to the parm
+
+    The final curve is worked out in memory and applied in one go - keys that
+    only changed in place are set with a single setKeyframes call, anything
+    that moved replaces the whole channel. Inside a keyedit transaction the
+    write is buffered until the transaction commits.
+
+    @param parm: hou.Parm the original curve was read from
+    @param original: KeyCurve as read from the parm
+    @param curve: Modified copy of the original, with the same keys
+    @param stats: Optional WriteStats to add to
+    @param collisions: What to keep when keys land on the same frame, see keycurve.COLLISIONS
+    @return: Number of keys changed
+    """
+    final, changed, source = keycurve.apply_changes(original, curve, collisions)
+    count = int(changed.sum())
+    if not count:
+        return 0
+    keytrace.add_keys(count)
+
+    if (original.frame[changed] == curve.frame[changed]).all():
+        indices = changed.nonzero()[0]
+        keyedit.set_keyframes(parm, _update_read_keys(curve, indices, original, indices))
+        calls = 1
+    else:
+        keyedit.replace_keyframes(parm, _update_read_keys(final, np.arange(len(final)), original, source))
+        calls = 2
+
+    if stats is not None:
+        stats.parms += 1
+        stats.keys += count
+        stats.calls += calls
+        # a delete and a set for every changed key
+        stats.per_key_calls += count * 2
+
+    return count
+
+
+def export_channels(path, parms):
+    """
+    Write the keys of some parms to a .kchan file, see chanfile
+
+    @param parms: hou.Parms to write, named by their paths in the file
+    @return: Number of keys written
+    """
+    channels = chanfile.Channels((parm.path(), read_parm(parm)) for parm in parms)
+    return chanfile.write_kchan(path, channels)
+
+
+def import_channels(path):
+    """
+    Replace the keys of the parms named in a .kchan file with the file's keys
+
+    Inside a keyedit transaction nothing is written until that transaction
+    ends.
+
+    @return: (parms written, names of the channels with no parm to go to)
+    """
+    written = 0
+    missing = []
+    for name, curve in chanfile.read_kchan(path).items():
+        parm = hou.parm(name)
+        if parm is None:
+            missing.append(name)
+            continue
+        keyedit.replace_keyframes(parm, to_keyframes(curve.sorted()))
+        keytrace.add_keys(len(curve))
+        written += 1
+    return written, missing
+
+
+def export_channels_ui():
+    """
+    Export the animated parms of the selected nodes to a .kchan file
+    """
+    parms = [parm for node in hou.selectedNodes() for parm in node.parms() if parm.isTimeDependent()]
+    if not parms:
+        hou.ui.displayMessage('Select some animated nodes to export')
+        return
+    path = hou.ui.selectFile(title='Export Keys', pattern='*.kchan', chooser_mode=hou.fileChooserMode.Write)
+    if not path:
+        return
+    with keytrace.operation('Export Keys'):
+        keys = export_channels(hou.expandString(path), parms)
+    print 'export keys: %d keys on %d parms' % (keys, len(parms))
+
+
+def import_channels_ui():
+    """
+    Load the keys of a .kchan file back onto the parms they were exported from
+    """
+    path = hou.ui.selectFile(title='Import Keys', pattern='*.kchan', chooser_mode=hou.fileChooserMode.Read)
+    if not path:
+        return
+    try:
+        with keyedit.transaction('Import Keys'):
+            written, missing = import_channels(hou.expandString(path))
+    except (IOError, ValueError) as e:
+        hou.ui.displayMessage(str(e), severity=hou.severityType.Error)
+        return
+    print 'import keys: %d parms' % written
+    if missing:
+        hou.ui.displayMessage('No parms to load %d channels onto' % len(missing),
+                              details='\n'.join(missing), severity=hou.severityType.Warning)
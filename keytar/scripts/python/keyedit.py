@@ -0,0 +1,222 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Buffered key edits, committed in one pass as one undo entry
+
+Every keytar tool writes its keys through the functions here. Outside of a
+transaction they go straight to Houdini. Inside one they are buffered and
+applied together when the transaction ends, under a single undo group:
+
+    with keyedit.transaction('Transform Keys'):
+        keyedit.set_keyframes(parm, keys)
+        keyedit.hscript('chkey ...')
+
+Buffered edits to the same parm are merged, so a parm that is written to
+several times still only gets one delete and one set, and the undo entry
+holds as few steps as possible.
+
+Transactions nest - an inner transaction joins the outer one and everything
+is committed when the outermost ends. Each outermost transaction is one
+operation for keytrace. Reads inside a transaction see the
+scene as it was when the transaction started, so tools read everything they
+need before writing anything.
+
+If the block raises, nothing buffered is applied.
+
+"""
+
+import contextlib
+
+import hou
+
+import keytrace
+
+
+class Transaction(object):
+    """
+    Key edits waiting to be applied
+
+    @ivar label: Undo entry label
+    @ivar edits: Number of edits buffered, before merging
+    @ivar calls: Houdini calls made by commit
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.edits = 0
+        self.calls = 0
+        # ordered list of [kind, parm, payload]
+        self._ops = []
+        # parm path: index in _ops of its latest keyframe op
+        self._parm_ops = {}
+
+
+    def __str__(self):
+        return '%s: %d edits, %d calls' % (self.label, self.edits, self.calls)
+
+
+    def __len__(self):
+        return len(self._ops)
+
+
+    def _keys_op(self, parm, keys, replace):
+        self.edits += 1
+        path = parm.path()
+        index = self._parm_ops.get(path)
+        if index is not None and not replace:
+            # more keys for a parm already being set or replaced
+            self._ops[index][2].extend(keys)
+            return
+        if index is not None and replace:
+            # a replace wipes out whatever was set before it
+            self._ops[index][0] = None
+        self._parm_ops[path] = len(self._ops)
+        self._ops.append(['replace' if replace else 'set', parm, list(keys)])
+
+
+    def set_keyframes(self, parm, keys):
+        self._keys_op(parm, keys, replace=False)
+
+
+    def replace_keyframes(self, parm, keys):
+        self._keys_op(parm, keys, replace=True)
+
+
+    def delete_keyframe(self, parm, frame):
+        self.edits += 1
+        self._parm_ops.pop(parm.path(), None)
+        self._ops.append(['delete', parm, frame])
+
+
+    def set_value(self, parm, value):
+        self.edits += 1
+        self._parm_ops.pop(parm.path(), None)
+        self._ops.append(['value', parm, value])
+
+
+    def hscript(self, command):
+        self.edits += 1
+        # the command could touch any parm, so later keys can't merge back past it
+        self._parm_ops.clear()
+        self._ops.append(['hscript', None, command])
+
+
+    def commit(self):
+        """
+        Apply every buffered edit under one undo group
+
+        @return: Houdini calls made
+        """
+        ops, self._ops, self._parm_ops = self._ops, [], {}
+        ops = [op for op in ops if op[0] is not None]
+        if not ops:
+            return 0
+
+        calls = 0
+        with keytrace.phase('commit'), hou.undos.group(self.label):
+            for kind, parm, payload in ops:
+                if kind == 'set':
+                    parm.setKeyframes(payload)
+                elif kind == 'replace':
+                    parm.deleteAllKeyframes()
+                    parm.setKeyframes(payload)
+                    calls += 1
+                elif kind == 'delete':
+                    parm.deleteKeyframeAtFrame(payload)
+                elif kind == 'value':
+                    parm.set(payload)
+                else:
+                    hou.hscript(payload)
+                calls += 1
+        self.calls += calls
+        return calls
+
+
+# the outermost transaction in progress, if any
+_current = None
+
+
+def current():
+    """
+    The transaction in progress, or None
+    """
+    return _current
+
+
+@contextlib.contextmanager
+def transaction(label):
+    """
+    Buffer every key edit made in the block and commit them as one undo entry
+
+    Joins the transaction already in progress if there is one, the outer
+    label is used for the undo entry.
+
+    @param label: Undo entry label
+    @return: Context manager giving the Transaction
+    """
+    global _current
+    if _current is not None:
+        yield _current
+        return
+
+    _current = Transaction(label)
+    try:
+        with keytrace.operation(label):
+            yield _current
+            edit = _current
+            # anything the commit sets off shouldn't buffer into it
+            _current = None
+            edit.commit()
+    finally:
+        _current = None
+
+
+def set_keyframes(parm, keys):
+    """
+    Set some keys on a parm, keeping the others
+    """
+    if _current is not None:
+        _current.set_keyframes(parm, keys)
+    else:
+        parm.setKeyframes(keys)
+
+
+def replace_keyframes(parm, keys):
+    """
+    Replace every key of a parm
+    """
+    if _current is not None:
+        _current.replace_keyframes(parm, keys)
+    else:
+        parm.deleteAllKeyframes()
+        parm.setKeyframes(keys)
+
+
+def delete_keyframe(parm, frame):
+    """
+    Delete the key of a parm at a frame
+    """
+    if _current is not None:
+        _current.delete_keyframe(parm, frame)
+    else:
+        parm.deleteKeyframeAtFrame(frame)
+
+
+def set_value(parm, value):
+    """
+    Set the value of a parm without animation
+    """
+    if _current is not None:
+        _current.set_value(parm, value)
+    else:
+        parm.set(value)
+
+
+def hscript(command):
+    """
+    Run an hscript command that edits keys, eg. chkey
+    """
+    if _current is not None:
+        _current.hscript(command)
+    else:
+        hou.hscript(command)
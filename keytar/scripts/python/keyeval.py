@@ -0,0 +1,265 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Evaluate KeyCurves without Houdini
+
+Reproduces Houdini's channel segment functions on whole arrays of frames, so
+tools can sample thousands of frames from a curve snapshot rather than
+calling parm.evalAtFrame for each one.
+
+Each key's expression is the segment function leaving it. The supported ones
+are:
+
+    constant()  linear()  qlinear()  cubic()  bezier()  spline()
+    ease()  easein()  easeout()  easeinp(p)  easeoutp(p)
+
+Segments using anything else (eg. a real hscript or python expression)
+evaluate to NaN - callers should fall back to parm.evalAtFrame there.
+
+Slopes are in units per second and accels are handle lengths in seconds, as
+on hou.Keyframe. The curve must be sorted by time.
+
+Host independent - bench/verify_evaluator.py checks it against a live
+Houdini session, and bench/check_evaluator.py against samples captured from
+one, without Houdini.
+
+"""
+
+import collections
+import hashlib
+import re
+
+import numpy as np
+
+SEGMENT_FUNCTIONS = ('constant', 'linear', 'qlinear', 'cubic', 'bezier', 'spline',
+                     'ease', 'easein', 'easeout', 'easeinp', 'easeoutp')
+
+# keys with no expression read back from a host are taken as bezier, the
+# Houdini default
+DEFAULT_FUNCTION = 'bezier'
+
+# evaluated results kept around, keyed by curve version and a digest of the
+# frames. Bounded by the bytes held in results, results bigger than a quarter
+# of it aren't kept at all
+CACHE_BYTES = 32 * 1024 * 1024
+
+_EXPRESSION = re.compile(r'^\s*(\w+)\s*\(\s*([^()]*?)\s*\)\s*;?\s*$')
+
+_cache = collections.OrderedDict()
+_cache_bytes = [0]
+
+# parse_expression results, there are only ever a handful of distinct expressions
+_parsed = {}
+
+
+def parse_expression(expression):
+    """
+    Segment function and argument of a key expression
+
+    @param expression: Key expression, eg. "bezier()" or "easeinp(2)"
+    @return: (function name, float argument or None). The name is None for
+             expressions this module can't evaluate
+    """
+    try:
+        return _parsed[expression]
+    except KeyError:
+        pass
+    result = _parsed[expression] = _parse_expression(expression)
+    return result
+
+
+def _parse_expression(expression):
+    if not expression:
+        return DEFAULT_FUNCTION, None
+
+    match = _EXPRESSION.match(expression)
+    if not match or match.group(1) not in SEGMENT_FUNCTIONS:
+        return None, None
+
+    name, argument = match.groups()
+    if not argument:
+        return name, None
+    try:
+        return name, float(argument)
+    except ValueError:
+        return None, None
+
+
+def supported(curve):
+    """
+    Boolean mask of the keys whose outgoing segment can be evaluated here
+    """
+    return np.array([parse_expression(e)[0] is not None for e in curve.expression], dtype=np.bool_)
+
+
+def clear_cache():
+    _cache.clear()
+    _cache_bytes[0] = 0
+
+
+def evaluate(curve, frames, fps=24.0):
+    """
+    Value of a curve at some frames
+
+    Results are cached against the curve's version, so asking again for the
+    same frames of an unchanged curve is free. Call curve.touch() after
+    editing its arrays in place.
+
+    @param curve: Time sorted KeyCurve
+    @param frames: Frame numbers to evaluate at
+    @param fps: Frames per second, for converting slopes and accels
+    @return: Read only float array, one value per frame. NaN on segments
+             using an unsupported expression, and everywhere on an empty curve
+    """
+    frames = np.ascontiguousarray(frames, dtype=np.float64).reshape(-1)
+    cache_key = (curve.version, float(fps), len(frames), hashlib.sha1(frames).digest())
+    result = _cache.get(cache_key)
+    if result is not None:
+        return result
+
+    result = _evaluate(curve, frames, float(fps))
+    result.setflags(write=False)
+    if result.nbytes * 4 <= CACHE_BYTES:
+        _cache[cache_key] = result
+        _cache_bytes[0] += result.nbytes
+        while _cache_bytes[0] > CACHE_BYTES:
+            _cache_bytes[0] -= _cache.popitem(last=False)[1].nbytes
+    return result
+
+
+def _evaluate(curve, frames, fps):
+    count = len(curve)
+    result = np.full(len(frames), np.nan)
+    if not count:
+        return result
+
+    # hold the first and last values outside of the keys
+    before = frames <= curve.frame[0]
+    after = frames >= curve.frame[-1]
+    result[before] = curve.value[0]
+    result[after] = curve.value[-1]
+
+    inside = ~(before | after)
+    if count < 2 or not inside.any():
+        return result
+
+    # segment i runs from key i to key i + 1
+    segment = np.searchsorted(curve.frame, frames[inside], side='right') - 1
+    functions = [parse_expression(e) for e in curve.expression[:-1]]
+    arguments = np.array([f[1] if f[1] is not None else np.nan for f in functions])
+
+    t = frames[inside]
+    values = np.full(len(t), np.nan)
+    for name in set(f[0] for f in functions if f[0] is not None):
+        # segments using this function, and the frames that fall in them
+        names = np.array([f[0] == name for f in functions], dtype=np.bool_)
+        mask = names[segment]
+        if not mask.any():
+            continue
+        values[mask] = _segment(name, curve, segment[mask], t[mask], arguments[segment[mask]], fps)
+
+    result[inside] = values
+    return result
+
+
+def _segment(name, curve, i, t, argument, fps):
+    """
+    Values at times t on segments starting at keys i, all using one function
+    """
+    j = i + 1
+    t0 = curve.frame[i]
+    t1 = curve.frame[j]
+    v0 = curve.value[i]
+    v1 = curve.in_value[j]
+    u = (t - t0) / (t1 - t0)
+
+    if name == 'constant':
+        return v0
+    if name in ('linear', 'qlinear'):
+        # qlinear blends rotations as quaternions, which is plain linear on one channel
+        return v0 + (v1 - v0) * u
+    if name == 'ease':
+        return v0 + (v1 - v0) * u * u * (3 - 2 * u)
+    if name == 'easein':
+        return v0 + (v1 - v0) * u * u
+    if name == 'easeout':
+        return v0 + (v1 - v0) * (1 - (1 - u) ** 2)
+    if name == 'easeinp':
+        power = np.where(np.isnan(argument), 2.0, argument)
+        return v0 + (v1 - v0) * u ** power
+    if name == 'easeoutp':
+        power = np.where(np.isnan(argument), 2.0, argument)
+        return v0 + (v1 - v0) * (1 - (1 - u) ** power)
+
+    # the rest use slopes, so work in seconds
+    length = (t1 - t0) / fps
+    if name == 'cubic':
+        return _hermite(u, v0, v1, curve.slope[i] * length, curve.in_slope[j] * length)
+    if name == 'spline':
+        return _spline(curve, i, u)
+    if name == 'bezier':
+        return _bezier(curve, i, u, length)
+    raise ValueError("unknown segment function %r" % name)
+
+
+def _hermite(u, v0, v1, m0, m1):
+    u2 = u * u
+    u3 = u2 * u
+    return ((2 * u3 - 3 * u2 + 1) * v0 + (u3 - 2 * u2 + u) * m0 +
+            (-2 * u3 + 3 * u2) * v1 + (u3 - u2) * m1)
+
+
+def _spline(curve, i, u):
+    """
+    Catmull-Rom through the neighbouring keys, with one sided ends
+    """
+    last = len(curve) - 1
+    h = np.maximum(i - 1, 0)
+    j = i + 1
+    k = np.minimum(i + 2, last)
+
+    frame = curve.frame
+    value = curve.value
+    length = frame[j] - frame[i]
+
+    # tangents as value change per segment length
+    m0 = (value[j] - value[h]) / (frame[j] - frame[h]) * length
+    m1 = (value[k] - value[i]) / (frame[k] - frame[i]) * length
+    return _hermite(u, value[i], curve.in_value[j], m0, m1)
+
+
+def _bezier(curve, i, u, length, iterations=12):
+    """
+    Cubic bezier through the key handles
+
+    Handles stick out accel seconds from each key along its slope, clamped to
+    the segment. The time curve is inverted with a few Newton steps, falling
+    back to bisection where the derivative is flat.
+    """
+    j = i + 1
+    v0 = curve.value[i]
+    v1 = curve.in_value[j]
+
+    # handle lengths as a fraction of the segment. the value handles use the
+    # same clamped lengths, so a handle keeps its slope when it is cut short
+    a0 = np.clip(curve.accel[i] / length, 0.0, 1.0)
+    a1 = np.clip(curve.in_accel[j] / length, 0.0, 1.0)
+    p1 = v0 + curve.slope[i] * a0 * length
+    p2 = v1 - curve.in_slope[j] * a1 * length
+
+    # x(s) = 3(1-s)^2 s a0 + 3(1-s) s^2 (1 - a1) + s^3, solve x(s) = u
+    s = u.copy()
+    low = np.zeros_like(u)
+    high = np.ones_like(u)
+    for _ in range(iterations):
+        r = 1 - s
+        x = 3 * r * r * s * a0 + 3 * r * s * s * (1 - a1) + s * s * s
+        dx = 3 * r * r * a0 + 6 * r * s * (1 - a1 - a0) + 3 * s * s * a1
+        error = x - u
+        high = np.where(error > 0, s, high)
+        low = np.where(error <= 0, s, low)
+        newton = s - error / np.where(dx == 0, 1.0, dx)
+        s = np.where((dx > 1e-9) & (newton >= low) & (newton <= high), newton, (low + high) / 2)
+
+    r = 1 - s
+    return r * r * r * v0 + 3 * r * r * s * p1 + 3 * r * s * s * p2 + s * s * s * v1
@@ -0,0 +1,168 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Tolerance based key reduction
+
+Removes every key the rest of the curve can reproduce within a tolerance.
+Where keys are removed the segment spanning the gap becomes linear, segments
+that keep both their keys are left alone - so flat runs are the special
+case of a gap with zero error.
+
+The fit is top down, like Ramer-Douglas-Peucker: each channel starts as its
+first and last key, and every span whose error is over the tolerance is
+split at the key nearest its worst sample, until none are. All spans of all
+channels are split together as one array pass per round.
+
+The original curve is sampled at every key and at a few points between
+neighbouring keys, using keyeval. Spans over segments keyeval can't evaluate
+keep all their keys.
+
+Host independent - see remove_flat_keys for the Houdini side.
+
+"""
+
+import numpy as np
+
+import keyeval
+
+
+class Reduction(object):
+    """
+    What reducing one curve does
+
+    @ivar keep: Boolean mask of the keys that stay
+    @ivar linear: Boolean mask of the kept keys whose outgoing segment has to become linear
+    @ivar error: Largest difference between the original and reduced curve, over the samples
+    """
+
+    __slots__ = ('keep', 'linear', 'error')
+
+
+    def __init__(self, keep, linear, error):
+        self.keep = keep
+        self.linear = linear
+        self.error = error
+
+
+    def __repr__(self):
+        return '<Reduction %d of %d keys removed, max error %g>' % (self.removed(), len(self.keep), self.error)
+
+
+    def removed(self):
+        return int(len(self.keep) - self.keep.sum())
+
+
+def _samples(curves, samples, fps):
+    """
+    Sample every curve at its keys and between them
+
+    @return: (frames, values, key before each sample as a global key index)
+    """
+    frames = []
+    values = []
+    owners = []
+    u = np.arange(samples + 1, dtype=np.float64) / (samples + 1)
+    offset = 0
+    for curve in curves:
+        count = len(curve)
+        if count:
+            # every key, then samples inside each segment - the last key gets none
+            f0 = curve.frame[:, None]
+            f1 = np.append(curve.frame[1:], curve.frame[-1])[:, None]
+            curve_frames = (f0 + (f1 - f0) * u).reshape(-1)[:-samples or None]
+            owner = np.repeat(np.arange(count), samples + 1)[:len(curve_frames)]
+
+            curve_values = np.array(keyeval.evaluate(curve, curve_frames, fps))
+            # exactly on a key the curve is the key's own value
+            on_key = np.arange(len(curve_frames)) % (samples + 1) == 0
+            curve_values[on_key] = curve.value[owner[on_key]]
+
+            frames.append(curve_frames)
+            values.append(curve_values)
+            owners.append(owner + offset)
+        offset += count
+
+    if not frames:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.intp)
+    return np.concatenate(frames), np.concatenate(values), np.concatenate(owners)
+
+
+def reduce_curves(curves, tolerance, fps=24.0, samples=3):
+    """
+    Reduce a batch of curves
+
+    @param curves: Time sorted KeyCurves
+    @param tolerance: Largest value difference allowed from the original curve
+    @param fps: Frames per second, for evaluating slopes
+    @param samples: Points sampled between each pair of neighbouring keys
+    @return: List of Reduction, one per curve
+    """
+    curves = list(curves)
+    offsets = np.cumsum([0] + [len(curve) for curve in curves])
+    total = int(offsets[-1])
+    key_frame = np.concatenate([curve.frame for curve in curves] + [np.zeros(0)])
+    key_value = np.concatenate([curve.value for curve in curves] + [np.zeros(0)])
+
+    frames, values, owner = _samples(curves, samples, fps)
+
+    keep = np.zeros(total, dtype=np.bool_)
+    lengths = np.diff(offsets)
+    keep[offsets[:-1][lengths > 0]] = True
+    keep[offsets[1:][lengths > 0] - 1] = True
+
+    # keys starting a segment that can't be sampled can't go, and neither can the key after
+    bad = np.zeros(total, dtype=np.bool_)
+    bad[owner[np.isnan(values)]] = True
+    keep |= bad
+    keep[1:] |= bad[:-1]
+
+    error = np.zeros(len(frames))
+    while True:
+        kept = keep.nonzero()[0]
+        # span of every sample: from the last kept key at or before its owner to the next kept one
+        span = np.cumsum(keep)[owner] - 1
+        start = kept[span]
+        end = kept[np.minimum(span + 1, len(kept) - 1)]
+        gap = end - start > 1
+
+        f0 = key_frame[start]
+        f1 = key_frame[end]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            blend = np.where(f1 > f0, (frames - f0) / (f1 - f0), 0.0)
+        line = key_value[start] + (key_value[end] - key_value[start]) * blend
+        error = np.where(gap, np.abs(values - line), 0.0)
+
+        over = error > tolerance
+        if not over.any():
+            break
+
+        # worst sample of every span that is over, split at the key nearest to it
+        candidates = over.nonzero()[0]
+        order = candidates[np.lexsort((error[candidates], span[candidates]))]
+        worst = order[np.append(span[order][1:] != span[order][:-1], True)]
+
+        split = owner[worst]
+        split = np.where(split > start[worst], split, split + 1)
+        keep[split] = True
+
+    # spans that lost keys get a linear segment from their first key
+    linear = np.zeros(total, dtype=np.bool_)
+    kept = keep.nonzero()[0]
+    if len(kept) > 1:
+        starts = kept[:-1][np.diff(kept) > 1]
+        linear[starts] = True
+
+    channel_error = np.zeros(len(curves))
+    if len(frames):
+        channel = np.searchsorted(offsets, owner, side='right') - 1
+        np.maximum.at(channel_error, channel, error)
+
+    return [Reduction(keep[s:e].copy(), linear[s:e].copy(), float(channel_error[i]))
+            for i, (s, e) in enumerate(zip(offsets[:-1], offsets[1:]))]
+
+
+def reduce_curve(curve, tolerance, fps=24.0, samples=3):
+    """
+    Reduce a single curve, see reduce_curves
+    """
+    return reduce_curves([curve], tolerance, fps, samples)[0]
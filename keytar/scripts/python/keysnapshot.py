@@ -0,0 +1,263 @@
+# -*- coding: UTF-8 -*-
+"""
+Snapshots of curves taken before each keytar operation
+
+Once a tool knows which curves it is going to change, and before it writes
+any keys, it captures just those curves as KeyCurve arrays, without holding
+on to any hou objects. The last few
+operations can then be flipped between before and after (A/B) or reverted,
+each with one bulk write per parm as a single undo entry, instead of going
+through Houdini's undo one recorded edit at a time.
+
+Snapshots are kept least recently used first, and the oldest are thrown
+away once there are more than MAX_ENTRIES or they take more than MAX_BYTES.
+An operation whose snapshot would take more than half of MAX_BYTES (leaving
+room for its after snapshot) isn't captured at all, so the total never goes
+much past MAX_BYTES.
+"""
+
+import collections
+import itertools
+
+import hou
+
+import keycurve_hou
+import keyedit
+import keytrace
+
+# operations to remember
+MAX_ENTRIES = 20
+
+# memory the snapshots can take, in bytes
+MAX_BYTES = 64 * 1024 * 1024
+
+
+class CurveSnapshot(object):
+    """
+    Keys of some parms at one moment
+
+    @ivar curves: OrderedDict of parm path to KeyCurve, without host keys
+    @ivar values: Dict of parm path to value, for parms that had no keys
+    @ivar nbytes: Rough memory held, in bytes
+    """
+
+    def __init__(self, parms, curves=None):
+        """
+        @param parms: hou.Parms to capture
+        @param curves: KeyCurves already read from the parms, one per parm. Read if not given
+        """
+        self.curves = collections.OrderedDict()
+        self.values = {}
+        self.nbytes = 0
+        parms = list(parms)
+        if curves is None:
+            curves = [keycurve_hou.read_parm(parm) for parm in parms]
+
+        for parm, curve in zip(parms, curves):
+            path = parm.path()
+            if path in self.curves:
+                continue
+            curve = curve.copy()
+            curve.keys = None
+            self.curves[path] = curve
+            self.nbytes += curve.nbytes()
+            if not len(curve):
+                self.values[path] = parm.eval()
+
+
+    def __len__(self):
+        return len(self.curves)
+
+
+    def restore(self, label):
+        """
+        Put every parm back the way it was, as one undo entry
+
+        Parms that have been deleted since are skipped.
+
+        @param label: Undo entry label
+        @return: Number of parms restored
+        """
+        restored = 0
+        with keyedit.transaction(label):
+            for path, curve in self.curves.items():
+                parm = hou.parm(path)
+                if parm is None:
+                    continue
+                if len(curve):
+                    keyedit.replace_keyframes(parm, keycurve_hou.to_keyframes(curve))
+                    keytrace.add_keys(len(curve))
+                else:
+                    if parm.keyframes():
+                        keyedit.replace_keyframes(parm, [])
+                    keyedit.set_value(parm, self.values[path])
+                restored += 1
+        return restored
+
+
+class SnapshotEntry(object):
+    """
+    One operation's before and after
+
+    @ivar label: Name of the operation
+    @ivar before: CurveSnapshot taken before the operation
+    @ivar after: CurveSnapshot of the result, taken the first time the entry is toggled
+    @ivar showing: 'after' or 'before'
+    """
+
+    def __init__(self, label, before):
+        self.label = label
+        self.before = before
+        self.after = None
+        self.showing = 'after'
+
+
+    def __str__(self):
+        return '%s (%d parms, showing %s)' % (self.label, len(self.before), self.showing)
+
+
+    def nbytes(self):
+        return self.before.nbytes + (self.after.nbytes if self.after is not None else 0)
+
+
+class SnapshotStore(object):
+    """
+    The last few operations' snapshots, least recently used first
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._ids = itertools.count(1)
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def nbytes(self):
+        return sum(entry.nbytes() for entry in self._entries.values())
+
+
+    def capture(self, label, parms, curves=None):
+        """
+        Snapshot some parms before an operation changes them
+
+        @param label: Name of the operation
+        @param parms: hou.Parms the operation is about to change
+        @param curves: KeyCurves already read from the parms, see CurveSnapshot
+        @return: Id of the new entry, or None if there was nothing to capture or
+                 it was too big to keep
+        """
+        snapshot = CurveSnapshot(parms, curves)
+        if not len(snapshot):
+            return None
+        if snapshot.nbytes * 2 > self.max_bytes:
+            # toggling it would take as much again for the after snapshot
+            print 'snapshot: %s is too big to keep (%.1f MB)' % (label, snapshot.nbytes / 1048576.0)
+            return None
+        entry_id = next(self._ids)
+        self._entries[entry_id] = SnapshotEntry(label, snapshot)
+        self._evict(entry_id)
+        return entry_id
+
+
+    def get(self, entry_id=None):
+        """
+        An entry, marked as the most recently used
+
+        @param entry_id: Id from capture, defaults to the most recent entry
+        @return: SnapshotEntry, or None if it has been evicted
+        """
+        if not self._entries:
+            return None
+        if entry_id is None:
+            entry_id = next(reversed(self._entries))
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._entries[entry_id] = entry
+        return entry
+
+
+    def toggle(self, entry_id=None):
+        """
+        Flip an operation's parms between before and after
+
+        @return: The entry, or None if there isn't one
+        """
+        entry = self.get(entry_id)
+        if entry is None:
+            return None
+
+        if entry.showing == 'after':
+            if entry.after is None:
+                parms = [hou.parm(path) for path in entry.before.curves]
+                entry.after = CurveSnapshot([parm for parm in parms if parm is not None])
+            entry.before.restore('%s (before)' % entry.label)
+            entry.showing = 'before'
+        else:
+            entry.after.restore('%s (after)' % entry.label)
+            entry.showing = 'after'
+        self._evict(next(reversed(self._entries)))
+        return entry
+
+
+    def revert(self, entry_id=None):
+        """
+        Put an operation's parms back the way they were and forget it
+
+        @return: The entry, or None if there isn't one
+        """
+        entry = self.get(entry_id)
+        if entry is None:
+            return None
+        if entry.showing == 'after':
+            entry.before.restore('Revert %s' % entry.label)
+        # get() moved it to the end
+        self._entries.popitem()
+        return entry
+
+
+    def clear(self):
+        self._entries.clear()
+
+
+    def _evict(self, keep):
+        """
+        Throw away the least recently used entries until within the limits
+
+        @param keep: Id of the entry in use, which stays. capture makes sure it
+                     fits on its own
+        """
+        nbytes = self.nbytes()
+        for entry_id in list(self._entries):
+            if len(self._entries) <= self.max_entries and nbytes <= self.max_bytes:
+                break
+            if entry_id != keep:
+                nbytes -= self._entries.pop(entry_id).nbytes()
+
+
+snapshots = SnapshotStore()
+
+
+def toggle_ui():
+    """
+    Flip the last operation between before and after
+    """
+    entry = snapshots.toggle()
+    if entry is None:
+        hou.ui.displayMessage('No keytar operations to compare')
+        return
+    print 'snapshot:', entry
+
+
+def revert_ui():
+    """
+    Revert the last operation
+    """
+    entry = snapshots.revert()
+    if entry is None:
+        hou.ui.displayMessage('No keytar operations to revert')
+        return
+    print 'snapshot: reverted', entry.label
@@ -0,0 +1,295 @@
+# -*- coding: UTF-8 -*-
+"""
+Timings and call counts for the keytar tools
+
+Off by default. Turn it on by setting KEYTAR_TRACE before starting Houdini,
+to 1 for the default trace file or to the path of a file to write to, or
+from the menu with toggle_ui().
+
+While on, every keytar operation (see keyedit.transaction) records:
+
+ - time spent in each phase - gather (reading keys), compute (the maths)
+   and commit (writing keys back)
+ - HOM calls made, per method, and hscript calls
+ - keys touched
+
+Each operation is appended to the trace file as one line of json, and a
+one line summary is printed. The tools' own notes on what they did (keys
+written, calls saved) go through log(), and are only printed while tracing.
+
+When off, operation() and phase() hand back a shared do nothing context
+manager and HOM is left alone, so the tools run exactly as before. HOM
+calls are only counted while tracing is on, by wrapping the methods in
+HOM_METHODS.
+"""
+
+import collections
+import json
+import os
+import tempfile
+import time
+
+import hou
+
+ENV_VAR = 'KEYTAR_TRACE'
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'keytar_trace.jsonl')
+
+PHASES = ('gather', 'compute', 'commit')
+
+# hou class (or None for module functions): methods to count
+HOM_METHODS = {
+    None: ('hscript', 'parm', 'node', 'setFrame'),
+    'Parm': ('keyframes', 'setKeyframes', 'deleteAllKeyframes', 'deleteKeyframeAtFrame',
+             'set', 'eval', 'evalAtFrame', 'isTimeDependent', 'path'),
+    'ParmTuple': ('eval', 'evalAtFrame', 'set'),
+    'Keyframe': ('frame', 'value', 'inValue', 'slope', 'inSlope', 'accel', 'inAccel',
+                 'isSlopeAuto', 'isInSlopeAuto', 'expression', 'isValueTied', 'isSlopeTied',
+                 'isAccelTied', 'setFrame', 'setValue', 'setInValue', 'setSlope', 'setInSlope',
+                 'setAccel', 'setInAccel', 'setSlopeAuto', 'setInSlopeAuto', 'setExpression'),
+    'Node': ('parms', 'parm', 'parmTuple'),
+}
+
+# calls to the wrapped HOM methods, while tracing
+calls = collections.Counter()
+
+# file traces are appended to while tracing is on, otherwise None
+trace_file = None
+
+# the operation being traced
+_trace = None
+
+# (owner, name): original function, for unwrapping
+_originals = {}
+
+
+class _Null(object):
+    """
+    Context manager that does nothing, for when tracing is off
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL = _Null()
+
+
+class Trace(object):
+    """
+    One traced operation
+
+    @ivar name: Operation name
+    @ivar started: Time the operation started
+    @ivar seconds: Total time, once finished
+    @ivar phases: OrderedDict of phase name to seconds
+    @ivar calls: Counter of HOM method to calls
+    @ivar keys: Keys touched
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.phases = collections.OrderedDict((phase, 0.0) for phase in PHASES)
+        self.calls = collections.Counter()
+        self.keys = 0
+        self._stack = []
+        self._calls = calls.copy()
+        self.started = time.time()
+
+
+    def __str__(self):
+        phases = ', '.join('%s %.3fs' % item for item in self.phases.items() if item[1])
+        return '%s: %.3fs (%s), %d HOM calls, %d hscript, %d keys' % (
+            self.name, self.seconds, phases or 'no phases', self.hom_calls(), self.calls['hscript'], self.keys)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        global _trace
+        _trace = None
+        self.seconds = time.time() - self.started
+        self.calls = calls - self._calls
+        _write(self)
+        return False
+
+
+    def hom_calls(self):
+        return sum(self.calls.values())
+
+
+    def to_dict(self):
+        return {
+            'operation': self.name,
+            'started': self.started,
+            'seconds': self.seconds,
+            'phases': self.phases,
+            'hom_calls': self.hom_calls(),
+            'hscript_calls': self.calls['hscript'],
+            'calls': dict(self.calls),
+            'keys': self.keys,
+        }
+
+
+class _Phase(object):
+
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+
+    def __enter__(self):
+        self.trace._stack.append(self.name)
+        self.start = time.time()
+        return self
+
+
+    def __exit__(self, *args):
+        stack = self.trace._stack
+        stack.pop()
+        # nested phases of the same name are only timed once
+        if self.name not in stack:
+            self.trace.phases[self.name] = self.trace.phases.get(self.name, 0.0) + time.time() - self.start
+        return False
+
+
+def enabled():
+    return trace_file is not None
+
+
+def operation(name):
+    """
+    Trace an operation
+
+    Operations started while another is running are part of it.
+
+    @return: Context manager
+    """
+    global _trace
+    if trace_file is None or _trace is not None:
+        return _NULL
+    _trace = Trace(name)
+    return _trace
+
+
+def phase(name):
+    """
+    Time a phase of the current operation
+
+    @param name: One of PHASES
+    @return: Context manager
+    """
+    if _trace is None:
+        return _NULL
+    return _Phase(_trace, name)
+
+
+def add_keys(count):
+    """
+    Count keys touched by the current operation
+    """
+    if _trace is not None:
+        _trace.keys += count
+
+
+def log(*args):
+    """
+    Print a note about what a tool did, only while tracing is on
+    """
+    if trace_file is not None:
+        print ' '.join(str(arg) for arg in args)
+
+
+def _counter(name, func):
+    def wrapper(*args, **kwargs):
+        calls[name] += 1
+        return func(*args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def _wrap():
+    for cls_name, methods in HOM_METHODS.items():
+        owner = hou if cls_name is None else getattr(hou, cls_name, None)
+        if owner is None:
+            continue
+        for method in methods:
+            func = getattr(owner, method, None)
+            if func is None or (owner, method) in _originals:
+                continue
+            _originals[(owner, method)] = func
+            name = method if cls_name is None else '%s.%s' % (cls_name, method)
+            if cls_name is not None:
+                # unbound method on python 2, plain function on 3
+                func = getattr(func, '__func__', func)
+            setattr(owner, method, _counter(name, func))
+
+
+def _unwrap():
+    for (owner, method), func in _originals.items():
+        if isinstance(owner, type):
+            func = getattr(func, '__func__', func)
+        setattr(owner, method, func)
+    _originals.clear()
+
+
+def enable(trace_path=None):
+    """
+    Start tracing
+
+    @param trace_path: File to append traces to, defaults to DEFAULT_PATH
+    """
+    global trace_file
+    trace_file = trace_path or DEFAULT_PATH
+    _wrap()
+
+
+def disable():
+    """
+    Stop tracing and leave HOM as it was
+    """
+    global trace_file
+    trace_file = None
+    _unwrap()
+
+
+def _write(trace):
+    print 'keytar trace:', trace
+    if trace_file is None:
+        return
+    try:
+        with open(trace_file, 'a') as f:
+            f.write(json.dumps(trace.to_dict()) + '\n')
+    except (IOError, OSError) as e:
+        print 'keytar trace: could not write %s: %s' % (trace_file, e)
+
+
+def toggle_ui():
+    """
+    Turn tracing on or off
+    """
+    if enabled():
+        disable()
+        print 'keytar trace: off'
+    else:
+        enable(_env_path())
+        print 'keytar trace: on, writing to', trace_file
+
+
+def _env_path():
+    # KEYTAR_TRACE=1 means the default file
+    value = os.environ.get(ENV_VAR)
+    return None if value in (None, '', '1') else value
+
+
+if os.environ.get(ENV_VAR):
+    enable(_env_path())
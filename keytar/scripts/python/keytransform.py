@@ -0,0 +1,164 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Scale / translate maths for keyframe curves
+
+Host independent - works on KeyCurves, see transformkeys for the Houdini side.
+
+"""
+
+import numpy as np
+
+from keycurve import KeyCurve, field_dtype, round_frames
+
+AUTOPIVOTS = ('tl', 'tm', 'tr', 'ml', 'mm', 'mr', 'bl', 'bm', 'br')
+
+
+def resolve_pivot(bounds, autopivot='mm', pivotx=None, pivoty=None):
+    """
+    Pivot position for a transform
+
+    @param bounds: (xmin, xmax, ymin, ymax) of the selection
+    @param autopivot: One of tl, tm, tr, ml, mm, mr, bl, bm, br. Anything else uses the manual pivots
+    @param pivotx: Manual pivot for x axis
+    @param pivoty: Manual pivot for y axis
+    @return: (pivotx, pivoty)
+    """
+    xmin, xmax, ymin, ymax = bounds
+
+    if autopivot not in AUTOPIVOTS:
+        return pivotx or 0, pivoty or 0
+
+    # first letter is the vertical position, second the horizontal
+    vertical, horizontal = autopivot
+    pivotx = {'l': xmin, 'm': (xmax - xmin) / 2 + xmin, 'r': xmax}[horizontal]
+    pivoty = {'t': ymax, 'm': (ymax - ymin) / 2 + ymin, 'b': ymin}[vertical]
+    return pivotx, pivoty
+
+
+class CurveBatch(object):
+    """
+    A set of curves packed end to end into flat arrays
+
+    Lets a transform run over every selected key of every channel as a single
+    array operation, instead of once per channel.
+
+    @ivar curves: The packed KeyCurves
+    @ivar offsets: Start index of each curve in the flat arrays, plus the total length
+    @ivar selected: Boolean mask of the selected keys
+    """
+
+    def __init__(self, curves, selections=None):
+        """
+        @param curves: Sequence of KeyCurves
+        @param selections: Selected key indices (or masks), one per curve. Defaults to every key
+        """
+        self.curves = list(curves)
+        self.offsets = np.cumsum([0] + [len(curve) for curve in self.curves])
+
+        for name in KeyCurve.FIELDS:
+            arrays = [getattr(curve, name) for curve in self.curves]
+            setattr(self, name, np.concatenate(arrays) if arrays else np.zeros(0, dtype=field_dtype(name)))
+
+        self.selected = np.zeros(self.offsets[-1], dtype=np.bool_)
+        if selections is None:
+            self.selected[:] = True
+        else:
+            for curve, start, selected in zip(self.curves, self.offsets, selections):
+                self.selected[start:start + len(curve)][selected] = True
+
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+
+    def bounds(self):
+        """
+        Time and value range of the selected keys
+
+        @return: (xmin, xmax, ymin, ymax)
+        """
+        if not self.selected.any():
+            return np.inf, -np.inf, np.inf, -np.inf
+
+        frames = self.frame[self.selected]
+        values = self.value[self.selected]
+        return float(frames.min()), float(frames.max()), float(values.min()), float(values.max())
+
+
+    def unpack(self):
+        """
+        Split the flat arrays back into one KeyCurve per packed curve
+        """
+        curves = []
+        for curve, start, end in zip(self.curves, self.offsets[:-1], self.offsets[1:]):
+            fields = dict((name, getattr(self, name)[start:end]) for name in KeyCurve.FIELDS)
+            keys = list(curve.keys) if curve.keys is not None else None
+            curves.append(KeyCurve(keys=keys, **fields))
+        return curves
+
+
+def transform_batch(batch, bounds, pivot,
+                    scalex=1.0, scaley=1.0,
+                    translatex=0.0, translatey=0.0,
+                    ripple=True,
+                    snapframe=True):
+    """
+    Transform the selected keys of every curve in a batch
+
+    Keys keep their index, so each resulting curve can be compared key for key
+    with its original.
+
+    @param batch: CurveBatch to transform
+    @param bounds: (xmin, xmax, ymin, ymax) of the selection
+    @param pivot: (pivotx, pivoty)
+    @param ripple: Move keys outside of the selection range for x axis operations
+    @param snapframe: Snap key times to whole frames for x axis operations
+    @return: List of transformed KeyCurves, one per curve in the batch
+    """
+    xmin, xmax, ymin, ymax = bounds
+    pivotx, pivoty = pivot
+    selected = batch.selected
+
+    frame = batch.frame
+    if ripple and scalex > 0:
+        # you dont want to ripple if you're scaling negative. bad times
+        xmin_diff = (xmin - pivotx) * scalex + translatex - (xmin - pivotx)
+        xmax_diff = (xmax - pivotx) * scalex + translatex - (xmax - pivotx)
+
+        before = batch.frame <= xmin - 1
+        after = batch.frame >= xmax + 1
+        frame = frame + np.where(before, xmin_diff, 0.0) + np.where(after, xmax_diff, 0.0)
+        if snapframe:
+            frame = np.where(before | after, round_frames(frame), frame)
+
+    # whole arrays are cheaper to work on than masked subsets, so transform
+    # everything and pick the selected keys afterwards
+    new_frame = (batch.frame - pivotx) * scalex + translatex + pivotx
+    if snapframe:
+        new_frame = round_frames(new_frame)
+    frame = np.where(selected, new_frame, frame)
+    fields = {'frame': frame}
+    fields['value'] = np.where(selected, (batch.value - pivoty) * scaley + translatey + pivoty, batch.value)
+
+    manual = selected & ~batch.slope_auto
+    fields['accel'] = np.where(manual, batch.accel * scalex, batch.accel)
+    fields['slope'] = np.where(manual, batch.slope * scaley, batch.slope)
+
+    # only the out side is transformed, like setting it on a hou.Keyframe -
+    # tied in sides follow it, untied ones stay where they are
+    for name, keys in (('value', selected), ('accel', manual), ('slope', manual)):
+        in_name = 'in_' + name
+        tied = keys & (getattr(batch, in_name) == getattr(batch, name))
+        fields[in_name] = np.where(tied, fields[name], getattr(batch, in_name))
+
+    # re-auto the keys
+    fields['in_slope_auto'] = batch.in_slope_auto | (selected & batch.slope_auto)
+    fields['slope_auto'] = batch.slope_auto
+    fields['expression'] = batch.expression
+
+    result = []
+    for curve, start, end in zip(batch.curves, batch.offsets[:-1], batch.offsets[1:]):
+        keys = list(curve.keys) if curve.keys is not None else None
+        result.append(KeyCurve(keys=keys, **dict((name, fields[name][start:end]) for name in KeyCurve.FIELDS)))
+    return result
@@ -5,49 +5,414 @@ Remove flat keyframes from the scene
 
 import hou
 
+from PySide2 import QtCore
 
-def remove_static(node, children=False):
+import flatreport
+import keycurve
+import keycurve_hou
+import keyedit
+import keyreduce
+import keytrace
+from keysnapshot import snapshots
+
+# nodes between progress updates when cleaning the whole scene
+PROGRESS_STEP = 100
+
+# milliseconds the watcher waits after the last channel change before cleaning up
+DEBOUNCE = 500
+
+
+def remove_flat(parm, stats=None, changed=None, keys=None):
+    """
+    Remove the redundant keys from the flat runs of a parm
+
+    The first key of every run of equal keys is made linear and the keys
+    between it and the last key of the run are deleted. The channel is
+    rewritten in one go rather than key by key.
+
+    @param parm: hou.Parm
+    @param stats: Optional keycurve_hou.WriteStats to add to
+    @param changed: Optional list to append (parm, KeyCurve as it was) to if the
+                    parm changes, eg. to snapshot afterwards
+    @param keys: The parm's hou.Keyframes, if already read
+    @return: Number of keys deleted
+    """
+    with keytrace.phase('gather'):
+        if keys is None:
+            keys = parm.keyframes()
+        if len(keys) < 2:
+            return 0
+        values = [key.value() for key in keys]
+
+    with keytrace.phase('compute'):
+        starts, redundant = keycurve.flat_runs(values)
+    if not starts.any():
+        return 0
+
+    if changed is not None:
+        with keytrace.phase('gather'):
+            changed.append((parm, keycurve_hou.read_keyframes(keys)))
+
+    with keytrace.phase('commit'):
+        for i in starts.nonzero()[0]:
+            keys[i].setExpression("linear()", hou.exprLanguage.Hscript)
+
+        deleted = int(redundant.sum())
+        if deleted:
+            keyedit.replace_keyframes(parm, [key for key, drop in zip(keys, redundant) if not drop])
+            calls = 2
+        else:
+            keyedit.set_keyframes(parm, [keys[i] for i in starts.nonzero()[0]])
+            calls = 1
+    keytrace.add_keys(deleted)
+
+    if stats is not None:
+        stats.parms += 1
+        stats.keys += deleted
+        stats.calls += calls
+        # a set for every run start and a delete for every redundant key
+        stats.per_key_calls += int(starts.sum()) + deleted
+    return deleted
+
+
+def reduce_keys(parms, tolerance, stats=None):
+    """
+    Remove every key the rest of its curve reproduces within a tolerance
+
+    All the parms are reduced as one batch, see keyreduce. Spans that lose
+    keys become linear. The parms that lose keys are snapshotted, see
+    keysnapshot.
+
+    @param parms: hou.Parms to reduce
+    @param tolerance: Largest value change allowed anywhere on a curve
+    @param stats: Optional keycurve_hou.WriteStats to add to
+    @return: List of (parm, keyreduce.Reduction)
+    """
+    with keytrace.phase('gather'):
+        parms = list(parms)
+        curves = [keycurve_hou.read_parm(parm) for parm in parms]
+    with keytrace.phase('compute'):
+        reductions = keyreduce.reduce_curves(curves, tolerance, hou.fps())
+
+    reduced = [i for i, reduction in enumerate(reductions) if reduction.removed()]
+    snapshots.capture('Reduce Keys', [parms[i] for i in reduced], [curves[i] for i in reduced])
+
+    with keytrace.phase('commit'):
+        for parm, curve, reduction in zip(parms, curves, reductions):
+            removed = reduction.removed()
+            if not removed:
+                continue
+
+            for i in reduction.linear.nonzero()[0]:
+                curve.keys[i].setExpression("linear()", hou.exprLanguage.Hscript)
+            keyedit.replace_keyframes(parm, [key for key, keep in zip(curve.keys, reduction.keep) if keep])
+            keytrace.add_keys(removed)
+
+            if stats is not None:
+                stats.parms += 1
+                stats.keys += removed
+                stats.calls += 2
+                stats.per_key_calls += int(reduction.linear.sum()) + removed
+
+    return list(zip(parms, reductions))
+
+
+def remove_static(node, children=False, changed=None):
     
     for parm in [x for x in node.parms() if x.isTimeDependent()]:
-        deletelist = []
-        keyframes = parm.keyframes()
-        if len(keyframes) > 1:
-            lastkey = None
-            blockstart = None
-            for key in keyframes:
-                if lastkey:
-                    if key.value() == lastkey.value():
-                        if blockstart is None:
-                            blockstart = True
-                        if blockstart is not True:
-                            deletelist.append(lastkey.frame())
-                    else:
-                        blockstart = None
-                    
-                    if blockstart is True:
-                        lastkey.setExpression("linear()", hou.exprLanguage.Hscript)
-                        parm.setKeyframe(lastkey)
-                        blockstart = False
-                
-                # first frame - ignore
-                lastkey = key
-        
-        if deletelist:
-            print 'Removing keys on %s' % parm
-            
-            for frame in deletelist:
-                parm.deleteKeyframeAtFrame(frame)
+        if remove_flat(parm, changed=changed):
+            keytrace.log('Removing keys on', parm)
     
     if children:
         if not node.isLockedHDA():
             for n in node.allSubChildren():
-                remove_static(n)
+                remove_static(n, changed=changed)
+
+
+def scene_nodes(root=None):
+    """
+    Every node under root, not looking inside locked digital assets
+
+    @param root: hou.Node to start from, defaults to /
+    """
+    stack = [root or hou.node('/')]
+    while stack:
+        node = stack.pop()
+        yield node
+        if not node.isLockedHDA():
+            stack.extend(reversed(node.children()))
+
+
+def animated_keys(nodes):
+    """
+    Generator of (parm, hou.Keyframes) for the keyed parms on some nodes
+    """
+    for node in nodes:
+        for parm in node.parms():
+            if parm.isTimeDependent():
+                keys = parm.keyframes()
+                if keys:
+                    yield parm, keys
+
+
+def animated_parms(nodes):
+    """
+    Generator of the keyed parms on some nodes
+    """
+    for parm, keys in animated_keys(nodes):
+        yield parm
+
+
+def remove_static_scene(root=None):
+    """
+    Remove flat keys from every animated parm in the scene
+
+    Shows a progress bar that can be cancelled. Every PROGRESS_STEP nodes
+    are read, cleaned and written before the bar moves on, so keys already
+    cleaned when cancelling stay cleaned, and the whole run is still one undo
+    entry. Each parm's keys are read once. The parms that lose keys are
+    snapshotted, see keysnapshot.
+
+    Inside a keyedit transaction nothing is written until that transaction
+    ends.
+
+    @param root: hou.Node to start from, defaults to /
+    @return: keycurve_hou.WriteStats of the parms and keys cleaned up
+    """
+    stats = keycurve_hou.WriteStats()
+    changed = []
+    with keytrace.operation('Remove Flat Keys'), hou.undos.group('Remove Flat Keys'):
+        with keytrace.phase('gather'):
+            nodes = list(scene_nodes(root))
+
+        with hou.InterruptableOperation('Remove Flat Keys', long_operation_name='Removing flat keys',
+                                        open_interrupt_dialog=True) as operation:
+            try:
+                for i in range(0, len(nodes), PROGRESS_STEP):
+                    operation.updateLongProgress(float(i) / len(nodes), '%d keys removed' % stats.keys)
+                    with keyedit.transaction('Remove Flat Keys'):
+                        for parm, keys in animated_keys(nodes[i:i + PROGRESS_STEP]):
+                            remove_flat(parm, stats, changed, keys)
+            except hou.OperationInterrupted:
+                keytrace.log('remove flat keys: cancelled')
+
+        snapshots.capture('Remove Flat Keys', [parm for parm, curve in changed],
+                          [curve for parm, curve in changed])
+
+    keytrace.log('remove flat keys: removed %d keys from %d parms' % (stats.keys, stats.parms))
+    return stats
+
+
+def analyse_flat(parm_keys, report=None):
+    """
+    Dry run of remove_flat over some parms, without changing anything
+
+    @param parm_keys: (hou.Parm, hou.Keyframes) to look at, eg. from animated_keys
+    @param report: flatreport.FlatKeyReport to add to, a new one if not given
+    @return: The report
+    """
+    if report is None:
+        report = flatreport.FlatKeyReport()
+    for parm, keys in parm_keys:
+        report.add(parm.node().path(), parm.name(),
+                   [key.frame() for key in keys], [key.value() for key in keys])
+    return report
+
+
+class FlatKeyWatcher(object):
+    """
+    Removes flat keys from channels as they get edited
+
+    Registers change callbacks on the watched nodes and keeps the paths of
+    the animated parms that changed. Once the edits stop for DEBOUNCE ms only
+    those parms are cleaned up, so the cost follows the edits rather than the
+    size of the scene.
+
+    Changes made by an undo or redo are left alone, so undoing a clean up
+    doesn't just set off the same clean up again.
+
+    @ivar dirty: Paths of the parms waiting to be cleaned
+    @ivar stats: keycurve_hou.WriteStats of everything cleaned so far
+    """
+
+    EVENTS = (hou.nodeEventType.ParmTupleChanged,
+              hou.nodeEventType.ChildCreated,
+              hou.nodeEventType.BeingDeleted)
+
+
+    def __init__(self):
+        self.dirty = set()
+        self.stats = keycurve_hou.WriteStats()
+        self._nodes = {}
+        self._cleaning = False
+        self._timer = QtCore.QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(DEBOUNCE)
+        self._timer.timeout.connect(self.flush)
+
+
+    def watch(self, nodes):
+        """
+        Start watching some nodes. Nodes created under them are watched too
+        """
+        for node in nodes:
+            path = node.path()
+            if path not in self._nodes:
+                node.addEventCallback(self.EVENTS, self._node_changed)
+                self._nodes[path] = node
+
+
+    def stop(self):
+        """
+        Stop watching everything, dropping any edits not cleaned yet
+        """
+        self._timer.stop()
+        for node in self._nodes.values():
+            try:
+                node.removeEventCallback(self.EVENTS, self._node_changed)
+            except (hou.OperationFailed, hou.ObjectWasDeleted):
+                pass
+        self._nodes.clear()
+        self.dirty.clear()
+
+
+    def _node_changed(self, event_type, node, **kwargs):
+        if self._cleaning:
+            # our own edits
+            return
+        if _undoing():
+            # undoing a clean up puts the flat keys back, which shouldn't set
+            # off another one
+            return
+
+        if event_type == hou.nodeEventType.ChildCreated:
+            self.watch([kwargs['child_node']])
+            return
+
+        if event_type == hou.nodeEventType.BeingDeleted:
+            path = node.path()
+            self._nodes.pop(path, None)
+            self.dirty = set(p for p in self.dirty if p.rpartition('/')[0] != path)
+            return
+
+        parm_tuple = kwargs.get('parm_tuple')
+        # no tuple means several changed at once
+        parms = node.parms() if parm_tuple is None else parm_tuple
+        changed = [parm.path() for parm in parms if parm.isTimeDependent()]
+        if changed:
+            self.dirty.update(changed)
+            # restarting pushes the clean up back until the edits stop
+            self._timer.start()
+
+
+    def flush(self):
+        """
+        Clean up the channels edited since the last flush
+
+        @return: Number of keys removed
+        """
+        self._timer.stop()
+        paths, self.dirty = self.dirty, set()
+        removed = 0
+        self._cleaning = True
+        try:
+            with keyedit.transaction('Remove Flat Keys'):
+                for path in sorted(paths):
+                    parm = hou.parm(path)
+                    if parm is not None:
+                        removed += remove_flat(parm, self.stats)
+        finally:
+            self._cleaning = False
+
+        if removed:
+            keytrace.log('remove flat keys: removed %d keys from %d edited parms' % (removed, len(paths)))
+        return removed
+
+
+def _undoing():
+    """
+    True while Houdini is performing an undo or redo
+    """
+    undos = hou.undos
+    return bool((hasattr(undos, 'performingUndo') and undos.performingUndo()) or
+                (hasattr(undos, 'performingRedo') and undos.performingRedo()))
+
+
+# the watcher started from the menu, if any
+watcher = None
+
+
+def toggle_watcher_ui():
+    """
+    Start or stop cleaning up flat keys as channels are edited, over the whole scene
+    """
+    global watcher
+    if watcher is None:
+        watcher = FlatKeyWatcher()
+        watcher.watch(scene_nodes())
+        print 'remove flat keys: watching %d nodes' % len(watcher._nodes)
+    else:
+        watcher.stop()
+        print 'remove flat keys: stopped watching,', watcher.stats
+        watcher = None
 
 
 def remove_static_ui():
     if hou.selectedNodes():
         start_nodes = hou.selectedNodes()
     
-        with hou.undos.group('Remove Flat Keys'):
+        changed = []
+        with keyedit.transaction('Remove Flat Keys'):
             for node in start_nodes:
-                remove_static(node)
+                remove_static(node, changed=changed)
+            snapshots.capture('Remove Flat Keys', [parm for parm, curve in changed],
+                              [curve for parm, curve in changed])
+
+
+def reduce_keys_ui():
+    nodes = hou.selectedNodes()
+    if not nodes:
+        return
+
+    button, text = hou.ui.readInput('Largest value change allowed', buttons=('Reduce', 'Cancel'),
+                                    default_choice=0, close_choice=1,
+                                    title='Reduce Keys', initial_contents='0.001')
+    if button != 0:
+        return
+    try:
+        tolerance = float(text)
+    except ValueError:
+        hou.ui.displayMessage('Tolerance has to be a number', severity=hou.severityType.Error)
+        return
+
+    stats = keycurve_hou.WriteStats()
+    with keyedit.transaction('Reduce Keys'):
+        with keytrace.phase('gather'):
+            parms = list(animated_parms(nodes))
+        results = reduce_keys(parms, tolerance, stats)
+
+    for parm, reduction in results:
+        if reduction.removed():
+            print '%s: removed %d of %d keys, max error %g' % (
+                parm.path(), reduction.removed(), len(reduction.keep), reduction.error)
+    print 'reduce keys:', stats
+
+
+def analyse_flat_ui():
+    """
+    Report the flat keys in the whole scene, and optionally write it out as json or csv
+    """
+    with keytrace.operation('Flat Keys Report'):
+        report = analyse_flat(animated_keys(scene_nodes()))
+    for node, totals in report.nodes().items():
+        print '%s: %d removable keys on %d parms' % (node, totals['removable'], totals['parms'])
+    print 'flat keys:', report
+
+    path = hou.ui.selectFile(title='Save Flat Key Report', pattern='*.json *.csv',
+                             chooser_mode=hou.fileChooserMode.Write)
+    if path:
+        report.write(hou.expandString(path))
+
+
+def remove_static_scene_ui():
+    remove_static_scene()
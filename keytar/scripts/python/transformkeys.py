@@ -14,17 +14,30 @@ import hou
 from PySide2 import QtWidgets, QtCore
 from functools import partial
 
+import keycurve_hou
+import keyedit
+import keytrace
+import keytransform
+from channelscope import scope_resolver
+from keysnapshot import snapshots
+
 
 def transformKeyframes(keyframes, scalex=1.0, scaley=1.0,
                        translatex=0.0, translatey=0.0,
                        pivotx=None, pivoty=None,
                        autopivot='mm',
                        ripple=True,
-                       snapframe=True
+                       snapframe=True,
+                       collisions='keep-moved'
                        ):
     """
     Transform a set of keyframes
     
+    Every channel is read into a KeyCurve once, the whole selection is
+    transformed in one batch of array operations and only the keys that
+    changed are written back, as one undo entry. The curves that change are
+    snapshotted before they are written, see keysnapshot.
+    
     @param keyframes: Dict of keyframes, with the parm as the key
     @param scalex: Scale factor for x axis
     @param scaley: Scale factor for y axis
@@ -35,171 +48,47 @@ def transformKeyframes(keyframes, scalex=1.0, scaley=1.0,
     @param autopivot: Automatic pivot location. Possible values are tl, tm, tr, ml, mm, mr, bl, bm, br
     @param ripple: Move keys outside of the selection range for x axis operations
     @param snapframe: Snap key times to whole frames for x axis operations
+    @param collisions: What to keep when keys land on the same frame. Possible values are keep-moved, keep-static, average
     """
     
-    xmin = 99999999999999
-    xmax = -99999999999999
-    
-    ymin = 99999999999999
-    ymax = -99999999999999
-    
-    for parm in keyframes.keys():
-        for key in keyframes[parm]:
-            xmin = min(xmin, key.frame())
-            xmax = max(xmax, key.frame())
-            
-            ymin = min(ymin, key.value())
-            ymax = max(ymax, key.value())
-    
-    print 'time range:', xmin, xmax
-    
-    print 'value range:', ymin, ymax
-    
-    pivotx_mid = (xmax - xmin) / 2 + xmin
-    pivoty_mid = (ymax - ymin) / 2 + ymin
-    
-    if autopivot == 'tl':
-        # top left
-        pivotx = xmin
-        pivoty = ymax
-    
-    elif autopivot == 'tm':
-        # top middle
-        pivotx = pivotx_mid
-        pivoty = ymax
-    
-    elif autopivot == 'tr':
-        # top right
-        pivotx = xmax
-        pivoty = ymax
-    
-    elif autopivot == 'ml':
-        # middle left
-        pivotx = xmin
-        pivoty = pivoty_mid
-    
-    elif autopivot == 'mm':
-        # middle middle
-        pivotx = pivotx_mid
-        pivoty = pivoty_mid
-    
-    elif autopivot == 'mr':
-        # middle right
-        pivotx = xmax
-        pivoty = pivoty_mid
-    
-    elif autopivot == 'bl':
-        # bottom left
-        pivotx = xmin
-        pivoty = ymin
-    
-    elif autopivot == 'bm':
-        # bottom middle
-        pivotx = pivotx_mid
-        pivoty = ymin
-    
-    elif autopivot == 'br':
-        # bottom right
-        pivotx = xmax
-        pivoty = ymin
-    else:
-        pivotx = pivotx or 0
-        pivoty = pivoty or 0
-    
-    print 'pivots:'
-    print pivotx, pivoty
-    
-    if xmin == xmax:
-        raise RuntimeError("gotta select a bigger time range")
-    
-    xmin_pvt = xmin - pivotx
-    xmax_pvt = xmax - pivotx
-    
-    xmin_scaled = xmin_pvt * scalex + translatex
-    xmax_scaled = xmax_pvt * scalex + translatex
-    xmin_diff = xmin_scaled - xmin_pvt
-    xmax_diff = xmax_scaled - xmax_pvt
-    print 'xdiffs', xmin_diff, xmax_diff
-    
-    ymin_pvt = ymin - pivoty
-    ymax_pvt = ymax - pivoty
-    
-    ymin_scaled = ymin_pvt * scaley + translatey
-    ymax_scaled = ymax_pvt * scaley + translatey
-    
-    for parm in keyframes.keys():
-        if ripple:
-            # you dont want to ripple if you're scaling negative. bad times
-            if scalex > 0:
-                
-                before = parm.keyframesBefore(xmin - 1)
-                for key in before:
-                    parm.deleteKeyframeAtFrame(key.frame())
-                    
-                    newframe = key.frame() + xmin_diff
-                    if snapframe:
-                        newframe = round(newframe)
-                    
-                    key.setFrame(newframe)
-                    parm.setKeyframe(key)
-                
-                after = parm.keyframesAfter(xmax + 1)
-                
-                for key in after:
-                    parm.deleteKeyframeAtFrame(key.frame())
-                    
-                    newframe = key.frame() + xmax_diff
-                    if snapframe:
-                        newframe = round(newframe)
-                    
-                    key.setFrame(newframe)
-                    parm.setKeyframe(key)
-        
-        for key in keyframes[parm]:
-            # first run - delete the target keys from the parm
-            parm.deleteKeyframeAtFrame(key.frame())
-        
-        for key in keyframes[parm]:
-            # second run - apply the key at a modified time
-            xvalue = key.frame()
-            
-            xvalue_pvt = xvalue - pivotx
-            yvalue_pvt = key.value() - pivoty
-            
-            # https://stackoverflow.com/a/929107
-            # NewValue = (((OldValue - OldMin) * (NewMax - NewMin)) / (OldMax - OldMin)) + NewMin
-            new_xvalue = ((xvalue_pvt - xmin_pvt) * (xmax_scaled - xmin_scaled)) / (xmax_pvt - xmin_pvt) + xmin_scaled
-            new_xvalue += pivotx
-            
-            print 'xvalue', xvalue
-            print 'newxvalue', new_xvalue
+    stats = keycurve_hou.WriteStats()
+    with keyedit.transaction('TransformKeys'):
+        with keytrace.phase('gather'):
+            parms = list(keyframes.keys())
+            curves = []
+            selections = []
+            for parm in parms:
+                curve = keycurve_hou.read_parm(parm)
+                curves.append(curve)
+                selections.append(curve.find([key.frame() for key in keyframes[parm]]))
+        
+        with keytrace.phase('compute'):
+            batch = keytransform.CurveBatch(curves, selections)
+            bounds = batch.bounds()
+            xmin, xmax, ymin, ymax = bounds
             
-            # new_xvalue = ((xvalue - xmin) / (xmax - xmin) ) * (xmin - xmax) + xmax
-            # print frame, key.isSlopeAuto(), key.slope(), key.isSlopeTied()
+            pivotx, pivoty = keytransform.resolve_pivot(bounds, autopivot, pivotx, pivoty)
             
-            new_yvalue = ((yvalue_pvt - ymin_pvt) * (ymax_scaled - ymin_scaled)) / (ymax_pvt - ymin_pvt) + ymin_scaled
-            new_yvalue += pivoty
-            key.setValue(new_yvalue + translatey)
+            if xmin == xmax:
+                raise RuntimeError("gotta select a bigger time range")
             
-            if snapframe:
-                new_xvalue = round(new_xvalue)
-            key.setFrame(new_xvalue)
-            
-            if key.isSlopeAuto() is False:
-                print 'old', key.inAccel(), key.accel()
-                key.setAccel(key.accel() * scalex)
-                # key.setInAccel(key.inAccel() * scalex)
-                
-                print 'new', key.inAccel(), key.accel()
-                
-                key.setSlope(key.slope() * scaley)
-            
-            else:
-                # re-auto the keys
-                key.setSlope(0)
-                key.setSlopeAuto(True)
-                key.setInSlopeAuto(True)
-            parm.setKeyframe(key)
+            new_curves = keytransform.transform_batch(batch, bounds, (pivotx, pivoty),
+                                                      scalex=scalex, scaley=scaley,
+                                                      translatex=translatex, translatey=translatey,
+                                                      ripple=ripple,
+                                                      snapframe=snapframe)
+        
+            changed = [i for i, (curve, new_curve) in enumerate(zip(curves, new_curves))
+                       if curve.changed(new_curve).any()]
+        
+        snapshots.capture('Transform Keys', [parms[i] for i in changed], [curves[i] for i in changed])
+        
+        with keytrace.phase('commit'):
+            for parm, curve, new_curve in zip(parms, curves, new_curves):
+                keycurve_hou.write_curve(parm, curve, new_curve, stats, collisions)
+    
+    keytrace.log('transform keys: wrote', stats)
+    return stats
 
 
 class TransformKeysUi(QtWidgets.QDialog):
@@ -332,6 +221,19 @@ class TransformKeysUi(QtWidgets.QDialog):
         self.ripple_chk.setToolTip("Move keys outside of the selection range")
         btn_lay.addWidget(self.ripple_chk)
         
+        collision_lay = QtWidgets.QHBoxLayout()
+        btn_lay.addLayout(collision_lay)
+        
+        collision_label = QtWidgets.QLabel("Collisions")
+        collision_lay.addWidget(collision_label)
+        
+        self.collision_combo = QtWidgets.QComboBox()
+        self.collision_combo.addItem('Keep moved', 'keep-moved')
+        self.collision_combo.addItem('Keep static', 'keep-static')
+        self.collision_combo.addItem('Average', 'average')
+        self.collision_combo.setToolTip("What to keep when keys land on the same frame")
+        collision_lay.addWidget(self.collision_combo)
+        
         reset_btn = QtWidgets.QPushButton("Reset")
         reset_btn.clicked.connect(self.reset)
         btn_lay.addWidget(reset_btn)
@@ -363,25 +265,8 @@ class TransformKeysUi(QtWidgets.QDialog):
     
     
     def get_channels(self):
-        keyframes = {}
-        animEdit = None
-        for pane in hou.ui.currentPaneTabs():
-            if pane.type() == hou.paneTabType.ChannelEditor:
-                animEdit = pane
-        
-        if animEdit:
-            graph = animEdit.graph()
-            keyframes = graph.selectedKeyframes()
-            if not keyframes:
-                # otherwise, just use the scoped / visible channel
-                scope = hou.hscript("chscope")[0]
-                
-                for x in scope.split():
-                    chan = hou.parm(x)
-                    # only operate on channels that are visible in the graph editor
-                    if chan.isSelected():
-                        keyframes[chan] = chan.keyframes()
-        return keyframes
+        # selected keys, otherwise the scoped / visible channels
+        return scope_resolver.keyframes(scoped=False)
     
     
     def flip(self, vertical=True):
@@ -394,7 +279,7 @@ class TransformKeysUi(QtWidgets.QDialog):
         
         keyframes = self.get_channels()
         if keyframes:
-            with hou.undos.group('TransformKeys'):
+            with keyedit.transaction('TransformKeys'):
                 if vertical:
                     transformKeyframes(keyframes, scaley=-1, autopivot=pivot, ripple=False)
                 else:
@@ -410,9 +295,7 @@ class TransformKeysUi(QtWidgets.QDialog):
         ty = self.ty_spin.value()
         
         snap = self.snap_chk.checkState() == QtCore.Qt.Checked
-        print snap
         ripple = self.ripple_chk.checkState() == QtCore.Qt.Checked
-        print ripple
         pivot = 'mm'
         for check in self.align_checks:
             if check.isChecked():
@@ -421,12 +304,13 @@ class TransformKeysUi(QtWidgets.QDialog):
         
         keyframes = self.get_channels()
         if keyframes:
-            with hou.undos.group('TransformKeys'):
+            with keyedit.transaction('TransformKeys'):
                 transformKeyframes(keyframes, scalex=sx, scaley=sy,
                                    translatex=tx, translatey=ty,
                                    snapframe=snap,
                                    ripple=ripple,
-                                   autopivot=pivot)
+                                   autopivot=pivot,
+                                   collisions=self.collision_combo.currentData())
 
 
 # x = TransformKeysUi()
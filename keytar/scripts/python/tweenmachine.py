@@ -8,45 +8,329 @@ import hou
 from PySide2 import QtWidgets, QtCore
 from functools import partial
 from fractions import Fraction
+import collections
+import contextlib
+import time
 
+import numpy as np
 
-def tween(parm, frame, blend):
-    # print "BEFORE", frame
-    before = list(parm.keyframesBefore(frame))
-    for k in before:
-        if k.frame() == frame:
-            before.remove(k)
-    # print before
+import keycurve_hou
+import keyedit
+import keytrace
+import keyeval
+from channelscope import scope_resolver
+from keysnapshot import snapshots
+
+
+class BreakdownWriter(object):
+    """
+    Collects breakdown keys and sets them with one setKeyframes call per parm
     
-    # print "AFTER", frame
-    after = list(parm.keyframesAfter(frame))
-    for k in after:
-        if k.frame() == frame:
-            after.remove(k)
-    # print after
-    # print "AFTER",  hou.frameToTime(frame)
-    # print parm.keyframesAfter(frame)
+    Keys are queued per parm as hou.Keyframes - the parm's own key where there
+    already is one, so its slopes and segment function stay as they were -
+    and each parm's keys go out together, rather than one chkey per key.
     
-    if len(before) > 0 and len(after) > 0:
-        previous = before[-1]
-        next = after[0]
-        
-        prev_val = previous.value()
-        next_val = next.value()
+    Inside a keyedit transaction the calls are only buffered, and run when
+    the transaction commits - keytrace times that as the commit phase. Wrap
+    the transaction in timing() to have it counted in seconds.
+    
+    @ivar keys: Keys written so far
+    @ivar parms: Parms written so far
+    @ivar calls: setKeyframes calls made so far
+    @ivar seconds: Time spent inside timing()
+    """
+    
+    def __init__(self):
+        self._queued = collections.OrderedDict()
+        self.keys = 0
+        self.parms = 0
+        self.calls = 0
+        self.seconds = 0.0
+    
+    
+    def __str__(self):
+        # a chkey per key is what this replaced
+        return '%d keys on %d parms, %d setKeyframes calls (%d chkey calls saved), %.3fs' % (
+            self.keys, self.parms, self.calls, self.keys - self.calls, self.seconds)
+    
+    
+    @contextlib.contextmanager
+    def timing(self):
+        """
+        Add the time spent in the block to seconds - wrap the whole keyedit
+        transaction, so the commit is counted too
+        """
+        start = time.time()
+        try:
+            yield self
+        finally:
+            self.seconds += time.time() - start
+    
+    
+    def add(self, parm, key):
+        """
+        Queue a key on a parm
         
-        # print previous.frame(), prev_val, next.frame(), next_val
+        @param key: hou.Keyframe. It is only read when flushed, so don't change it before then
+        """
+        self._queued.setdefault(parm.path(), (parm, []))[1].append(key)
+    
+    
+    def flush(self):
+        """
+        Set every key collected so far
+        """
+        for parm, keys in self._queued.values():
+            keyedit.set_keyframes(parm, keys)
+            keytrace.add_keys(len(keys))
+            self.keys += len(keys)
+            self.parms += 1
+            self.calls += 1
+        self._queued.clear()
+
+
+def breakdown_key(curve, keys, frame):
+    """
+    hou.Keyframe to set a breakdown on
+    
+    @param curve: Time sorted KeyCurve of the parm
+    @param keys: The parm's hou.Keyframes, in the curve's order
+    @param frame: Frame of the breakdown
+    @return: The parm's key at the frame if it has one, otherwise a new key there
+    """
+    pos = np.searchsorted(curve.frame, frame)
+    if pos < len(curve) and curve.frame[pos] == frame:
+        return keys[pos]
+    key = hou.Keyframe()
+    key.setFrame(float(frame))
+    return key
+
+
+def tween(parm, frame, blend, curve=None, writer=None, keys=None):
+    """
+    Set a breakdown key between the keys either side of a frame
+    
+    @param parm: hou.Parm to key
+    @param frame: Frame to key at
+    @param blend: 0 for the previous key's value, 1 for the next
+    @param curve: Snapshot of the parm's keys from keycurve_hou.read_values. Pass the same
+                  snapshot for every key of a blend, so neighbours are always the original
+                  values whatever order the keys are tweened in. Read from the parm if not given
+    @param writer: BreakdownWriter to queue the key on. The key is set straight away if not given
+    @param keys: The hou.Keyframes the curve was read from, read from the parm if not given
+    """
+    if curve is None:
+        keys = parm.keyframes()
+        curve = keycurve_hou.read_values(parm, keys)
+    elif keys is None:
+        keys = curve.keys if curve.keys is not None else parm.keyframes()
+    
+    previous, following, found = curve.neighbours([frame])
+    
+    if found[0]:
+        prev_val = curve.value[previous[0]]
+        next_val = curve.value[following[0]]
         
         # straight up lerp
         new_value = prev_val * (1 - blend) + next_val * blend
         
         # or eval curve at a blended time
-        # eval_frame = previous.frame() * (1 - blend) + next.frame() * blend
+        # eval_frame = curve.frame[previous[0]] * (1 - blend) + curve.frame[following[0]] * blend
         # new_value = parm.evalAtFrame(eval_frame)
         
-        hou.hscript('chkey -f %f -v %f -T "amvAMV" -o "amvAMV" %s' % (frame, new_value, parm.path()))
+        key = breakdown_key(curve, keys, frame)
+        key.setValue(float(new_value))
+        if writer is None:
+            keyedit.set_keyframes(parm, [key])
+        else:
+            writer.add(parm, key)
+
+
+# blend modes
+#  linear:  straight lerp between the previous and next key values
+#  curve:   curve value at the blended time between the previous and next keys
+#  ease:    lerp with the blend eased in and out
+#  default: lerp from the current value to the parm's default
+#  rest:    lerp from the current value to the value at a rest frame
+MODES = ('linear', 'curve', 'ease', 'default', 'rest')
+
+
+class TweenTarget(object):
+    """
+    Breakdown frames on one parm, with the key values either side of them
+    
+    @ivar parm: hou.Parm
+    @ivar frames: Frames to key, only those with a key either side
+    @ivar prev_frames: Time of the key before each frame
+    @ivar next_frames: Time of the key after each frame
+    @ivar prev_values: Value of the key before each frame
+    @ivar next_values: Value of the key after each frame
+    @ivar original: Value at each frame before tweening
+    @ivar had_key: True where the frame already had a key
+    @ivar keys: hou.Keyframe to set at each frame, see breakdown_key
+    @ivar curve: Full KeyCurve snapshot for the modes that evaluate the curve, or None
+    @ivar target: Value blended towards at 1 by the default and rest modes
+    @ivar saved: Full KeyCurve of the parm as it was, for restoring, or None
+    """
+    
+    __slots__ = ('parm', 'frames', 'prev_frames', 'next_frames', 'prev_values', 'next_values',
+                 'original', 'had_key', 'keys', 'curve', 'target', 'saved')
+
+
+class TweenSnapshot(object):
+    """
+    Breakdown frames and the key values either side of them, read once
+    
+    Blending from a snapshot always starts from the original neighbours, so
+    the same snapshot can be applied over and over (eg. while dragging the
+    slider) without each pass building on the last. Every mode is worked out
+    on whole arrays per parm, only the curve evaluation falls back to
+    evalAtFrame for segments keyeval can't do.
+    
+    @ivar mode: One of MODES
+    @ivar targets: List of TweenTarget
+    """
+    
+    def __init__(self, frames, mode='linear', rest_frame=None, curves=None):
+        """
+        @param frames: Dict of hou.Parm to the frames to tween on it
+        @param mode: One of MODES
+        @param rest_frame: Frame holding the rest pose for the rest mode. Defaults to
+                           the start of the playbar range
+        @param curves: Dict of hou.Parm to its KeyCurve from keycurve_hou.read_parm, if
+                       already read. Needed for restore
+        """
+        if mode not in MODES:
+            raise ValueError("unknown tween mode %r, expected one of %s" % (mode, ', '.join(MODES)))
+        if mode == 'rest' and rest_frame is None:
+            rest_frame = hou.playbar.frameRange()[0]
+        
+        self.mode = mode
+        self.fps = hou.fps()
+        self.targets = []
+        for parm, parm_frames in frames.items():
+            # slopes and expressions only matter when the curve gets evaluated
+            # or the keys are to be restored
+            saved = curves.get(parm) if curves is not None else None
+            if saved is not None:
+                curve = saved.sorted()
+                keys = curve.keys
+            elif mode in ('curve', 'rest'):
+                curve = keycurve_hou.read_parm(parm).sorted()
+                keys = curve.keys
+            else:
+                keys = parm.keyframes()
+                curve = keycurve_hou.read_values(parm, keys)
+            parm_frames = np.asarray(parm_frames, dtype=np.float64)
+            previous, following, found = curve.neighbours(parm_frames)
+            if not found.any():
+                continue
+            
+            target = TweenTarget()
+            target.parm = parm
+            target.frames = parm_frames[found]
+            target.prev_frames = curve.frame[previous[found]]
+            target.next_frames = curve.frame[following[found]]
+            target.prev_values = curve.value[previous[found]]
+            target.next_values = curve.value[following[found]]
+            
+            pos = np.clip(np.searchsorted(curve.frame, target.frames), 0, len(curve) - 1)
+            target.had_key = curve.frame[pos] == target.frames
+            target.keys = [breakdown_key(curve, keys, frame) for frame in target.frames]
+            target.curve = curve if mode in ('curve', 'rest') else None
+            target.saved = saved
+            target.original = curve.value[pos]
+            if not target.had_key.all():
+                # between keys the current value comes off the curve
+                target.original = np.where(target.had_key, target.original,
+                                           self._evaluate(target, target.frames, curve))
+            
+            if mode == 'default':
+                target.target = parm.parmTemplate().defaultValue()[parm.componentIndex()]
+            elif mode == 'rest':
+                target.target = self._evaluate(target, [rest_frame])[0]
+            self.targets.append(target)
+    
+    
+    def __len__(self):
+        return sum(len(target.frames) for target in self.targets)
+    
+    
+    def _evaluate(self, target, frames, curve=None):
+        """
+        Curve values at some frames, asking the parm for anything keyeval can't do
+        """
+        frames = np.asarray(frames, dtype=np.float64)
+        if curve is None:
+            curve = target.curve
+        if curve is None or curve.keys is None:
+            # a values only snapshot, no slopes or segment functions to go on
+            return np.array([target.parm.evalAtFrame(f) for f in frames])
+        
+        values = np.array(keyeval.evaluate(curve, frames, self.fps))
+        missing = np.isnan(values).nonzero()[0]
+        for i in missing:
+            values[i] = target.parm.evalAtFrame(frames[i])
+        return values
+    
+    
+    def values(self, target, blend):
+        """
+        Breakdown values for one target
+        
+        @param blend: 0 for the previous key (or current value), 1 for the next key (or
+                      default / rest value). Values outside 0 - 1 overshoot
+        @return: Array of values, one per target frame
+        """
+        if self.mode == 'curve':
+            times = target.prev_frames * (1 - blend) + target.next_frames * blend
+            return self._evaluate(target, times)
+        
+        if self.mode in ('default', 'rest'):
+            return target.original * (1 - blend) + target.target * blend
+        
+        if self.mode == 'ease' and 0 <= blend <= 1:
+            blend = blend * blend * (3 - 2 * blend)
+        return target.prev_values * (1 - blend) + target.next_values * blend
+    
+    
+    def apply(self, blend, writer):
+        """
+        Queue a breakdown for every frame
+        
+        @param blend: See values()
+        @param writer: BreakdownWriter to queue the keys on
+        """
+        for target in self.targets:
+            for key, value in zip(target.keys, self.values(target, blend)):
+                key.setValue(float(value))
+                writer.add(target.parm, key)
+    
+    
+    def restore(self):
+        """
+        Put the keys back the way they were when the snapshot was taken
+        
+        Every key of each tweened parm is replaced from its saved curve, so
+        slopes, accels, auto slopes and expressions all come back along with
+        the values. The snapshot must have been made with curves.
+        """
+        for target in self.targets:
+            if target.saved is None:
+                raise RuntimeError("can't restore %s, the snapshot has no saved curve" % target.parm.path())
+            keyedit.replace_keyframes(target.parm, keycurve_hou.to_keyframes(target.saved))
+            keytrace.add_keys(len(target.saved))
 
 
 class TweenMachineUi(QtWidgets.QDialog):
+    # milliseconds between live updates while dragging the slider, ~60Hz
+    DRAG_INTERVAL = 16
+    
+    # blend mode, see MODES
+    mode = 'linear'
+    # rest pose frame for the rest mode, None for the start of the playbar
+    rest_frame = None
+    
     def __init__(self):
         super(TweenMachineUi, self).__init__(hou.ui.mainQtWindow())
         
@@ -66,6 +350,20 @@ class TweenMachineUi(QtWidgets.QDialog):
         self.blendSlider.setTickPosition(QtWidgets.QSlider.TicksBelow)
         main_layout.addWidget(self.blendSlider)
         
+        # live blending while the slider is dragged. value changes only mark
+        # the latest blend as pending, the timer applies it at most every
+        # DRAG_INTERVAL ms
+        self.drag_snapshot = None
+        self.drag_pending = None
+        self.drag_moved = False
+        self.drag_timer = QtCore.QTimer(self)
+        self.drag_timer.setSingleShot(True)
+        self.drag_timer.setInterval(self.DRAG_INTERVAL)
+        self.drag_timer.timeout.connect(self.drag_apply)
+        self.blendSlider.sliderPressed.connect(self.drag_start)
+        self.blendSlider.valueChanged.connect(self.slider_moved)
+        self.blendSlider.sliderReleased.connect(self.slider_released)
+        
         quick_layout = QtWidgets.QHBoxLayout()
         self.quick_buttons = []
         for i in range(7):
@@ -82,11 +380,48 @@ class TweenMachineUi(QtWidgets.QDialog):
         
         main_layout.addLayout(quick_layout)
         
+        options_layout = QtWidgets.QHBoxLayout()
+        self.mode_combo = QtWidgets.QComboBox()
+        self.mode_combo.addItems(MODES)
+        self.mode_combo.currentIndexChanged.connect(self.mode_changed)
+        options_layout.addWidget(QtWidgets.QLabel('Mode'))
+        options_layout.addWidget(self.mode_combo)
+        
+        self.rest_spin = QtWidgets.QSpinBox()
+        self.rest_spin.setRange(-100000, 100000)
+        self.rest_spin.setValue(int(hou.playbar.frameRange()[0]))
+        self.rest_spin.setEnabled(False)
+        self.rest_spin.valueChanged.connect(self.rest_frame_changed)
+        options_layout.addWidget(QtWidgets.QLabel('Rest frame'))
+        options_layout.addWidget(self.rest_spin)
+        
+        self.overshoot_chk = QtWidgets.QCheckBox('Overshoot')
+        self.overshoot_chk.stateChanged.connect(self.overshoot_changed)
+        options_layout.addWidget(self.overshoot_chk)
+        main_layout.addLayout(options_layout)
+        
         self.blendButton = QtWidgets.QPushButton("Blend")
         self.blendButton.clicked.connect(self.slider_blend)
         main_layout.addWidget(self.blendButton)
     
     
+    def mode_changed(self, index):
+        self.mode = MODES[index]
+        self.rest_spin.setEnabled(self.mode == 'rest')
+    
+    
+    def rest_frame_changed(self, value):
+        self.rest_frame = value
+    
+    
+    def overshoot_changed(self, state):
+        # overshoot lets the slider go half as far again past either key
+        if self.overshoot_chk.isChecked():
+            self.blendSlider.setRange(-50, 150)
+        else:
+            self.blendSlider.setRange(0, 100)
+    
+    
     def quick_blend(self, blend):
         self.blendSlider.setValue(int(blend * 100))
         self.blend(blend)
@@ -97,31 +432,112 @@ class TweenMachineUi(QtWidgets.QDialog):
         self.blend(blend)
     
     
-    def blend(self, blend):
-        animEdit = None
-        for pane in hou.ui.currentPaneTabs():
-            if pane.type() == hou.paneTabType.ChannelEditor:
-                animEdit = pane
-        
-        if animEdit:
-            graph = animEdit.graph()
-            keyframes = graph.selectedKeyframes()
-            # if there are keyframes selected
-            # tween those
-            if keyframes:
-                for parm in keyframes.keys():
-                    for key in keyframes[parm]:
-                        tween(parm, key.frame(), blend)
-                return
+    def slider_moved(self, value):
+        if self.drag_snapshot is None:
+            return
+        self.drag_pending = float(value) / 100.0
+        self.drag_moved = True
+        if not self.drag_timer.isActive():
+            self.drag_timer.start()
+    
+    
+    def slider_released(self):
+        self.drag_timer.stop()
+        if not self.drag_moved:
+            # pressed and let go without moving, nothing has been written
+            self.drag_snapshot = None
+            self.drag_pending = None
+            return
+        self.drag_finish(float(self.blendSlider.value()) / 100.0)
+    
+    
+    def drag_start(self):
+        """
+        Snapshot the keys to tween at the start of a slider drag
+        """
+        frames = self.tween_frames()
+        curves = dict((parm, keycurve_hou.read_parm(parm)) for parm in frames)
+        self.drag_snapshot = TweenSnapshot(frames, self.mode, self.rest_frame, curves)
+        self.drag_pending = None
+        self.drag_moved = False
+    
+    
+    def drag_apply(self):
+        """
+        Apply the latest blend from the drag snapshot
+        
+        Each parm's keys are set in one go from the snapshot, see
+        BreakdownWriter. Live updates skip the undo queue - drag_finish
+        records the drag as a single undo entry.
+        """
+        if self.drag_snapshot is None or self.drag_pending is None:
+            return
+        
+        writer = BreakdownWriter()
+        with hou.undos.disabler():
+            self.drag_snapshot.apply(self.drag_pending, writer)
+            writer.flush()
+        self.drag_pending = None
+    
+    
+    def drag_finish(self, blend):
+        """
+        Commit the final blend of a drag as one undo entry
+        """
+        snapshot = self.drag_snapshot
+        self.drag_snapshot = None
+        self.drag_pending = None
+        if snapshot is None:
+            return
+        
+        # only the parms with keys either side of a frame get tweened
+        targets = snapshot.targets
+        snapshots.capture('tweenmachine', [t.parm for t in targets], [t.saved for t in targets])
+        
+        # put the keys back quietly, so undoing the drag goes right back to
+        # where it started
+        with hou.undos.disabler():
+            snapshot.restore()
+        
+        writer = BreakdownWriter()
+        with writer.timing(), keyedit.transaction('tweenmachine'):
+            with keytrace.phase('compute'):
+                snapshot.apply(blend, writer)
+                writer.flush()
+        keytrace.log('tweenmachine:', writer)
+    
+    
+    def tween_frames(self):
+        """
+        The frames to tween on each parm
+        
+        Selected keys in the animation editor if there are any, otherwise
+        the scoped and visible channels at the current frame.
+        
+        @return: Dict of hou.Parm to list of frames
+        """
+        keyframes = scope_resolver.selected_keyframes()
+        # if there are keyframes selected
+        # tween those
+        if keyframes:
+            return dict((parm, [key.frame() for key in keys]) for parm, keys in keyframes.items())
         
         # otherwise, just use the scoped / visible channels at the current time
-        scope = hou.hscript("chscope")[0]
-        for x in scope.split():
-            chan = hou.parm(x)
-            # only operate on channels that are visible in the graph editor
-            if chan.isSelected():
-                with hou.undos.group('tweenmachine'):
-                    tween(chan, hou.frame(), blend)
+        frame = hou.frame()
+        return dict((chan, [frame]) for chan in scope_resolver.scoped_parms())
+    
+    
+    def blend(self, blend):
+        writer = BreakdownWriter()
+        with writer.timing(), keyedit.transaction('tweenmachine'):
+            with keytrace.phase('gather'):
+                frames = self.tween_frames()
+                snapshot = TweenSnapshot(frames, self.mode, self.rest_frame)
+                snapshots.capture('tweenmachine', [target.parm for target in snapshot.targets])
+            with keytrace.phase('compute'):
+                snapshot.apply(blend, writer)
+                writer.flush()
+        keytrace.log('tweenmachine:', writer)
 
 
 # x = TweenMachineUi()